@@ -218,6 +218,8 @@ def get_params() -> AttributeDict:
             "lr_factor": 5.0,
             "warm_step": 80000,
             "use_pruned_intersect": False,
+            # If True, intersect num and den graphs with a single call
+            "use_fused_intersect": False,
             "den_scale": 1.0,
             "env_info": get_env_info(),
         }
@@ -368,6 +370,7 @@ def compute_loss(
         graph_compiler=graph_compiler,
         den_scale=params.den_scale,
         use_pruned_intersect=params.use_pruned_intersect,
+        use_fused_intersect=params.use_fused_intersect,
     )
 
     mmi_loss = loss_fn(dense_fsa_vec=dense_fsa_vec, texts=texts)
@@ -883,8 +883,9 @@ def main():
             str(params.lang_dir / lm_filename),
             backoff_id=params.backoff_id,
             is_binary=False,
+            compiled_filename=str(params.lang_dir / f"{lm_filename}.npz"),
         )
-        logging.info(f"num states: {ngram_lm.lm.num_states}")
+        logging.info(f"num states: {ngram_lm.num_states}")
         ngram_lm_scale = params.ngram_lm_scale
     else:
         ngram_lm = None
@@ -127,6 +127,29 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--exact-kbest",
+        type=str2bool,
+        default=False,
+        help="""True to use the num_paths best distinct word sequences of
+        the lattice for n-best based decoding methods instead of sampling
+        num_paths paths. Used only when "method" is one of the following
+        values: nbest, nbest-rescoring, attention-decoder, and rnn-lm
+        """,
+    )
+
+    parser.add_argument(
+        "--rescore-max-arcs",
+        type=int,
+        default=0,
+        help="""If positive, the expected maximum number of arcs of the
+        lattice after whole-lattice rescoring with G. The lattice is pruned
+        before rescoring to fit it, instead of after running out of memory.
+        Used only when "method" is one of the following values:
+        whole-lattice-rescoring, attention-decoder, and rnn-lm
+        """,
+    )
+
     parser.add_argument(
         "--exp-dir",
         type=str,
@@ -384,6 +407,7 @@ def decode_one_batch(
                 num_paths=params.num_paths,
                 use_double_scores=params.use_double_scores,
                 nbest_scale=params.nbest_scale,
+                exact_kbest=params.exact_kbest,
             )
             key = f"no_rescore-nbest-scale-{params.nbest_scale}-{params.num_paths}"  # noqa
 
@@ -409,12 +433,14 @@ def decode_one_batch(
             num_paths=params.num_paths,
             lm_scale_list=lm_scale_list,
             nbest_scale=params.nbest_scale,
+            exact_kbest=params.exact_kbest,
         )
     elif params.method == "whole-lattice-rescoring":
         best_path_dict = rescore_with_whole_lattice(
             lattice=lattice,
             G_with_epsilon_loops=G,
             lm_scale_list=lm_scale_list,
+            max_arcs=params.rescore_max_arcs or None,
         )
     elif params.method == "attention-decoder":
         # lattice uses a 3-gram Lm. We rescore it with a 4-gram LM.
@@ -422,6 +448,7 @@ def decode_one_batch(
             lattice=lattice,
             G_with_epsilon_loops=G,
             lm_scale_list=None,
+            max_arcs=params.rescore_max_arcs or None,
         )
 
         best_path_dict = rescore_with_attention_decoder(
@@ -433,6 +460,7 @@ def decode_one_batch(
             sos_id=sos_id,
             eos_id=eos_id,
             nbest_scale=params.nbest_scale,
+            exact_kbest=params.exact_kbest,
         )
     elif params.method == "rnn-lm":
         # lattice uses a 3-gram Lm. We rescore it with a 4-gram LM.
@@ -440,6 +468,7 @@ def decode_one_batch(
             lattice=lattice,
             G_with_epsilon_loops=G,
             lm_scale_list=None,
+            max_arcs=params.rescore_max_arcs or None,
         )
 
         best_path_dict = rescore_with_rnn_lm(
@@ -453,6 +482,7 @@ def decode_one_batch(
             eos_id=eos_id,
             blank_id=0,
             nbest_scale=params.nbest_scale,
+            exact_kbest=params.exact_kbest,
         )
     else:
         assert False, f"Unsupported decoding method: {params.method}"
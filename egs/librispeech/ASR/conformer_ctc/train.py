@@ -30,9 +30,10 @@ Usage:
 
 import argparse
 import logging
+import time
 from pathlib import Path
 from shutil import copyfile
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import k2
 import torch
@@ -53,6 +54,7 @@ from icefall.checkpoint import load_checkpoint
 from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
+from icefall.fsa_cache import FsaCache
 from icefall.graph_compiler import CtcTrainingGraphCompiler
 from icefall.lexicon import Lexicon
 from icefall.utils import (
@@ -159,6 +161,24 @@ def get_parser():
         help="The seed for random generators intended for reproducibility",
     )
 
+    parser.add_argument(
+        "--graph-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache up to this number of training graphs in
+        memory, so that the graph of a transcript is compiled only once
+        instead of once per epoch.""",
+    )
+
+    parser.add_argument(
+        "--graph-cache-dir",
+        type=str,
+        default=None,
+        help="""If given together with --graph-cache-size, training graphs
+        are also saved to this directory and loaded from it in later runs.
+        Remove it if the lang dir is changed.""",
+    )
+
     return parser
 
 
@@ -346,6 +366,7 @@ def compute_loss(
     batch: dict,
     graph_compiler: BpeCtcTrainingGraphCompiler,
     is_training: bool,
+    compile_times: Optional[List[float]] = None,
 ) -> Tuple[Tensor, MetricsTracker]:
     """
     Compute CTC loss given the model and its inputs.
@@ -366,6 +387,9 @@ def compute_loss(
         True for training. False for validation. When it is True, this
         function enables autograd during computation; when it is False, it
         disables autograd.
+      compile_times:
+        If not None, the time in seconds of compiling the training graphs
+        of this batch is appended to it.
     """
     device = graph_compiler.device
     feature = batch["inputs"]
@@ -385,6 +409,7 @@ def compute_loss(
         supervisions, subsampling_factor=params.subsampling_factor
     )
 
+    start = time.time()
     if isinstance(graph_compiler, BpeCtcTrainingGraphCompiler):
         # Works with a BPE model
         token_ids = graph_compiler.texts_to_ids(texts)
@@ -394,6 +419,8 @@ def compute_loss(
         decoding_graph = graph_compiler.compile(texts)
     else:
         raise ValueError(f"Unsupported type of graph compiler: {type(graph_compiler)}")
+    if compile_times is not None:
+        compile_times.append(time.time() - start)
 
     dense_fsa_vec = k2.DenseFsaVec(
         nnet_output,
@@ -526,6 +553,9 @@ def train_one_epoch(
     model.train()
 
     tot_loss = MetricsTracker()
+    # Time of compiling the training graphs of each batch. With a graph
+    # cache, it should drop after the first epoch.
+    compile_times = []
 
     for batch_idx, batch in enumerate(train_dl):
         params.batch_idx_train += 1
@@ -537,6 +567,7 @@ def train_one_epoch(
             batch=batch,
             graph_compiler=graph_compiler,
             is_training=True,
+            compile_times=compile_times,
         )
         # summary stats
         tot_loss = (tot_loss * (1 - 1 / params.reset_interval)) + loss_info
@@ -580,6 +611,18 @@ def train_one_epoch(
                     tb_writer, "train/valid_", params.batch_idx_train
                 )
 
+    if len(compile_times) > 0:
+        mean_compile_time = sum(compile_times) / len(compile_times)
+        logging.info(
+            f"Epoch {params.cur_epoch}, graph compilation: "
+            f"{mean_compile_time * 1000:.2f} ms per batch on average "
+            f"over {len(compile_times)} batches"
+        )
+        if tb_writer is not None:
+            tb_writer.add_scalar(
+                "train/graph_compile_ms", mean_compile_time * 1000, params.cur_epoch
+            )
+
     loss_value = tot_loss["loss"] / tot_loss["frames"]
     params.train_loss = loss_value
     if params.train_loss < params.best_train_loss:
@@ -623,12 +666,19 @@ def run(rank, world_size, args):
     if torch.cuda.is_available():
         device = torch.device("cuda", rank)
 
+    graph_cache = None
+    if params.graph_cache_size > 0:
+        graph_cache = FsaCache(
+            max_size=params.graph_cache_size, cache_dir=params.graph_cache_dir
+        )
+
     if "lang_bpe" in str(params.lang_dir):
         graph_compiler = BpeCtcTrainingGraphCompiler(
             params.lang_dir,
             device=device,
             sos_token="<sos/eos>",
             eos_token="<sos/eos>",
+            graph_cache=graph_cache,
         )
     elif "lang_phone" in str(params.lang_dir):
         assert params.att_rate == 0, (
@@ -645,6 +695,7 @@ def run(rank, world_size, args):
         graph_compiler = CtcTrainingGraphCompiler(
             lexicon,
             device=device,
+            graph_cache=graph_cache,
         )
         # Manually add the sos/eos ID with their default values
         # from the BPE recipe which we're adapting here.
@@ -744,6 +795,10 @@ def run(rank, world_size, args):
             world_size=world_size,
         )
 
+        if graph_cache is not None:
+            graph_cache.flush()
+            logging.info(f"{graph_cache}")
+
         save_checkpoint(
             params=params,
             model=model,
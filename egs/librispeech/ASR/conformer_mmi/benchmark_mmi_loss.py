@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script benchmarks LFMMILoss with random network outputs and random
+transcripts. For each batch size, it reports the time of computing the loss
+and its gradient and, on GPU, the peak memory, for:
+
+  - exact: the den graph is replicated for each utterance by the graph
+    compiler and intersected separately from the num graphs
+  - fused: the den graph is copied for each utterance in the same call
+    that reorders the num graphs, and both are intersected with a single
+    call (use_fused_intersect=True)
+  - pruned: a single den graph is shared by the batch and intersected with
+    pruning (use_pruned_intersect=True)
+
+It also checks that the losses of "exact" and "fused" are the same.
+
+Usage:
+
+    cd icefall/egs/librispeech/ASR
+    ./conformer_mmi/benchmark_mmi_loss.py \
+      --lang-dir ./data/lang_bpe_500 \
+      --batch-sizes 1,2,4,8,16,32
+"""
+
+import argparse
+import logging
+import random
+import time
+from pathlib import Path
+from typing import List
+
+import k2
+import torch
+
+from icefall.mmi import LFMMILoss
+from icefall.mmi_graph_compiler import MmiTrainingGraphCompiler
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--lang-dir",
+        type=Path,
+        default=Path("data/lang_bpe_500"),
+        help="It should contain lexicon.txt, tokens.txt, words.txt and P.fst.txt",
+    )
+
+    parser.add_argument(
+        "--batch-sizes",
+        type=str,
+        default="1,2,4,8,16,32",
+        help="Comma separated batch sizes",
+    )
+
+    parser.add_argument(
+        "--num-frames",
+        type=int,
+        default=250,
+        help="Number of frames of the network output, i.e., after subsampling",
+    )
+
+    parser.add_argument(
+        "--num-words",
+        type=int,
+        default=15,
+        help="Number of words of each transcript",
+    )
+
+    parser.add_argument(
+        "--beam-size",
+        type=float,
+        default=8.0,
+    )
+
+    parser.add_argument(
+        "--num-iters",
+        type=int,
+        default=3,
+        help="Number of runs averaged for each batch size",
+    )
+
+    return parser
+
+
+def compute_loss(
+    loss_fn: LFMMILoss,
+    nnet_output: torch.Tensor,
+    texts: List[str],
+) -> torch.Tensor:
+    nnet_output = nnet_output.detach().requires_grad_(True)
+    batch_size, num_frames, _ = nnet_output.shape
+    supervision_segments = torch.tensor(
+        [[i, 0, num_frames] for i in range(batch_size)], dtype=torch.int32
+    )
+    dense_fsa_vec = k2.DenseFsaVec(nnet_output, supervision_segments)
+    loss = loss_fn(dense_fsa_vec=dense_fsa_vec, texts=texts)
+    loss.backward()
+    return loss.detach()
+
+
+def benchmark(
+    args: argparse.Namespace,
+    graph_compiler: MmiTrainingGraphCompiler,
+    words: List[str],
+    device: torch.device,
+):
+    num_classes = max(graph_compiler.lexicon.tokens) + 1
+    methods = {
+        "exact": dict(use_pruned_intersect=False, use_fused_intersect=False),
+        "fused": dict(use_pruned_intersect=False, use_fused_intersect=True),
+        "pruned": dict(use_pruned_intersect=True),
+    }
+
+    for batch_size in map(int, args.batch_sizes.split(",")):
+        texts = [
+            " ".join(random.choices(words, k=args.num_words)) for _ in range(batch_size)
+        ]
+        nnet_output = torch.randn(
+            batch_size, args.num_frames, num_classes, device=device
+        ).log_softmax(dim=-1)
+
+        results = []
+        losses = dict()
+        for name, kwargs in methods.items():
+            loss_fn = LFMMILoss(
+                graph_compiler=graph_compiler,
+                beam_size=args.beam_size,
+                **kwargs,
+            )
+            # warm up
+            compute_loss(loss_fn, nnet_output, texts)
+
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+                torch.cuda.reset_peak_memory_stats(device)
+            start = time.time()
+            for _ in range(args.num_iters):
+                losses[name] = compute_loss(loss_fn, nnet_output, texts)
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+                peak = torch.cuda.max_memory_allocated(device) / 1024**2
+                peak = f"{peak:8.1f} MB"
+            else:
+                peak = "n/a"
+            elapsed = (time.time() - start) / args.num_iters
+            results.append(f"{name} {elapsed * 1000:8.2f} ms, peak {peak}")
+
+        assert torch.allclose(losses["exact"], losses["fused"]), losses
+
+        logging.info(f"batch_size={batch_size:3d}: " + "; ".join(results))
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    random.seed(20221017)
+    torch.manual_seed(20221017)
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    graph_compiler = MmiTrainingGraphCompiler(
+        args.lang_dir,
+        uniq_filename="lexicon.txt",
+        device=device,
+        oov="<UNK>",
+        sos_id=1,
+        eos_id=1,
+    )
+    logging.info(f"den graph num_arcs: {graph_compiler.ctc_topo_P.num_arcs}")
+
+    word_table = graph_compiler.lexicon.word_table
+    words = [w for w in word_table.symbols if not w.startswith(("<", "#", "!"))]
+
+    benchmark(args, graph_compiler, words, device)
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -200,6 +200,8 @@ def get_params() -> AttributeDict:
             "lr_factor": 5.0,
             "warm_step": 80000,
             "use_pruned_intersect": False,
+            # If True, intersect num and den graphs with a single call
+            "use_fused_intersect": False,
             "den_scale": 1.0,
             # use alignments before this number of batches
             "use_ali_until": 13000,
@@ -377,6 +379,7 @@ def compute_loss(
         loss_fn = LFMMILoss(
             graph_compiler=graph_compiler,
             use_pruned_intersect=params.use_pruned_intersect,
+            use_fused_intersect=params.use_fused_intersect,
             den_scale=params.den_scale,
             beam_size=params.beam_size,
         )
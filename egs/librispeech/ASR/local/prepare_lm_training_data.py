@@ -37,13 +37,30 @@ representation of a dict with the following format:
             together with 'words' and the bpe.model).
   'sentence_lengths' -> a 1-D torch.Tensor of dtype torch.int32, containing
             number of BPE tokens of each sentence.
+
+The input file is split into --num-jobs byte ranges, which are read by
+that number of processes. The word IDs are assigned in the order in which
+the words first appear in the file, as if it were read by one process.
+
+If --num-shards is larger than 1, the sentences are split into that number of
+consecutive shards, and shard i is saved to `lm_data.{i}.pt` if --lm-archive
+is `lm_data.pt`. Each shard has the above format and contains all the words.
+
+If --sort is true, the sentences of each archive are sorted by the number
+of BPE tokens in descending order, so there is no need to run
+./local/sort_lm_training_data.py on them.
 """
 
 import argparse
 import logging
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import List, Tuple
 
 import k2
+import numpy as np
 import sentencepiece as spm
 import torch
 
@@ -67,96 +84,218 @@ def get_args():
         help="""Path to output archive, e.g. data/bpe_500/lm_data.pt;
         look at the source of this script to see the format.""",
     )
+    parser.add_argument(
+        "--num-jobs",
+        type=int,
+        default=1,
+        help="Number of processes to read the input and to encode the words.",
+    )
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=1,
+        help="Number of output archives.",
+    )
+    parser.add_argument(
+        "--sort",
+        action="store_true",
+        help="If set, sort the sentences by length in descending order.",
+    )
 
     return parser.parse_args()
 
 
+def get_byte_ranges(filename: str, num_ranges: int) -> List[Tuple[int, int]]:
+    """Split a text file into byte ranges at line boundaries."""
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, num_ranges):
+            f.seek(max(size * i // num_ranges - 1, boundaries[-1]))
+            # Move to the beginning of the next line
+            f.readline()
+            boundaries.append(max(f.tell(), boundaries[-1]))
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_sentences(
+    filename: str, start: int, end: int
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Read the lines in the given byte range of a text file.
+
+    Returns:
+      Return a tuple (words, row_splits, values), where `words` contains
+      the words in the order in which they first appear, and the word IDs of
+      the i-th sentence, i.e., indexes into `words`, are
+      values[row_splits[i]:row_splits[i+1]].
+    """
+    word2index = dict()
+    # Use arrays instead of lists to save memory
+    row_splits = array("q", [0])
+    values = array("i")
+    with open(filename, "rb") as f:
+        f.seek(start)
+        # The byte range ends at a line boundary. See get_byte_ranges().
+        while f.tell() < end:
+            line_words = f.readline().decode("utf-8").split()
+            values.extend(word2index.setdefault(w, len(word2index)) for w in line_words)
+            row_splits.append(len(values))
+
+    return (
+        list(word2index.keys()),
+        np.frombuffer(row_splits, dtype=np.int64),
+        np.frombuffer(values, dtype=np.int32),
+    )
+
+
+_sp = None
+
+
+def init_sp(bpe_model: str):
+    global _sp
+    _sp = spm.SentencePieceProcessor()
+    _sp.load(bpe_model)
+
+
+def encode_words(words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Encode words with the BPE model loaded by :func:`init_sp`.
+
+    Returns:
+      Return a tuple (lengths, values), containing the number of tokens of
+      each word and the concatenated token IDs.
+    """
+    pieces = _sp.encode(words)
+    lengths = np.array([len(p) for p in pieces], dtype=np.int64)
+    values = np.fromiter(
+        (i for p in pieces for i in p), dtype=np.int32, count=int(lengths.sum())
+    )
+    return lengths, values
+
+
+def to_ragged(row_splits: np.ndarray, values: np.ndarray) -> k2.RaggedTensor:
+    shape = k2.ragged.create_ragged_shape2(
+        torch.from_numpy(row_splits.astype(np.int32)),
+        None,
+        values.size,
+    )
+    return k2.RaggedTensor(shape, torch.from_numpy(values.astype(np.int32)))
+
+
+def select_sentences(
+    row_splits: np.ndarray, values: np.ndarray, indexes: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (row_splits, values) of the sentences with the given indexes."""
+    lengths = row_splits[indexes + 1] - row_splits[indexes]
+    new_row_splits = np.zeros(indexes.size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_row_splits[1:])
+    # The position in `values` of each word of the selected sentences
+    offsets = np.repeat(row_splits[indexes] - new_row_splits[:-1], lengths)
+    positions = offsets + np.arange(new_row_splits[-1], dtype=np.int64)
+    return new_row_splits, values[positions]
+
+
 def main():
     args = get_args()
 
-    if Path(args.lm_archive).exists():
+    lm_archive = Path(args.lm_archive)
+    if args.num_shards > 1:
+        archives = [
+            lm_archive.with_name(f"{lm_archive.stem}.{i}{lm_archive.suffix}")
+            for i in range(args.num_shards)
+        ]
+    else:
+        archives = [lm_archive]
+
+    if all(a.exists() for a in archives):
         logging.warning(f"{args.lm_archive} exists - skipping")
         return
 
-    sp = spm.SentencePieceProcessor()
-    sp.load(args.bpe_model)
+    num_jobs = max(1, args.num_jobs)
+    executor = None
+    if num_jobs > 1:
+        executor = ProcessPoolExecutor(
+            num_jobs, initializer=init_sp, initargs=(args.bpe_model,)
+        )
+        map_fn = executor.map
+    else:
+        init_sp(args.bpe_model)
+        map_fn = map
+
+    ranges = get_byte_ranges(args.lm_data, num_jobs)
+    logging.info(f"Reading {args.lm_data} with {num_jobs} jobs")
+    results = map_fn(
+        read_sentences,
+        [args.lm_data] * len(ranges),
+        [r[0] for r in ranges],
+        [r[1] for r in ranges],
+    )
 
     # word2index is a dictionary from words to integer ids.  No need to reserve
     # space for epsilon, etc.; the words are just used as a convenient way to
     # compress the sequences of BPE pieces.
     word2index = dict()
-
-    word2bpe = []  # Will be a list-of-list-of-int, representing BPE pieces.
-    sentences = []  # Will be a list-of-list-of-int, representing word-ids.
-
-    if "librispeech-lm-norm" in args.lm_data:
-        num_lines_in_total = 40418261.0
-        step = 5000000
-    elif "valid" in args.lm_data:
-        num_lines_in_total = 5567.0
-        step = 3000
-    elif "test" in args.lm_data:
-        num_lines_in_total = 5559.0
-        step = 3000
-    else:
-        num_lines_in_total = None
-        step = None
-
-    processed = 0
-
-    with open(args.lm_data) as f:
-        while True:
-            line = f.readline()
-            if line == "":
-                break
-
-            if step and processed % step == 0:
-                logging.info(
-                    f"Processed number of lines: {processed} "
-                    f"({processed/num_lines_in_total*100: .3f}%)"
-                )
-            processed += 1
-
-            line_words = line.split()
-            for w in line_words:
-                if w not in word2index:
-                    w_bpe = sp.encode(w)
-                    word2index[w] = len(word2bpe)
-                    word2bpe.append(w_bpe)
-            sentences.append([word2index[w] for w in line_words])
-
-    logging.info("Constructing ragged tensors")
-    words = k2.ragged.RaggedTensor(word2bpe)
-    sentences = k2.ragged.RaggedTensor(sentences)
-
-    output = dict(words=words, sentences=sentences)
-
-    num_sentences = sentences.dim0
-    logging.info(f"Computing sentence lengths, num_sentences: {num_sentences}")
-    sentence_lengths = [0] * num_sentences
-    for i in range(num_sentences):
-        if step and i % step == 0:
-            logging.info(
-                f"Processed number of lines: {i} ({i/num_sentences*100: .3f}%)"
-            )
-
-        word_ids = sentences[i]
-
-        # NOTE: If word_ids is a tensor with only 1 entry,
-        # token_ids is a torch.Tensor
-        token_ids = words[word_ids]
-        if isinstance(token_ids, k2.RaggedTensor):
-            token_ids = token_ids.values
-
-        # token_ids is a 1-D tensor containing the BPE tokens
-        # of the current sentence
-
-        sentence_lengths[i] = token_ids.numel()
-
-    output["sentence_lengths"] = torch.tensor(sentence_lengths, dtype=torch.int32)
-
-    torch.save(output, args.lm_archive)
-    logging.info(f"Saved to {args.lm_archive}")
+    all_row_splits = []
+    all_values = []
+    num_words = 0
+    for words, row_splits, values in results:
+        local_to_global = np.array(
+            [word2index.setdefault(w, len(word2index)) for w in words],
+            dtype=np.int32,
+        )
+        all_values.append(local_to_global[values])
+        all_row_splits.append(row_splits[1:] + num_words)
+        num_words += values.size
+
+    sentence_row_splits = np.concatenate([np.zeros(1, dtype=np.int64)] + all_row_splits)
+    sentence_values = np.concatenate(all_values)
+    num_sentences = sentence_row_splits.size - 1
+    logging.info(f"num_sentences: {num_sentences}, num_words: {len(word2index)}")
+
+    logging.info("Encoding words")
+    word_list = list(word2index.keys())
+    chunk_size = max(1, (len(word_list) + num_jobs - 1) // num_jobs)
+    chunks = [
+        word_list[i : i + chunk_size] for i in range(0, len(word_list), chunk_size)
+    ]
+    encoded = list(map_fn(encode_words, chunks))
+    if executor is not None:
+        executor.shutdown()
+
+    word_lengths = np.concatenate(
+        [np.zeros(1, dtype=np.int64)] + [lengths for lengths, _ in encoded]
+    )
+    word_row_splits = np.cumsum(word_lengths)
+    word_values = np.concatenate(
+        [np.zeros(0, dtype=np.int32)] + [values for _, values in encoded]
+    )
+    words = to_ragged(word_row_splits, word_values)
+
+    logging.info("Computing sentence lengths")
+    # Number of tokens of the words of all sentences
+    token_counts = np.cumsum(word_lengths[1:][sentence_values])
+    token_counts = np.concatenate([np.zeros(1, dtype=np.int64), token_counts])
+    sentence_lengths = (
+        token_counts[sentence_row_splits[1:]] - token_counts[sentence_row_splits[:-1]]
+    ).astype(np.int32)
+
+    boundaries = np.linspace(0, num_sentences, len(archives) + 1).astype(np.int64)
+    for filename, start, end in zip(archives, boundaries[:-1], boundaries[1:]):
+        indexes = np.arange(start, end, dtype=np.int64)
+        if args.sort:
+            order = np.argsort(-sentence_lengths[indexes], kind="stable")
+            indexes = indexes[order]
+
+        row_splits, values = select_sentences(
+            sentence_row_splits, sentence_values, indexes
+        )
+        output = dict(
+            words=words,
+            sentences=to_ragged(row_splits, values),
+            sentence_lengths=torch.from_numpy(sentence_lengths[indexes]),
+        )
+        torch.save(output, filename)
+        logging.info(f"Saved to {filename}")
 
 
 if __name__ == "__main__":
@@ -302,7 +302,8 @@ if [ $stage -le 11 ] && [ $stop_stage -ge 11 ]; then
     ./local/prepare_lm_training_data.py \
       --bpe-model $lang_dir/bpe.model \
       --lm-data $dl_dir/lm/librispeech-lm-norm.txt \
-      --lm-archive $out_dir/lm_data.pt
+      --lm-archive $out_dir/lm_data.pt \
+      --num-jobs $nj
   done
 fi
 
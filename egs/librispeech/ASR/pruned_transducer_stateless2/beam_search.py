@@ -26,6 +26,7 @@ from model import Transducer
 
 from icefall import NgramLm, NgramLmStateCost
 from icefall.decode import Nbest, one_best_decoding
+from icefall.decoder_cache import DecoderOutputCache
 from icefall.lm_wrapper import LmScorer
 from icefall.rnn_lm.model import RnnLmModel
 from icefall.transformer_lm.model import TransformerLM
@@ -612,6 +613,136 @@ def greedy_search_batch(
     return_timestamps: bool = False,
 ) -> Union[List[List[int]], DecodingResults]:
     """Greedy search in batch mode. It hardcodes --max-sym-per-frame=1.
+
+    The emitted tokens and the decoder contexts are kept in tensors on the
+    device of the model, so there is no device-to-host copy per frame. The
+    results are copied to the host once at the end.
+
+    Args:
+      model:
+        The transducer model.
+      encoder_out:
+        Output from the encoder. Its shape is (N, T, C), where N >= 1.
+      encoder_out_lens:
+        A 1-D tensor of shape (N,), containing number of valid frames in
+        encoder_out before padding.
+      return_timestamps:
+        Whether to return timestamps.
+    Returns:
+      If return_timestamps is False, return the decoded result.
+      Else, return a DecodingResults object containing
+      decoded result and corresponding timestamps.
+    """
+    assert encoder_out.ndim == 3
+    assert encoder_out.size(0) >= 1, encoder_out.size(0)
+
+    packed_encoder_out = torch.nn.utils.rnn.pack_padded_sequence(
+        input=encoder_out,
+        lengths=encoder_out_lens.cpu(),
+        batch_first=True,
+        enforce_sorted=False,
+    )
+
+    device = next(model.parameters()).device
+
+    blank_id = model.decoder.blank_id
+    unk_id = getattr(model, "unk_id", blank_id)
+    context_size = model.decoder.context_size
+
+    batch_size_list = packed_encoder_out.batch_sizes.tolist()
+    N = encoder_out.size(0)
+    T = len(batch_size_list)
+    assert torch.all(encoder_out_lens > 0), encoder_out_lens
+    assert N == batch_size_list[0], (N, batch_size_list)
+
+    # The last context_size tokens of each hypothesis
+    contexts = torch.full((N, context_size), -1, device=device, dtype=torch.int64)
+    contexts[:, -1] = blank_id
+
+    # tokens[t, n] is the token decoded on frame t for the n-th sorted
+    # utterance. It is blank for frames after the end of the utterance.
+    tokens = torch.full((T, N), blank_id, device=device, dtype=torch.int64)
+
+    decoder_out = model.decoder(contexts, need_pad=False)
+    decoder_out = model.joiner.decoder_proj(decoder_out)
+    # decoder_out: (N, 1, decoder_out_dim)
+
+    encoder_out = model.joiner.encoder_proj(packed_encoder_out.data)
+
+    offset = 0
+    for (t, batch_size) in enumerate(batch_size_list):
+        start = offset
+        end = offset + batch_size
+        current_encoder_out = encoder_out.data[start:end]
+        current_encoder_out = current_encoder_out.unsqueeze(1).unsqueeze(1)
+        # current_encoder_out's shape: (batch_size, 1, 1, encoder_out_dim)
+        offset = end
+
+        decoder_out = decoder_out[:batch_size]
+        contexts = contexts[:batch_size]
+
+        logits = model.joiner(
+            current_encoder_out, decoder_out.unsqueeze(1), project_input=False
+        )
+        # logits'shape (batch_size, 1, 1, vocab_size)
+
+        logits = logits.squeeze(1).squeeze(1)  # (batch_size, vocab_size)
+        assert logits.ndim == 2, logits.shape
+        y = logits.argmax(dim=1)
+        mask = (y != blank_id) & (y != unk_id)
+        tokens[t, :batch_size] = y
+
+        # Update the decoder output of the rows that emitted a token. On
+        # other devices, we don't check whether any row emitted one, as it
+        # needs a sync.
+        if device.type == "cpu" and not mask.any():
+            continue
+        contexts = torch.where(
+            mask.unsqueeze(1),
+            torch.cat([contexts[:, 1:], y.unsqueeze(1)], dim=1),
+            contexts,
+        )
+        new_decoder_out = model.decoder(contexts, need_pad=False)
+        new_decoder_out = model.joiner.decoder_proj(new_decoder_out)
+        decoder_out = torch.where(
+            mask.unsqueeze(1).unsqueeze(2), new_decoder_out, decoder_out
+        )
+
+    tokens = tokens.t().cpu()
+    emitted = (tokens != blank_id) & (tokens != unk_id)
+
+    ans = []
+    ans_timestamps = []
+    unsorted_indices = packed_encoder_out.unsorted_indices.tolist()
+    for i in range(N):
+        n = unsorted_indices[i]
+        # timestamp[i] is the frame index after subsampling
+        # on which hyp[i] is decoded
+        timestamp = emitted[n].nonzero().squeeze(1)
+        ans.append(tokens[n, timestamp].tolist())
+        ans_timestamps.append(timestamp.tolist())
+
+    if not return_timestamps:
+        return ans
+    else:
+        return DecodingResults(
+            hyps=ans,
+            timestamps=ans_timestamps,
+        )
+
+
+def _greedy_search_batch_python_list(
+    model: Transducer,
+    encoder_out: torch.Tensor,
+    encoder_out_lens: torch.Tensor,
+    return_timestamps: bool = False,
+) -> Union[List[List[int]], DecodingResults]:
+    """Greedy search in batch mode. It hardcodes --max-sym-per-frame=1.
+
+    It is the previous implementation of :func:`greedy_search_batch`, which
+    keeps the hypotheses in Python lists and so copies the argmax to the host
+    for every frame. It is kept for testing and benchmarking.
+
     Args:
       model:
         The transducer model.
@@ -736,8 +867,9 @@ class Hypothesis:
     # the lm score for next token given the current ys
     lm_score: Optional[torch.Tensor] = None
 
-    # the RNNLM states (h and c in LSTM)
-    state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None
+    # the RNNLM states (h and c in LSTM), or the slot of the hypothesis
+    # in an LmStatePool
+    state: Optional[Union[Tuple[torch.Tensor, torch.Tensor], int]] = None
 
     # N-gram LM state
     state_cost: Optional[NgramLmStateCost] = None
@@ -879,6 +1011,447 @@ def get_hyps_shape(hyps: List[HypothesisList]) -> k2.RaggedShape:
     return ans
 
 
+# Base of the rolling hash used by HypothesisStore to represent `ys`.
+# The multiplication wraps around on int64 overflow.
+_HASH_BASE = 1000003
+
+
+class HypothesisStore(object):
+    """The hypotheses of a batch of utterances, kept in tensors.
+
+    It replaces `List[HypothesisList]` in :func:`modified_beam_search`,
+    where at most one symbol is emitted per frame and each utterance has
+    at most `beam` hypotheses. Instead of copying `ys` and `timestamp` of
+    every hypothesis on every frame, it keeps only the following for the
+    active hypotheses:
+
+      - `scores`: The log prob of each hypothesis, of shape (num_hyps,)
+      - `contexts`: The last `context_size` tokens of each hypothesis,
+        i.e., the decoder input, of shape (num_hyps, context_size)
+      - `lengths`: `len(ys)` of each hypothesis, of shape (num_hyps,)
+      - `hashes`: A rolling hash of `ys` of each hypothesis, of
+        shape (num_hyps,)
+
+    The hypotheses of utterance `i` are in the range
+    `[row_splits[i], row_splits[i+1])`.
+
+    For each frame, the token emitted by each hypothesis (-1 for blank)
+    and the index of the hypothesis it is extended from are written into
+    two preallocated tensors of shape (num_frames, batch_size * beam).
+    `ys` and `timestamp` of the best hypotheses are recovered from them
+    only once in :meth:`get_results`.
+
+    Two hypotheses of the same utterance are considered identical if their
+    `lengths` and `hashes` are equal. As in :meth:`HypothesisList.add`,
+    a duplicate is merged into the one that was added first using
+    `log-sum-exp`, so the results are the same as using `HypothesisList`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        beam: int,
+        context_size: int,
+        blank_id: int,
+        unk_id: int,
+        num_frames: int,
+        device: torch.device,
+    ) -> None:
+        """
+        Args:
+          batch_size:
+            Number of utterances.
+          beam:
+            Max number of hypotheses per utterance.
+          context_size:
+            Context size of the decoder.
+          blank_id:
+            The ID of the blank symbol.
+          unk_id:
+            The ID of the unk symbol. Like blank, it is not appended to `ys`.
+          num_frames:
+            Max number of frames, i.e., the number of calls to
+            :meth:`advance`.
+          device:
+            The device on which the tensors are allocated.
+        """
+        self.blank_id = blank_id
+        self.unk_id = unk_id
+        self.device = device
+
+        # Each utterance starts with a single hypothesis
+        # whose ys is [blank_id] * context_size
+        self.row_splits = list(range(batch_size + 1))
+        self.scores = torch.zeros(batch_size, dtype=torch.float32, device=device)
+        self.contexts = torch.full(
+            (batch_size, context_size),
+            blank_id,
+            dtype=torch.int64,
+            device=device,
+        )
+        self.lengths = torch.full(
+            (batch_size,), context_size, dtype=torch.int64, device=device
+        )
+        self.hashes = torch.zeros(batch_size, dtype=torch.int64, device=device)
+
+        self.tokens = torch.full(
+            (num_frames, batch_size * beam), -1, dtype=torch.int64, device=device
+        )
+        self.parents = torch.zeros(
+            (num_frames, batch_size * beam), dtype=torch.int64, device=device
+        )
+        self.num_frames = 0
+
+        # best_indexes[i] is the index of the best hypothesis of utterance i
+        # on frame last_frames[i]. They are set in `finalize()`.
+        self.best_indexes = [0] * batch_size
+        self.last_frames = [0] * batch_size
+
+    @property
+    def batch_size(self) -> int:
+        """Return the number of utterances that are not finalized yet."""
+        return len(self.row_splits) - 1
+
+    def get_shape(self) -> k2.RaggedShape:
+        """Return a ragged shape with axes [utt][num_hyps].
+        Note that the shape is on CPU. See also :func:`get_hyps_shape`.
+        """
+        row_splits = torch.tensor(self.row_splits, dtype=torch.int32)
+        return k2.ragged.create_ragged_shape2(
+            row_splits=row_splits, cached_tot_size=self.row_splits[-1]
+        )
+
+    def finalize(self, batch_size: int) -> None:
+        """Select the best hypothesis for utterances whose index is not less
+        than `batch_size` and remove them from the active hypotheses.
+
+        Args:
+          batch_size:
+            Number of utterances to keep.
+        """
+        if batch_size >= self.batch_size:
+            return
+
+        start = self.row_splits[batch_size]
+        # Length normalized, see HypothesisList.get_most_probable()
+        scores = self.scores[start:] / self.lengths[start:]
+        best_indexes = [
+            scores[self.row_splits[i] - start : self.row_splits[i + 1] - start].argmax()
+            for i in range(batch_size, self.batch_size)
+        ]
+        best_indexes = torch.stack(best_indexes).tolist()
+        for i, index in zip(range(batch_size, self.batch_size), best_indexes):
+            self.best_indexes[i] = self.row_splits[i] + index
+            self.last_frames[i] = self.num_frames - 1
+
+        self.row_splits = self.row_splits[: batch_size + 1]
+        self.scores = self.scores[:start]
+        self.contexts = self.contexts[:start]
+        self.lengths = self.lengths[:start]
+        self.hashes = self.hashes[:start]
+
+    def advance(
+        self,
+        topk_log_probs: torch.Tensor,
+        topk_indexes: torch.Tensor,
+        vocab_size: int,
+    ) -> None:
+        """Replace the active hypotheses with their top-k expansions on the
+        current frame.
+
+        Args:
+          topk_log_probs:
+            A 2-D tensor of shape (batch_size, k). topk_log_probs[i] contains
+            the log probs of the k best expansions of utterance i, sorted in
+            descending order.
+          topk_indexes:
+            A 2-D tensor of shape (batch_size, k). topk_indexes[i] contains
+            indexes into the flattened (num_hyps_of_utt_i, vocab_size)
+            log probs of utterance i.
+          vocab_size:
+            The vocabulary size.
+        """
+        assert topk_indexes.shape == topk_log_probs.shape, (
+            topk_indexes.shape,
+            topk_log_probs.shape,
+        )
+        assert topk_indexes.size(0) == self.batch_size, (
+            topk_indexes.size(0),
+            self.batch_size,
+        )
+        k = topk_indexes.size(1)
+        device = self.device
+
+        starts = torch.tensor(self.row_splits[:-1], dtype=torch.int64, device=device)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            hyp_indexes = topk_indexes // vocab_size + starts.unsqueeze(1)
+            tokens = topk_indexes % vocab_size
+        emitted = (tokens != self.blank_id) & (tokens != self.unk_id)
+
+        hashes = self.hashes[hyp_indexes]
+        hashes = torch.where(emitted, hashes * _HASH_BASE + tokens + 1, hashes)
+        lengths = self.lengths[hyp_indexes] + emitted
+
+        # same[i, j, m] is True if the j-th and the m-th expansions of
+        # utterance i have the same ys, where j <= m
+        same = (hashes.unsqueeze(2) == hashes.unsqueeze(1)) & (
+            lengths.unsqueeze(2) == lengths.unsqueeze(1)
+        )
+        same &= torch.ones(k, k, dtype=torch.bool, device=device).triu()
+
+        # firsts[i, m] is the index of the first expansion of utterance i
+        # that has the same ys as the m-th expansion
+        firsts = same.to(torch.int8).argmax(dim=1)
+        is_duplicate = firsts != torch.arange(k, device=device)
+
+        scores = topk_log_probs.clone()
+        if is_duplicate.any():
+            # Merge duplicates in the order they are added, like HypothesisList
+            columns = is_duplicate.any(dim=0).nonzero().squeeze(1).tolist()
+            for m in columns:
+                dst = firsts[:, m : m + 1]
+                old = scores.gather(1, dst)
+                merged = torch.logaddexp(old, scores[:, m : m + 1])
+                merged = torch.where(is_duplicate[:, m : m + 1], merged, old)
+                scores.scatter_(1, dst, merged)
+
+        keep = ~is_duplicate
+        row_splits = torch.cumsum(keep.sum(dim=1), dim=0)
+        self.row_splits = [0] + row_splits.tolist()
+
+        keep = keep.reshape(-1).nonzero().squeeze(1)
+        hyp_indexes = hyp_indexes.reshape(-1)[keep]
+        tokens = tokens.reshape(-1)[keep]
+        emitted = emitted.reshape(-1)[keep]
+
+        self.scores = scores.reshape(-1)[keep]
+        self.hashes = hashes.reshape(-1)[keep]
+        self.lengths = lengths.reshape(-1)[keep]
+
+        contexts = self.contexts[hyp_indexes]
+        self.contexts = torch.where(
+            emitted.unsqueeze(1),
+            torch.cat([contexts[:, 1:], tokens.unsqueeze(1)], dim=1),
+            contexts,
+        )
+
+        num_hyps = hyp_indexes.numel()
+        self.tokens[self.num_frames, :num_hyps] = tokens.masked_fill(~emitted, -1)
+        self.parents[self.num_frames, :num_hyps] = hyp_indexes
+        self.num_frames += 1
+
+    def get_results(self) -> Tuple[List[List[int]], List[List[int]]]:
+        """Finalize all utterances and return the best hypothesis of each.
+
+        Returns:
+          Return a tuple containing:
+            - The decoded tokens of each utterance, without the
+              initial blanks.
+            - The timestamps of each utterance, i.e., the frame index
+              on which each token is decoded.
+        """
+        self.finalize(0)
+
+        index = torch.tensor(self.best_indexes, dtype=torch.int64, device=self.device)
+        last_frames = torch.tensor(self.last_frames, device=self.device)
+
+        tokens = torch.empty(
+            (self.num_frames, index.numel()), dtype=torch.int64, device=self.device
+        )
+        for t in range(self.num_frames - 1, -1, -1):
+            active = last_frames >= t
+            tokens[t] = self.tokens[t, index].masked_fill(~active, -1)
+            index = torch.where(active, self.parents[t, index], index)
+
+        hyps = []
+        timestamps = []
+        for row in tokens.t().cpu():
+            timestamp = row.ge(0).nonzero().squeeze(1)
+            hyps.append(row[timestamp].tolist())
+            timestamps.append(timestamp.tolist())
+        return hyps, timestamps
+
+
+def topk_per_utterance(
+    log_probs: torch.Tensor,
+    hyps_shape: k2.RaggedShape,
+    beam: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Select the top-k expansions of all utterances with a single call
+    to `torch.topk()`.
+
+    It gives the same results as calling `ragged_log_probs[i].topk(beam)`
+    for each utterance i, where `ragged_log_probs` contains `log_probs`
+    with axes [utt][num_hyps*vocab_size]. The log probs of utterance i are
+    copied into row i of a tensor of shape (batch_size, beam * vocab_size)
+    that is padded with `-inf`.
+
+    Caution:
+      Each utterance must have at most `beam` hypotheses, which holds for
+      the modified beam search functions in this file as they keep the
+      top `beam` expansions of each utterance on every frame.
+
+    Args:
+      log_probs:
+        A 2-D tensor of shape (num_hyps, vocab_size).
+      hyps_shape:
+        A ragged shape with axes [utt][num_hyps]. It must be on the same
+        device as `log_probs`.
+      beam:
+        Number of expansions to keep for each utterance.
+    Returns:
+      Return a tuple containing two tensors of shape (batch_size, beam):
+        - topk_log_probs, the log probs of the top-k expansions of each
+          utterance, sorted in descending order.
+        - topk_indexes, indexes into the flattened log probs of shape
+          (num_hyps_of_utt_i, vocab_size) for row i.
+    """
+    assert log_probs.ndim == 2, log_probs.shape
+    num_hyps, vocab_size = log_probs.shape
+    batch_size = hyps_shape.dim0
+
+    row_splits = hyps_shape.row_splits(1).to(torch.int64)
+    row_ids = hyps_shape.row_ids(1).to(torch.int64)
+
+    # The index of each hypothesis within its utterance
+    hyp_indexes = torch.arange(num_hyps, device=log_probs.device) - row_splits[row_ids]
+
+    padded_log_probs = log_probs.new_full(
+        (batch_size * beam, vocab_size), float("-inf")
+    )
+    padded_log_probs.index_copy_(0, row_ids * beam + hyp_indexes, log_probs)
+    padded_log_probs = padded_log_probs.reshape(batch_size, beam * vocab_size)
+
+    return padded_log_probs.topk(beam, dim=1)
+
+
+class LmStatePool(object):
+    """The scores and states of a neural network LM for all hypotheses
+    on a frame, stored in batched tensors on the device.
+
+    A hypothesis refers to its LM state by its row (slot) in the pool,
+    i.e., `Hypothesis.state` is an int. On each frame, :meth:`advance`
+    gathers the rows of the parents of all expansions with a single
+    `index_select()`, and scores the non-blank expansions with a single
+    call to `LM.score_token()`.
+    """
+
+    def __init__(
+        self,
+        LM: LmScorer,
+        scores: torch.Tensor,
+        state: Tuple[torch.Tensor, torch.Tensor],
+    ):
+        """
+        Args:
+          LM:
+            The neural network LM. Its `lm_type` is either "rnn" or
+            "transformer".
+          scores:
+            A 2-D tensor of shape (num_slots, vocab_size), containing the
+            LM log probs of the next token of each slot.
+          state:
+            The LM states of all slots. For RNN LMs, it is the tuple (h, c)
+            of shape (num_layers, num_slots, hidden_dim). For transformer
+            LMs, it is the state returned by `TransformerLM.score_token()`.
+        """
+        self.LM = LM
+        self.scores = scores
+        self.state = state
+
+    @staticmethod
+    def from_sos(LM: LmScorer, sos_id: int, device: torch.device) -> "LmStatePool":
+        """Return a pool with a single slot, containing the LM state
+        after seeing the "sos" token."""
+        sos_token = torch.tensor([[sos_id]], dtype=torch.int64, device=device)
+        lens = torch.tensor([1], device=device)
+        scores, state = LM.score_token(sos_token, lens)
+        return LmStatePool(LM, scores=scores, state=state)
+
+    def _select_state(
+        self, state: Tuple[torch.Tensor, torch.Tensor], indexes: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.LM.lm_type == "rnn":
+            h, c = state
+            return h.index_select(1, indexes), c.index_select(1, indexes)
+        else:
+            return TransformerLM.select_states(state, indexes)
+
+    def _update_state(
+        self,
+        state: Tuple[torch.Tensor, torch.Tensor],
+        indexes: torch.Tensor,
+        new_state: Tuple[torch.Tensor, torch.Tensor],
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.LM.lm_type == "rnn":
+            h, c = state
+            new_h, new_c = new_state
+            return h.index_copy(1, indexes, new_h), c.index_copy(1, indexes, new_c)
+        else:
+            cached_kv, cached_padding_mask = state
+            new_cached_kv, new_cached_padding_mask = new_state
+            # Slots that are not scored are padded on the left
+            pad = new_cached_kv.size(1) - cached_kv.size(1)
+            cached_kv = torch.nn.functional.pad(cached_kv, (0, 0, 0, 0, pad, 0))
+            cached_padding_mask = torch.nn.functional.pad(
+                cached_padding_mask, (pad, 0), value=True
+            )
+            cached_kv = cached_kv.index_copy(2, indexes, new_cached_kv)
+            cached_padding_mask = cached_padding_mask.index_copy(
+                0, indexes, new_cached_padding_mask
+            )
+            # Remove positions that are padding for all slots
+            return TransformerLM.stack_states([(cached_kv, cached_padding_mask)])
+
+    def advance(
+        self,
+        parents: List[int],
+        scored: List[int],
+        tokens: List[int],
+    ) -> Tuple["LmStatePool", torch.Tensor]:
+        """Return the pool of the expansions on the next frame.
+
+        Args:
+          parents:
+            parents[j] is the slot of the parent hypothesis of the j-th
+            expansion, which is also the slot of the expansion in the
+            returned pool.
+          scored:
+            The expansions with a non-blank token, which are fed to the LM.
+          tokens:
+            tokens[j] is the new token of the expansion `scored[j]`.
+        Returns:
+          Return a tuple containing:
+            - The pool of the expansions.
+            - A 1-D tensor of shape (len(scored),), containing the LM log
+              prob of `tokens[j]` given the parent of `scored[j]`.
+        """
+        device = self.scores.device
+        parents = torch.tensor(parents, dtype=torch.int64, device=device)
+
+        scores = self.scores.index_select(0, parents)
+        state = self._select_state(self.state, parents)
+
+        if len(scored) == 0:
+            return LmStatePool(self.LM, scores=scores, state=state), scores[:0, 0]
+
+        scored = torch.tensor(scored, dtype=torch.int64, device=device)
+        tokens = torch.tensor(tokens, dtype=torch.int64, device=device)
+
+        token_log_probs = scores[scored, tokens]
+
+        lens = torch.ones_like(tokens)
+        new_scores, new_state = self.LM.score_token(
+            tokens.unsqueeze(1), lens, self._select_state(state, scored)
+        )
+
+        scores = scores.index_copy(0, scored, new_scores)
+        state = self._update_state(state, scored, new_state)
+
+        return LmStatePool(self.LM, scores=scores, state=state), token_log_probs
+
+
 def modified_beam_search(
     model: Transducer,
     encoder_out: torch.Tensor,
@@ -886,9 +1459,153 @@ def modified_beam_search(
     beam: int = 4,
     temperature: float = 1.0,
     return_timestamps: bool = False,
+    decoder_cache: Optional[DecoderOutputCache] = None,
 ) -> Union[List[List[int]], DecodingResults]:
     """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
 
+    The hypotheses are kept in a :class:`HypothesisStore`. It gives the same
+    results as :func:`_modified_beam_search_hypothesis_list`.
+
+    Args:
+      model:
+        The transducer model.
+      encoder_out:
+        Output from the encoder. Its shape is (N, T, C).
+      encoder_out_lens:
+        A 1-D tensor of shape (N,), containing number of valid frames in
+        encoder_out before padding.
+      beam:
+        Number of active paths during the beam search.
+      temperature:
+        Softmax temperature.
+      return_timestamps:
+        Whether to return timestamps.
+      decoder_cache:
+        If not None, it is used to look up the decoder output. If None,
+        a new one is created and shared by all frames of this batch.
+    Returns:
+      If return_timestamps is False, return the decoded result.
+      Else, return a DecodingResults object containing
+      decoded result and corresponding timestamps.
+    """
+    assert encoder_out.ndim == 3, encoder_out.shape
+    assert encoder_out.size(0) >= 1, encoder_out.size(0)
+
+    packed_encoder_out = torch.nn.utils.rnn.pack_padded_sequence(
+        input=encoder_out,
+        lengths=encoder_out_lens.cpu(),
+        batch_first=True,
+        enforce_sorted=False,
+    )
+
+    blank_id = model.decoder.blank_id
+    unk_id = getattr(model, "unk_id", blank_id)
+    context_size = model.decoder.context_size
+    device = next(model.parameters()).device
+
+    batch_size_list = packed_encoder_out.batch_sizes.tolist()
+    N = encoder_out.size(0)
+    assert torch.all(encoder_out_lens > 0), encoder_out_lens
+    assert N == batch_size_list[0], (N, batch_size_list)
+
+    if decoder_cache is None:
+        decoder_cache = DecoderOutputCache(model)
+
+    hyps = HypothesisStore(
+        batch_size=N,
+        beam=beam,
+        context_size=context_size,
+        blank_id=blank_id,
+        unk_id=unk_id,
+        num_frames=len(batch_size_list),
+        device=device,
+    )
+
+    encoder_out = model.joiner.encoder_proj(packed_encoder_out.data)
+
+    offset = 0
+    for (t, batch_size) in enumerate(batch_size_list):
+        start = offset
+        end = offset + batch_size
+        current_encoder_out = encoder_out.data[start:end]
+        current_encoder_out = current_encoder_out.unsqueeze(1).unsqueeze(1)
+        # current_encoder_out's shape is (batch_size, 1, 1, encoder_out_dim)
+        offset = end
+
+        hyps.finalize(batch_size)
+
+        hyps_shape = hyps.get_shape().to(device)
+
+        ys_log_probs = hyps.scores.unsqueeze(1)  # (num_hyps, 1)
+
+        decoder_out = decoder_cache.get(hyps.contexts)
+        decoder_out = decoder_out.unsqueeze(1).unsqueeze(1)
+        # decoder_out is of shape (num_hyps, 1, 1, joiner_dim)
+
+        # Note: For torch 1.7.1 and below, it requires a torch.int64 tensor
+        # as index, so we use `to(torch.int64)` below.
+        current_encoder_out = torch.index_select(
+            current_encoder_out,
+            dim=0,
+            index=hyps_shape.row_ids(1).to(torch.int64),
+        )  # (num_hyps, 1, 1, encoder_out_dim)
+
+        logits = model.joiner(
+            current_encoder_out,
+            decoder_out,
+            project_input=False,
+        )  # (num_hyps, 1, 1, vocab_size)
+
+        logits = logits.squeeze(1).squeeze(1)  # (num_hyps, vocab_size)
+
+        log_probs = (logits / temperature).log_softmax(dim=-1)  # (num_hyps, vocab_size)
+
+        log_probs.add_(ys_log_probs)
+
+        vocab_size = log_probs.size(-1)
+
+        topk_log_probs, topk_indexes = topk_per_utterance(
+            log_probs=log_probs, hyps_shape=hyps_shape, beam=beam
+        )  # (batch_size, beam)
+
+        hyps.advance(
+            topk_log_probs=topk_log_probs,
+            topk_indexes=topk_indexes,
+            vocab_size=vocab_size,
+        )
+
+    sorted_ans, sorted_timestamps = hyps.get_results()
+
+    ans = []
+    ans_timestamps = []
+    unsorted_indices = packed_encoder_out.unsorted_indices.tolist()
+    for i in range(N):
+        ans.append(sorted_ans[unsorted_indices[i]])
+        ans_timestamps.append(sorted_timestamps[unsorted_indices[i]])
+
+    if not return_timestamps:
+        return ans
+    else:
+        return DecodingResults(
+            hyps=ans,
+            timestamps=ans_timestamps,
+        )
+
+
+def _modified_beam_search_hypothesis_list(
+    model: Transducer,
+    encoder_out: torch.Tensor,
+    encoder_out_lens: torch.Tensor,
+    beam: int = 4,
+    temperature: float = 1.0,
+    return_timestamps: bool = False,
+) -> Union[List[List[int]], DecodingResults]:
+    """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
+
+    Each utterance keeps its hypotheses in a :class:`HypothesisList`.
+    It is slower than :func:`modified_beam_search`. We keep it only
+    for reference and benchmarking.
+
     Args:
       model:
         The transducer model.
@@ -1179,6 +1896,7 @@ def beam_search(
     beam: int = 4,
     temperature: float = 1.0,
     return_timestamps: bool = False,
+    decoder_cache: Optional[DecoderOutputCache] = None,
 ) -> Union[List[int], DecodingResults]:
     """
     It implements Algorithm 1 in https://arxiv.org/pdf/1211.3711.pdf
@@ -1196,6 +1914,9 @@ def beam_search(
         Softmax temperature.
       return_timestamps:
         Whether to return timestamps.
+      decoder_cache:
+        If not None, it is used to look up the decoder output. If None,
+        a new one is created for this utterance.
 
     Returns:
       If return_timestamps is False, return the decoded result.
@@ -1233,7 +1954,8 @@ def beam_search(
 
     sym_per_utt = 0
 
-    decoder_cache: Dict[str, torch.Tensor] = {}
+    if decoder_cache is None:
+        decoder_cache = DecoderOutputCache(model)
 
     while t < T and sym_per_utt < max_sym_per_utt:
         # fmt: off
@@ -1251,22 +1973,11 @@ def beam_search(
             y_star = A.get_most_probable()
             A.remove(y_star)
 
-            cached_key = y_star.key
-
-            if cached_key not in decoder_cache:
-                decoder_input = torch.tensor(
-                    [y_star.ys[-context_size:]],
-                    device=device,
-                    dtype=torch.int64,
-                ).reshape(1, context_size)
+            decoder_out = decoder_cache.get([y_star.ys[-context_size:]])
+            decoder_out = decoder_out.unsqueeze(1)
+            # decoder_out is of shape (1, 1, joiner_dim)
 
-                decoder_out = model.decoder(decoder_input, need_pad=False)
-                decoder_out = model.joiner.decoder_proj(decoder_out)
-                decoder_cache[cached_key] = decoder_out
-            else:
-                decoder_out = decoder_cache[cached_key]
-
-            cached_key += f"-t-{t}"
+            cached_key = y_star.key + f"-t-{t}"
             if cached_key not in joint_cache:
                 logits = model.joiner(
                     current_encoder_out,
@@ -1800,28 +2511,27 @@ def modified_beam_search_ngram_rescoring(
 
         log_probs.add_(ys_log_probs)
         vocab_size = log_probs.size(-1)
-        log_probs = log_probs.reshape(-1)
-
-        row_splits = hyps_shape.row_splits(1) * vocab_size
-        log_probs_shape = k2.ragged.create_ragged_shape2(
-            row_splits=row_splits, cached_tot_size=log_probs.numel()
-        )
-        ragged_log_probs = k2.RaggedTensor(shape=log_probs_shape, value=log_probs)
+        topk_log_probs, topk_indexes = topk_per_utterance(
+            log_probs=log_probs, hyps_shape=hyps_shape, beam=beam
+        )  # (batch_size, beam)
 
-        for i in range(batch_size):
-            topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            topk_hyp_indexes = topk_indexes // vocab_size
+            topk_token_indexes = topk_indexes % vocab_size
 
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
-                topk_token_indexes = (topk_indexes % vocab_size).tolist()
+        # Transfer them to CPU all at once
+        topk_hyp_indexes, topk_token_indexes = torch.stack(
+            [topk_hyp_indexes, topk_token_indexes]
+        ).tolist()
 
-            for k in range(len(topk_hyp_indexes)):
-                hyp_idx = topk_hyp_indexes[k]
+        for i in range(batch_size):
+            for k in range(len(topk_hyp_indexes[i])):
+                hyp_idx = topk_hyp_indexes[i][k]
                 hyp = A[i][hyp_idx]
 
                 new_ys = hyp.ys[:]
-                new_token = topk_token_indexes[k]
+                new_token = topk_token_indexes[i][k]
                 if new_token not in (blank_id, unk_id):
                     new_ys.append(new_token)
                     state_cost = hyp.state_cost.forward_one_step(new_token)
@@ -1829,7 +2539,7 @@ def modified_beam_search_ngram_rescoring(
                     state_cost = hyp.state_cost
 
                 # We only keep AM scores in new_hyp.log_prob
-                new_log_prob = topk_log_probs[k] - hyp.state_cost.lm_score * lm_scale
+                new_log_prob = topk_log_probs[i, k] - hyp.state_cost.lm_score * lm_scale
 
                 new_hyp = Hypothesis(
                     ys=new_ys, log_prob=new_log_prob, state_cost=state_cost
@@ -1912,9 +2622,7 @@ def modified_beam_search_LODR(
     assert N == batch_size_list[0], (N, batch_size_list)
 
     # get initial lm score and lm state by scoring the "sos" token
-    sos_token = torch.tensor([[sos_id]]).to(torch.int64).to(device)
-    lens = torch.tensor([1]).to(device)
-    init_score, init_states = LM.score_token(sos_token, lens)
+    lm_pool = LmStatePool.from_sos(LM, sos_id=sos_id, device=device)
 
     B = [HypothesisList() for _ in range(N)]
     for i in range(N):
@@ -1922,8 +2630,7 @@ def modified_beam_search_LODR(
             Hypothesis(
                 ys=[blank_id] * context_size,
                 log_prob=torch.zeros(1, dtype=torch.float32, device=device),
-                state=init_states,  # state of the NN LM
-                lm_score=init_score.reshape(-1),
+                state=0,  # slot of the NN LM state in lm_pool
                 state_cost=NgramLmStateCost(
                     LODR_lm
                 ),  # state of the source domain ngram
@@ -1983,98 +2690,40 @@ def modified_beam_search_LODR(
 
         vocab_size = log_probs.size(-1)
 
-        log_probs = log_probs.reshape(-1)
+        topk_log_probs, topk_indexes = topk_per_utterance(
+            log_probs=log_probs, hyps_shape=hyps_shape, beam=beam
+        )  # (batch_size, beam)
 
-        row_splits = hyps_shape.row_splits(1) * vocab_size
-        log_probs_shape = k2.ragged.create_ragged_shape2(
-            row_splits=row_splits, cached_tot_size=log_probs.numel()
-        )
-        ragged_log_probs = k2.RaggedTensor(shape=log_probs_shape, value=log_probs)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            topk_hyp_indexes = topk_indexes // vocab_size
+            topk_token_indexes = topk_indexes % vocab_size
+
+        # Transfer them to CPU all at once
+        topk_hyp_indexes, topk_token_indexes = torch.stack(
+            [topk_hyp_indexes, topk_token_indexes]
+        ).tolist()
         """
         for all hyps with a non-blank new token, score this token.
-        It is a little confusing here because this for-loop
-        looks very similar to the one below. Here, we go through all
-        top-k tokens and only add the non-blanks ones to the token_list.
-        LM will score those tokens given the LM states. Note that
-        the variable `scores` is the LM score after seeing the new
-        non-blank token.
+        The LM states of the parents of all top-k expansions are gathered
+        into a new LmStatePool, and the non-blank expansions are scored by
+        the LM with a single call. `token_log_probs[j]` is the LM score of
+        the j-th non-blank token given the LM state of its parent.
         """
-        token_list = []
-        hs = []
-        cs = []
-        for i in range(batch_size):
-            topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
-                topk_token_indexes = (topk_indexes % vocab_size).tolist()
-            for k in range(len(topk_hyp_indexes)):
-                hyp_idx = topk_hyp_indexes[k]
-                hyp = A[i][hyp_idx]
-
-                new_token = topk_token_indexes[k]
-                if new_token not in (blank_id, unk_id):
-                    if LM.lm_type == "rnn":
-                        token_list.append([new_token])
-                        # store the LSTM states
-                        hs.append(hyp.state[0])
-                        cs.append(hyp.state[1])
-                    else:
-                        # for transformer LM
-                        token_list.append(
-                            [sos_id] + hyp.ys[context_size:] + [new_token]
-                        )
-
-        # forward NN LM to get new states and scores
-        if len(token_list) != 0:
-            x_lens = torch.tensor([len(tokens) for tokens in token_list]).to(device)
-            if LM.lm_type == "rnn":
-                tokens_to_score = (
-                    torch.tensor(token_list).to(torch.int64).to(device).reshape(-1, 1)
-                )
-                hs = torch.cat(hs, dim=1).to(device)
-                cs = torch.cat(cs, dim=1).to(device)
-                state = (hs, cs)
-            else:
-                # for transformer LM
-                tokens_list = [torch.tensor(tokens) for tokens in token_list]
-                tokens_to_score = (
-                    torch.nn.utils.rnn.pad_sequence(
-                        tokens_list, batch_first=True, padding_value=0.0
-                    )
-                    .to(device)
-                    .to(torch.int64)
-                )
-
-                state = None
-
-            scores, lm_states = LM.score_token(tokens_to_score, x_lens, state)
-
-        count = 0  # index, used to locate score and lm states
+        parents = []
+        scored = []
+        tokens = []
+        state_costs = []
+        ngram_scores = []
         for i in range(batch_size):
-            topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
-                topk_token_indexes = (topk_indexes % vocab_size).tolist()
-
-            for k in range(len(topk_hyp_indexes)):
-                hyp_idx = topk_hyp_indexes[k]
-                hyp = A[i][hyp_idx]
-
-                ys = hyp.ys[:]
-
-                # current score of hyp
-                lm_score = hyp.lm_score
-                state = hyp.state
+            for k in range(len(topk_hyp_indexes[i])):
+                hyp = A[i][topk_hyp_indexes[i][k]]
 
-                hyp_log_prob = topk_log_probs[k]  # get score of current hyp
-                new_token = topk_token_indexes[k]
+                new_token = topk_token_indexes[i][k]
                 if new_token not in (blank_id, unk_id):
+                    scored.append(len(parents))
+                    tokens.append(new_token)
 
-                    ys.append(new_token)
                     state_cost = hyp.state_cost.forward_one_step(new_token)
 
                     # calculate the score of the latest token
@@ -2084,31 +2733,42 @@ def modified_beam_search_LODR(
                         state_cost.lm_score,
                         hyp.state_cost.lm_score,
                     )
-                    # score = score + TDLM_score - LODR_score
-                    # LODR_LM_scale should be a negative number here
-                    hyp_log_prob += (
-                        lm_score[new_token] * lm_scale
-                        + LODR_lm_scale * current_ngram_score
-                    )  # add the lm score
-
-                    lm_score = scores[count]
-                    if LM.lm_type == "rnn":
-                        state = (
-                            lm_states[0][:, count, :].unsqueeze(1),
-                            lm_states[1][:, count, :].unsqueeze(1),
-                        )
-                    count += 1
+                    ngram_scores.append(LODR_lm_scale * current_ngram_score)
                 else:
                     state_cost = hyp.state_cost
+                parents.append(hyp.state)
+                state_costs.append(state_cost)
+
+        lm_pool, token_log_probs = lm_pool.advance(parents, scored, tokens)
+
+        # score = score + TDLM_score - LODR_score
+        # LODR_LM_scale should be a negative number here
+        new_log_probs = topk_log_probs.reshape(-1)
+        new_log_probs = new_log_probs.index_add(
+            0,
+            torch.tensor(scored, dtype=torch.int64, device=device),
+            token_log_probs * lm_scale
+            + torch.tensor(ngram_scores, dtype=torch.float32, device=device),
+        )
+
+        j = 0  # index of the expansion, which is also its slot in lm_pool
+        for i in range(batch_size):
+            for k in range(len(topk_hyp_indexes[i])):
+                hyp = A[i][topk_hyp_indexes[i][k]]
+
+                ys = hyp.ys[:]
+                new_token = topk_token_indexes[i][k]
+                if new_token not in (blank_id, unk_id):
+                    ys.append(new_token)
 
                 new_hyp = Hypothesis(
                     ys=ys,
-                    log_prob=hyp_log_prob,
-                    state=state,
-                    lm_score=lm_score,
-                    state_cost=state_cost,
+                    log_prob=new_log_probs[j],
+                    state=j,
+                    state_cost=state_costs[j],
                 )
                 B[i].add(new_hyp)
+                j += 1
 
     B = B + finalized_B
     best_hyps = [b.get_most_probable(length_norm=True) for b in B]
@@ -2176,9 +2836,7 @@ def modified_beam_search_lm_shallow_fusion(
     assert N == batch_size_list[0], (N, batch_size_list)
 
     # get initial lm score and lm state by scoring the "sos" token
-    sos_token = torch.tensor([[sos_id]]).to(torch.int64).to(device)
-    lens = torch.tensor([1]).to(device)
-    init_score, init_states = LM.score_token(sos_token, lens)
+    lm_pool = LmStatePool.from_sos(LM, sos_id=sos_id, device=device)
 
     B = [HypothesisList() for _ in range(N)]
     for i in range(N):
@@ -2186,8 +2844,7 @@ def modified_beam_search_lm_shallow_fusion(
             Hypothesis(
                 ys=[blank_id] * context_size,
                 log_prob=torch.zeros(1, dtype=torch.float32, device=device),
-                state=init_states,
-                lm_score=init_score.reshape(-1),
+                state=0,  # slot of the NN LM state in lm_pool
                 timestamp=[],
             )
         )
@@ -2216,10 +2873,6 @@ def modified_beam_search_lm_shallow_fusion(
             [hyp.log_prob.reshape(1, 1) for hyps in A for hyp in hyps]
         )
 
-        lm_scores = torch.cat(
-            [hyp.lm_score.reshape(1, -1) for hyps in A for hyp in hyps]
-        )
-
         decoder_input = torch.tensor(
             [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
             device=device,
@@ -2249,117 +2902,68 @@ def modified_beam_search_lm_shallow_fusion(
 
         vocab_size = log_probs.size(-1)
 
-        log_probs = log_probs.reshape(-1)
+        topk_log_probs, topk_indexes = topk_per_utterance(
+            log_probs=log_probs, hyps_shape=hyps_shape, beam=beam
+        )  # (batch_size, beam)
 
-        row_splits = hyps_shape.row_splits(1) * vocab_size
-        log_probs_shape = k2.ragged.create_ragged_shape2(
-            row_splits=row_splits, cached_tot_size=log_probs.numel()
-        )
-        ragged_log_probs = k2.RaggedTensor(shape=log_probs_shape, value=log_probs)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            topk_hyp_indexes = topk_indexes // vocab_size
+            topk_token_indexes = topk_indexes % vocab_size
+
+        # Transfer them to CPU all at once
+        topk_hyp_indexes, topk_token_indexes = torch.stack(
+            [topk_hyp_indexes, topk_token_indexes]
+        ).tolist()
         """
         for all hyps with a non-blank new token, score this token.
-        It is a little confusing here because this for-loop
-        looks very similar to the one below. Here, we go through all
-        top-k tokens and only add the non-blanks ones to the token_list.
-        `LM` will score those tokens given the LM states. Note that
-        the variable `scores` is the LM score after seeing the new
-        non-blank token.
+        The LM states of the parents of all top-k expansions are gathered
+        into a new LmStatePool, and the non-blank expansions are scored by
+        the LM with a single call. `token_log_probs[j]` is the LM score of
+        the j-th non-blank token given the LM state of its parent.
         """
-        token_list = []  # a list of list
-        hs = []
-        cs = []
+        parents = []
+        scored = []
+        tokens = []
         for i in range(batch_size):
-            topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
-                topk_token_indexes = (topk_indexes % vocab_size).tolist()
-            for k in range(len(topk_hyp_indexes)):
-                hyp_idx = topk_hyp_indexes[k]
-                hyp = A[i][hyp_idx]
+            for k in range(len(topk_hyp_indexes[i])):
+                hyp = A[i][topk_hyp_indexes[i][k]]
 
-                new_token = topk_token_indexes[k]
+                new_token = topk_token_indexes[i][k]
                 if new_token not in (blank_id, unk_id):
-                    if LM.lm_type == "rnn":
-                        token_list.append([new_token])
-                        # store the LSTM states
-                        hs.append(hyp.state[0])
-                        cs.append(hyp.state[1])
-                    else:
-                        # for transformer LM
-                        token_list.append(
-                            [sos_id] + hyp.ys[context_size:] + [new_token]
-                        )
-
-        if len(token_list) != 0:
-            x_lens = torch.tensor([len(tokens) for tokens in token_list]).to(device)
-            if LM.lm_type == "rnn":
-                tokens_to_score = (
-                    torch.tensor(token_list).to(torch.int64).to(device).reshape(-1, 1)
-                )
-                hs = torch.cat(hs, dim=1).to(device)
-                cs = torch.cat(cs, dim=1).to(device)
-                state = (hs, cs)
-            else:
-                # for transformer LM
-                tokens_list = [torch.tensor(tokens) for tokens in token_list]
-                tokens_to_score = (
-                    torch.nn.utils.rnn.pad_sequence(
-                        tokens_list, batch_first=True, padding_value=0.0
-                    )
-                    .to(device)
-                    .to(torch.int64)
-                )
+                    scored.append(len(parents))
+                    tokens.append(new_token)
+                parents.append(hyp.state)
 
-                state = None
+        lm_pool, token_log_probs = lm_pool.advance(parents, scored, tokens)
 
-            scores, lm_states = LM.score_token(tokens_to_score, x_lens, state)
+        new_log_probs = topk_log_probs.reshape(-1)
+        new_log_probs = new_log_probs.index_add(
+            0,
+            torch.tensor(scored, dtype=torch.int64, device=device),
+            token_log_probs * lm_scale,
+        )  # add the lm score
 
-        count = 0  # index, used to locate score and lm states
+        j = 0  # index of the expansion, which is also its slot in lm_pool
         for i in range(batch_size):
-            topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
-                topk_token_indexes = (topk_indexes % vocab_size).tolist()
-
-            for k in range(len(topk_hyp_indexes)):
-                hyp_idx = topk_hyp_indexes[k]
-                hyp = A[i][hyp_idx]
+            for k in range(len(topk_hyp_indexes[i])):
+                hyp = A[i][topk_hyp_indexes[i][k]]
 
                 ys = hyp.ys[:]
-
-                lm_score = hyp.lm_score
-                state = hyp.state
-
-                hyp_log_prob = topk_log_probs[k]  # get score of current hyp
-                new_token = topk_token_indexes[k]
+                new_token = topk_token_indexes[i][k]
                 new_timestamp = hyp.timestamp[:]
                 if new_token not in (blank_id, unk_id):
-
                     ys.append(new_token)
                     new_timestamp.append(t)
 
-                    hyp_log_prob += lm_score[new_token] * lm_scale  # add the lm score
-
-                    lm_score = scores[count]
-                    if LM.lm_type == "rnn":
-                        state = (
-                            lm_states[0][:, count, :].unsqueeze(1),
-                            lm_states[1][:, count, :].unsqueeze(1),
-                        )
-                    count += 1
-
                 new_hyp = Hypothesis(
                     ys=ys,
-                    log_prob=hyp_log_prob,
-                    state=state,
-                    lm_score=lm_score,
+                    log_prob=new_log_probs[j],
+                    state=j,
                     timestamp=new_timestamp,
                 )
                 B[i].add(new_hyp)
+                j += 1
 
     B = B + finalized_B
     best_hyps = [b.get_most_probable(length_norm=True) for b in B]
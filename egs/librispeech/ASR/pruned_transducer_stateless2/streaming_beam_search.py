@@ -15,7 +15,7 @@
 # limitations under the License.
 
 import warnings
-from typing import List
+from typing import List, Optional
 
 import k2
 import torch
@@ -24,6 +24,7 @@ from beam_search import Hypothesis, HypothesisList, get_hyps_shape
 from decode_stream import DecodeStream
 
 from icefall.decode import one_best_decoding
+from icefall.decoder_cache import DecoderOutputCache
 from icefall.utils import get_texts
 
 
@@ -97,6 +98,7 @@ def modified_beam_search(
     encoder_out: torch.Tensor,
     streams: List[DecodeStream],
     num_active_paths: int = 4,
+    decoder_cache: Optional[DecoderOutputCache] = None,
 ) -> None:
     """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
 
@@ -110,6 +112,10 @@ def modified_beam_search(
         A list of stream objects.
       num_active_paths:
         Number of active paths during the beam search.
+      decoder_cache:
+        If not None, it is used to look up the decoder output. Pass the same
+        one for all chunks to share it across chunks and streams. If None,
+        a new one is created and shared by all streams of this chunk.
     """
     assert encoder_out.ndim == 3, encoder_out.shape
     assert len(streams) == encoder_out.size(0)
@@ -120,6 +126,9 @@ def modified_beam_search(
     batch_size = len(streams)
     T = encoder_out.size(1)
 
+    if decoder_cache is None:
+        decoder_cache = DecoderOutputCache(model)
+
     B = [stream.hyps for stream in streams]
 
     for t in range(T):
@@ -135,14 +144,10 @@ def modified_beam_search(
             [hyp.log_prob.reshape(1) for hyps in A for hyp in hyps], dim=0
         )  # (num_hyps, 1)
 
-        decoder_input = torch.tensor(
-            [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
-            device=device,
-            dtype=torch.int64,
-        )  # (num_hyps, context_size)
-
-        decoder_out = model.decoder(decoder_input, need_pad=False).unsqueeze(1)
-        decoder_out = model.joiner.decoder_proj(decoder_out)
+        decoder_out = decoder_cache.get(
+            [hyp.ys[-context_size:] for hyps in A for hyp in hyps]
+        )
+        decoder_out = decoder_out.unsqueeze(1).unsqueeze(1)
         # decoder_out is of shape (num_hyps, 1, 1, decoder_output_dim)
 
         # Note: For torch 1.7.1 and below, it requires a torch.int64 tensor
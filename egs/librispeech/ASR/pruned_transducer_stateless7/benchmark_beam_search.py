@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script benchmarks the search methods in beam_search.py with a randomly
+initialized model and random encoder outputs. It also checks that the
+optimized implementations give the same results as the reference ones.
+
+Usage:
+
+    cd icefall/egs/librispeech/ASR
+    ./pruned_transducer_stateless7/benchmark_beam_search.py \
+      --beam-sizes 4,8,16 \
+      --batch-sizes 1,4,16,64 \
+      --greedy-batch-sizes 1,8,32,128
+"""
+
+import argparse
+import logging
+import time
+from typing import Callable, List
+
+import torch
+import torch.nn as nn
+from beam_search import (
+    _greedy_search_batch_python_list,
+    _modified_beam_search_hypothesis_list,
+    greedy_search_batch,
+    modified_beam_search,
+)
+from decoder import Decoder
+from joiner import Joiner
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--beam-sizes",
+        type=str,
+        default="4,8,16",
+        help="Comma separated beam sizes for modified_beam_search",
+    )
+
+    parser.add_argument(
+        "--batch-sizes",
+        type=str,
+        default="1,4,16,64",
+        help="Comma separated batch sizes",
+    )
+
+    parser.add_argument(
+        "--greedy-batch-sizes",
+        type=str,
+        default="1,8,32,128",
+        help="Comma separated batch sizes for greedy_search_batch",
+    )
+
+    parser.add_argument(
+        "--num-frames",
+        type=int,
+        default=100,
+        help="Number of encoder output frames of the longest utterance",
+    )
+
+    parser.add_argument(
+        "--num-iters",
+        type=int,
+        default=3,
+        help="Number of runs to average over for each configuration",
+    )
+
+    parser.add_argument(
+        "--vocab-size",
+        type=int,
+        default=500,
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; 2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--encoder-dim",
+        type=int,
+        default=384,
+    )
+
+    parser.add_argument(
+        "--decoder-dim",
+        type=int,
+        default=512,
+    )
+
+    parser.add_argument(
+        "--joiner-dim",
+        type=int,
+        default=512,
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="Number of threads used by torch on CPU",
+    )
+
+    return parser
+
+
+def to_int_list(s: str) -> List[int]:
+    return list(map(int, s.split(",")))
+
+
+class DecoderJoiner(nn.Module):
+    """The decoder and the joiner of a transducer model, which is all
+    that the search methods use. The encoder is not needed as we feed
+    random encoder outputs."""
+
+    def __init__(self, decoder: nn.Module, joiner: nn.Module):
+        super().__init__()
+        self.decoder = decoder
+        self.joiner = joiner
+
+
+def get_encoder_out(
+    batch_size: int, num_frames: int, encoder_dim: int, device: torch.device
+):
+    """Return random encoder outputs with different lengths."""
+    encoder_out = torch.randn(batch_size, num_frames, encoder_dim, device=device)
+    encoder_out_lens = torch.randint(
+        low=num_frames // 2, high=num_frames + 1, size=(batch_size,), device=device
+    )
+    encoder_out_lens[0] = num_frames
+    return encoder_out, encoder_out_lens
+
+
+def measure(func: Callable, num_iters: int):
+    """Return the result of `func()` and the average time in seconds
+    of calling it."""
+    ans = func()  # warmup
+    start = time.time()
+    for _ in range(num_iters):
+        func()
+    return ans, (time.time() - start) / num_iters
+
+
+@torch.no_grad()
+def benchmark_modified_beam_search(
+    model: torch.nn.Module,
+    beam_sizes: List[int],
+    batch_sizes: List[int],
+    num_frames: int,
+    encoder_dim: int,
+    num_iters: int,
+    device: torch.device,
+):
+    logging.info("modified_beam_search: HypothesisStore vs HypothesisList")
+    for beam in beam_sizes:
+        for batch_size in batch_sizes:
+            encoder_out, encoder_out_lens = get_encoder_out(
+                batch_size, num_frames, encoder_dim, device
+            )
+
+            def run(search):
+                return search(
+                    model=model,
+                    encoder_out=encoder_out,
+                    encoder_out_lens=encoder_out_lens,
+                    beam=beam,
+                    return_timestamps=True,
+                )
+
+            ref, ref_time = measure(
+                lambda: run(_modified_beam_search_hypothesis_list), num_iters
+            )
+            hyp, hyp_time = measure(lambda: run(modified_beam_search), num_iters)
+
+            assert hyp.hyps == ref.hyps, (beam, batch_size)
+            assert hyp.timestamps == ref.timestamps, (beam, batch_size)
+
+            num_frames_total = encoder_out_lens.sum().item()
+            logging.info(
+                f"beam={beam:2d} batch_size={batch_size:3d}: "
+                f"HypothesisList {ref_time * 1000:9.2f} ms, "
+                f"HypothesisStore {hyp_time * 1000:9.2f} ms, "
+                f"speedup {ref_time / hyp_time:5.2f}, "
+                f"{num_frames_total / hyp_time:9.1f} frames/s"
+            )
+
+
+@torch.no_grad()
+def benchmark_greedy_search_batch(
+    model: torch.nn.Module,
+    batch_sizes: List[int],
+    num_frames: int,
+    encoder_dim: int,
+    num_iters: int,
+    device: torch.device,
+):
+    logging.info("greedy_search_batch: device tensors vs Python lists")
+    for batch_size in batch_sizes:
+        encoder_out, encoder_out_lens = get_encoder_out(
+            batch_size, num_frames, encoder_dim, device
+        )
+
+        def run(search):
+            return search(
+                model=model,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+                return_timestamps=True,
+            )
+
+        ref, ref_time = measure(
+            lambda: run(_greedy_search_batch_python_list), num_iters
+        )
+        hyp, hyp_time = measure(lambda: run(greedy_search_batch), num_iters)
+
+        assert hyp.hyps == ref.hyps, batch_size
+        assert hyp.timestamps == ref.timestamps, batch_size
+
+        num_frames_total = encoder_out_lens.sum().item()
+        logging.info(
+            f"batch_size={batch_size:3d}: "
+            f"Python lists {ref_time * 1000:9.2f} ms, "
+            f"device tensors {hyp_time * 1000:9.2f} ms, "
+            f"speedup {ref_time / hyp_time:5.2f}, "
+            f"{num_frames_total / hyp_time:9.1f} frames/s"
+        )
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    torch.manual_seed(20221017)
+    torch.set_num_threads(args.num_threads)
+
+    device = torch.device("cpu")
+
+    decoder = Decoder(
+        vocab_size=args.vocab_size,
+        decoder_dim=args.decoder_dim,
+        blank_id=0,
+        context_size=args.context_size,
+    )
+    joiner = Joiner(
+        encoder_dim=args.encoder_dim,
+        decoder_dim=args.decoder_dim,
+        joiner_dim=args.joiner_dim,
+        vocab_size=args.vocab_size,
+    )
+    model = DecoderJoiner(decoder=decoder, joiner=joiner)
+    model.to(device)
+    model.eval()
+
+    benchmark_greedy_search_batch(
+        model=model,
+        batch_sizes=to_int_list(args.greedy_batch_sizes),
+        num_frames=args.num_frames,
+        encoder_dim=args.encoder_dim,
+        num_iters=args.num_iters,
+        device=device,
+    )
+
+    benchmark_modified_beam_search(
+        model=model,
+        beam_sizes=to_int_list(args.beam_sizes),
+        batch_sizes=to_int_list(args.batch_sizes),
+        num_frames=args.num_frames,
+        encoder_dim=args.encoder_dim,
+        num_iters=args.num_iters,
+        device=device,
+    )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -98,6 +98,7 @@ import argparse
 import logging
 import math
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -124,6 +125,7 @@ from icefall.checkpoint import (
     find_checkpoints,
     load_checkpoint,
 )
+from icefall.error_stats import ErrorStats
 from icefall.lexicon import Lexicon
 from icefall.utils import (
     AttributeDict,
@@ -180,6 +182,17 @@ def get_parser():
         "`epoch` are loaded for averaging. ",
     )
 
+    parser.add_argument(
+        "--cache-averaged-model",
+        type=str2bool,
+        default=False,
+        help="If True, save the averaged model to exp-dir/averaged-models "
+        "and reuse it when decoding again with the same --epoch/--iter, --avg "
+        "and --use-averaged-model. Each combination adds a file of the size "
+        "of a model, and old files are never removed, so clean up that "
+        "directory when it is no longer needed.",
+    )
+
     parser.add_argument(
         "--exp-dir",
         type=str,
@@ -323,6 +336,15 @@ def get_parser():
         help="left context can be seen during decoding (in frames after subsampling)",
     )
 
+    parser.add_argument(
+        "--num-scoring-jobs",
+        type=int,
+        default=1,
+        help="""Number of processes to compute the error statistics.
+        If it is greater than 1, the decoded batches are scored in
+        a process pool while the decoding goes on.""",
+    )
+
     add_model_arguments(parser)
 
     return parser
@@ -517,6 +539,7 @@ def decode_dataset(
     sp: spm.SentencePieceProcessor,
     word_table: Optional[k2.SymbolTable] = None,
     decoding_graph: Optional[k2.Fsa] = None,
+    error_stats: Optional[Dict[str, ErrorStats]] = None,
 ) -> Dict[str, List[Tuple[str, List[str], List[str]]]]:
     """Decode dataset.
 
@@ -535,6 +558,9 @@ def decode_dataset(
         The decoding graph. Can be either a `k2.trivial_graph` or HLG, Used
         only when --decoding_method is fast_beam_search, fast_beam_search_nbest,
         fast_beam_search_nbest_oracle, and fast_beam_search_nbest_LG.
+      error_stats:
+        If not None, the results of each batch are also added to
+        error_stats[key], where key is the same as that of the returned dict.
     Returns:
       Return a dict, whose key may be "greedy_search" if greedy search
       is used, or it may be "beam_7" if beam size of 7 is used.
@@ -576,6 +602,8 @@ def decode_dataset(
                 this_batch.append((cut_id, ref_words, hyp_words))
 
             results[name].extend(this_batch)
+            if error_stats is not None:
+                error_stats[name].add(this_batch)
 
         num_cuts += len(texts)
 
@@ -590,6 +618,7 @@ def save_results(
     params: AttributeDict,
     test_set_name: str,
     results_dict: Dict[str, List[Tuple[str, List[str], List[str]]]],
+    error_stats: Optional[Dict[str, ErrorStats]] = None,
 ):
     test_set_wers = dict()
     for key, results in results_dict.items():
@@ -606,9 +635,14 @@ def save_results(
             params.res_dir / f"errs-{test_set_name}-{key}-{params.suffix}.txt"
         )
         with open(errs_filename, "w") as f:
-            wer = write_error_stats(
-                f, f"{test_set_name}-{key}", results, enable_log=True
-            )
+            if error_stats is not None:
+                wer = error_stats[key].write(
+                    f, f"{test_set_name}-{key}", enable_log=True, sort=True
+                )
+            else:
+                wer = write_error_stats(
+                    f, f"{test_set_name}-{key}", results, enable_log=True
+                )
             test_set_wers[key] = wer
 
         logging.info("Wrote detailed error stats to {}".format(errs_filename))
@@ -705,6 +739,10 @@ def main():
     logging.info("About to create model")
     model = get_transducer_model(params)
 
+    avg_cache_dir = None
+    if params.cache_averaged_model:
+        avg_cache_dir = params.exp_dir / "averaged-models"
+
     if not params.use_averaged_model:
         if params.iter > 0:
             filenames = find_checkpoints(params.exp_dir, iteration=-params.iter)[
@@ -722,7 +760,9 @@ def main():
                 )
             logging.info(f"averaging {filenames}")
             model.to(device)
-            model.load_state_dict(average_checkpoints(filenames, device=device))
+            model.load_state_dict(
+                average_checkpoints(filenames, device=device, cache_dir=avg_cache_dir)
+            )
         elif params.avg == 1:
             load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
         else:
@@ -733,7 +773,9 @@ def main():
                     filenames.append(f"{params.exp_dir}/epoch-{i}.pt")
             logging.info(f"averaging {filenames}")
             model.to(device)
-            model.load_state_dict(average_checkpoints(filenames, device=device))
+            model.load_state_dict(
+                average_checkpoints(filenames, device=device, cache_dir=avg_cache_dir)
+            )
     else:
         if params.iter > 0:
             filenames = find_checkpoints(params.exp_dir, iteration=-params.iter)[
@@ -761,6 +803,7 @@ def main():
                     filename_start=filename_start,
                     filename_end=filename_end,
                     device=device,
+                    cache_dir=avg_cache_dir,
                 )
             )
         else:
@@ -779,6 +822,7 @@ def main():
                     filename_start=filename_start,
                     filename_end=filename_end,
                     device=device,
+                    cache_dir=avg_cache_dir,
                 )
             )
 
@@ -818,7 +862,12 @@ def main():
     test_sets = ["test-clean", "test-other"]
     test_dl = [test_clean_dl, test_other_dl]
 
+    executor = None
+    if params.num_scoring_jobs > 1:
+        executor = ProcessPoolExecutor(params.num_scoring_jobs)
+
     for test_set, test_dl in zip(test_sets, test_dl):
+        error_stats = defaultdict(lambda: ErrorStats(executor=executor))
         results_dict = decode_dataset(
             dl=test_dl,
             params=params,
@@ -826,14 +875,19 @@ def main():
             sp=sp,
             word_table=word_table,
             decoding_graph=decoding_graph,
+            error_stats=error_stats,
         )
 
         save_results(
             params=params,
             test_set_name=test_set,
             results_dict=results_dict,
+            error_stats=error_stats,
         )
 
+    if executor is not None:
+        executor.shutdown()
+
     logging.info("Done!")
 
 
@@ -76,12 +76,13 @@ from icefall import diagnostics
 from icefall.checkpoint import load_checkpoint, remove_checkpoints
 from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.checkpoint import (
+    AsyncCheckpointWriter,
     save_checkpoint_with_global_batch_idx,
     update_averaged_model,
 )
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
-from icefall.hooks import register_inf_check_hooks
+from icefall.hooks import InfChecker, register_inf_check_hooks
 from icefall.utils import AttributeDict, MetricsTracker, setup_logger, str2bool
 
 LRSchedulerType = Union[torch.optim.lr_scheduler._LRScheduler, optim.LRScheduler]
@@ -317,6 +318,31 @@ def get_parser():
         help="Accumulate stats on activations, print them and exit.",
     )
 
+    parser.add_argument(
+        "--sampled-diagnostics-fraction",
+        type=float,
+        default=0.0,
+        help="""If positive, accumulate stats on activations, gradients and
+        parameters of a random subset of modules on this fraction of batches
+        during the whole training, and write them to tensorboard and
+        exp-dir/diagnostics.jsonl. See SampledModelDiagnostic in
+        icefall/diagnostics.py.""",
+    )
+
+    parser.add_argument(
+        "--sampled-diagnostics-module-fraction",
+        type=float,
+        default=0.1,
+        help="The fraction of modules analyzed on each sampled batch.",
+    )
+
+    parser.add_argument(
+        "--sampled-diagnostics-flush-interval",
+        type=int,
+        default=1000,
+        help="Write the sampled diagnostics every this number of batches.",
+    )
+
     parser.add_argument(
         "--inf-check",
         type=str2bool,
@@ -324,6 +350,15 @@ def get_parser():
         help="Add hooks to check for infinite module outputs and gradients.",
     )
 
+    parser.add_argument(
+        "--deferred-inf-check",
+        type=str2bool,
+        default=False,
+        help="""Like --inf-check, but the results are kept on the device and
+        checked once per batch after backward(), which is cheap enough to be
+        used in normal training.""",
+    )
+
     parser.add_argument(
         "--save-every-n",
         type=int,
@@ -337,6 +372,15 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--async-checkpoint",
+        type=str2bool,
+        default=False,
+        help="""If True, checkpoints are copied to CPU and written to disk
+        in a background thread, so the training is only blocked by the copy.
+        """,
+    )
+
     parser.add_argument(
         "--keep-last-k",
         type=int,
@@ -576,6 +620,7 @@ def save_checkpoint(
     sampler: Optional[CutSampler] = None,
     scaler: Optional[GradScaler] = None,
     rank: int = 0,
+    checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
 ) -> None:
     """Save model, optimizer, scheduler and training stats to file.
 
@@ -592,6 +637,8 @@ def save_checkpoint(
        The sampler for the training dataset.
       scaler:
         The scaler used for mix precision training.
+      checkpoint_writer:
+        If not None, the checkpoint is written in the background by it.
     """
     if rank != 0:
         return
@@ -606,15 +653,23 @@ def save_checkpoint(
         sampler=sampler,
         scaler=scaler,
         rank=rank,
+        writer=checkpoint_writer,
     )
 
+    def copy_to(dst: Path):
+        if checkpoint_writer is None:
+            copyfile(src=filename, dst=dst)
+        else:
+            # It is copied after the checkpoint is written
+            checkpoint_writer.submit(copyfile, src=filename, dst=dst)
+
     if params.best_train_epoch == params.cur_epoch:
         best_train_filename = params.exp_dir / "best-train-loss.pt"
-        copyfile(src=filename, dst=best_train_filename)
+        copy_to(best_train_filename)
 
     if params.best_valid_epoch == params.cur_epoch:
         best_valid_filename = params.exp_dir / "best-valid-loss.pt"
-        copyfile(src=filename, dst=best_valid_filename)
+        copy_to(best_valid_filename)
 
 
 def compute_loss(
@@ -746,6 +801,9 @@ def train_one_epoch(
     tb_writer: Optional[SummaryWriter] = None,
     world_size: int = 1,
     rank: int = 0,
+    sampled_diagnostic: Optional[diagnostics.SampledModelDiagnostic] = None,
+    inf_checker: Optional[InfChecker] = None,
+    checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
 ) -> None:
     """Train the model for one epoch.
 
@@ -777,6 +835,14 @@ def train_one_epoch(
       rank:
         The rank of the node in DDP training. If no DDP is used, it should
         be set to 0.
+      sampled_diagnostic:
+        If not None, its step() is called before each batch.
+      inf_checker:
+        If not None, its check() is called after the backward pass of each
+        batch.
+      checkpoint_writer:
+        If not None, checkpoints are written and removed in the background
+        by it.
     """
     model.train()
 
@@ -792,6 +858,9 @@ def train_one_epoch(
         params.batch_idx_train += 1
         batch_size = len(batch["supervisions"]["text"])
 
+        if sampled_diagnostic is not None:
+            sampled_diagnostic.step(params.batch_idx_train)
+
         try:
             with torch.cuda.amp.autocast(enabled=params.use_fp16):
                 loss, loss_info = compute_loss(
@@ -807,6 +876,8 @@ def train_one_epoch(
             # NOTE: We use reduction==sum and loss is computed over utterances
             # in the batch and there is no normalization to it so far.
             scaler.scale(loss).backward()
+            if inf_checker is not None:
+                inf_checker.check()
             set_batch_count(model, params.batch_idx_train)
             scheduler.step_batch(params.batch_idx_train)
 
@@ -847,12 +918,14 @@ def train_one_epoch(
                 sampler=train_dl.sampler,
                 scaler=scaler,
                 rank=rank,
+                writer=checkpoint_writer,
             )
             del params.cur_batch_idx
             remove_checkpoints(
                 out_dir=params.exp_dir,
                 topk=params.keep_last_k,
                 rank=rank,
+                writer=checkpoint_writer,
             )
 
         if batch_idx % 100 == 0 and params.use_fp16:
@@ -1019,9 +1092,28 @@ def run(rank, world_size, args):
         )  # allow 4 megabytes per sub-module
         diagnostic = diagnostics.attach_diagnostics(model, opts)
 
+    sampled_diagnostic = None
+    if params.sampled_diagnostics_fraction > 0 and rank == 0:
+        sampled_diagnostic = diagnostics.SampledModelDiagnostic(
+            model,
+            step_fraction=params.sampled_diagnostics_fraction,
+            module_fraction=params.sampled_diagnostics_module_fraction,
+            flush_interval=params.sampled_diagnostics_flush_interval,
+            tb_writer=tb_writer,
+            filename=params.exp_dir / "diagnostics.jsonl",
+        )
+
     if params.inf_check:
         register_inf_check_hooks(model)
 
+    inf_checker = None
+    if params.deferred_inf_check:
+        inf_checker = InfChecker(model)
+
+    checkpoint_writer = None
+    if params.async_checkpoint and rank == 0:
+        checkpoint_writer = AsyncCheckpointWriter()
+
     librispeech = LibriSpeechAsrDataModule(args)
 
     train_cuts = librispeech.train_clean_100_cuts()
@@ -1120,6 +1212,9 @@ def run(rank, world_size, args):
             tb_writer=tb_writer,
             world_size=world_size,
             rank=rank,
+            sampled_diagnostic=sampled_diagnostic,
+            inf_checker=inf_checker,
+            checkpoint_writer=checkpoint_writer,
         )
 
         if params.print_diagnostics:
@@ -1135,8 +1230,15 @@ def run(rank, world_size, args):
             sampler=train_dl.sampler,
             scaler=scaler,
             rank=rank,
+            checkpoint_writer=checkpoint_writer,
         )
 
+    if sampled_diagnostic is not None:
+        sampled_diagnostic.close()
+
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
     logging.info("Done!")
 
     if world_size > 1:
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script benchmarks fast_beam_search_one_best in streaming_beam_search.py
+with a randomly initialized decoder and joiner and random encoder outputs.
+
+It compares, per chunk:
+  - rebuilding k2.RnntDecodingStreams and generating the lattices of all
+    streams for every chunk, and
+  - keeping the streams in a RnntDecodingStreamsPool, computing their
+    partial results every --partial-result-interval chunks and generating
+    their lattices only for the last chunk.
+
+It uses a trivial graph, and also an LG graph if --lg is given.
+
+Usage:
+
+    cd icefall/egs/librispeech/ASR
+    ./pruned_transducer_stateless7_streaming/benchmark_fast_beam_search.py \
+      --num-streams 1,4,16,64,256 \
+      --lg ./data/lang_bpe_500/LG.pt
+"""
+
+import argparse
+import logging
+import time
+from typing import List, Optional
+
+import k2
+import torch
+import torch.nn as nn
+from decode_stream import DecodeStream
+from decoder import Decoder
+from joiner import Joiner
+from streaming_beam_search import (
+    RnntDecodingStreamsPool,
+    fast_beam_search_one_best,
+    get_rnnt_decoding_config,
+)
+
+from icefall.utils import AttributeDict
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--num-streams",
+        type=str,
+        default="1,4,16,64,256",
+        help="Comma separated numbers of streams decoded in parallel",
+    )
+
+    parser.add_argument(
+        "--num-chunks",
+        type=int,
+        default=30,
+        help="Number of chunks decoded for each stream",
+    )
+
+    parser.add_argument(
+        "--chunk-frames",
+        type=int,
+        default=16,
+        help="Number of encoder output frames in each chunk",
+    )
+
+    parser.add_argument(
+        "--partial-result-interval",
+        type=int,
+        default=0,
+        help="""Compute partial results every this number of chunks when
+        the pool is used. 0 means only the final results are computed.""",
+    )
+
+    parser.add_argument(
+        "--lg",
+        type=str,
+        default=None,
+        help="""If given, also benchmark with this LG graph. --vocab-size
+        has to match its tokens.""",
+    )
+
+    parser.add_argument(
+        "--beam",
+        type=float,
+        default=4,
+    )
+
+    parser.add_argument(
+        "--max-contexts",
+        type=int,
+        default=4,
+    )
+
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=32,
+    )
+
+    parser.add_argument(
+        "--vocab-size",
+        type=int,
+        default=500,
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; 2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--encoder-dim",
+        type=int,
+        default=384,
+    )
+
+    parser.add_argument(
+        "--decoder-dim",
+        type=int,
+        default=512,
+    )
+
+    parser.add_argument(
+        "--joiner-dim",
+        type=int,
+        default=512,
+    )
+
+    return parser
+
+
+def to_int_list(s: str) -> List[int]:
+    return list(map(int, s.split(",")))
+
+
+class DecoderJoiner(nn.Module):
+    """The decoder and the joiner of a transducer model, which is all
+    that fast_beam_search uses."""
+
+    def __init__(self, decoder: nn.Module, joiner: nn.Module):
+        super().__init__()
+        self.decoder = decoder
+        self.joiner = joiner
+
+
+@torch.no_grad()
+def decode(
+    args: argparse.Namespace,
+    model: nn.Module,
+    decoding_graph: k2.Fsa,
+    encoder_out: torch.Tensor,
+    decoding_streams_pool: Optional[RnntDecodingStreamsPool],
+) -> List[List[int]]:
+    """Decode encoder_out chunk by chunk and return the final results."""
+    params = AttributeDict(
+        decoding_method="fast_beam_search",
+        blank_id=0,
+        context_size=args.context_size,
+    )
+    num_streams = encoder_out.size(0)
+    streams = [
+        DecodeStream(
+            params=params,
+            cut_id=str(i),
+            initial_states=[],
+            decoding_graph=decoding_graph,
+            device=encoder_out.device,
+        )
+        for i in range(num_streams)
+    ]
+    interval = args.partial_result_interval
+    for c in range(args.num_chunks):
+        chunk = encoder_out[:, c * args.chunk_frames : (c + 1) * args.chunk_frames]
+        processed_lens = torch.full(
+            (num_streams,), (c + 1) * args.chunk_frames, device=encoder_out.device
+        )
+        is_due = interval > 0 and (c + 1) % interval == 0
+        is_last = c + 1 == args.num_chunks
+        fast_beam_search_one_best(
+            model=model,
+            encoder_out=chunk,
+            processed_lens=processed_lens,
+            streams=streams,
+            beam=args.beam,
+            max_states=args.max_states,
+            max_contexts=args.max_contexts,
+            decoding_streams_pool=decoding_streams_pool,
+            need_results=[is_due] * num_streams,
+            finished=[is_last] * num_streams,
+        )
+    return [s.hyp for s in streams]
+
+
+def benchmark(
+    args: argparse.Namespace,
+    model: nn.Module,
+    decoding_graph: k2.Fsa,
+    graph_name: str,
+    device: torch.device,
+):
+    for num_streams in to_int_list(args.num_streams):
+        encoder_out = torch.randn(
+            num_streams,
+            args.num_chunks * args.chunk_frames,
+            args.joiner_dim,
+            device=device,
+        )
+
+        start = time.time()
+        ref = decode(args, model, decoding_graph, encoder_out, None)
+        ref_time = (time.time() - start) / args.num_chunks
+
+        pool = RnntDecodingStreamsPool(
+            get_rnnt_decoding_config(
+                model,
+                beam=args.beam,
+                max_states=args.max_states,
+                max_contexts=args.max_contexts,
+            ),
+            decoding_graph,
+            track_partial_results=args.partial_result_interval > 0,
+        )
+        start = time.time()
+        hyp = decode(args, model, decoding_graph, encoder_out, pool)
+        hyp_time = (time.time() - start) / args.num_chunks
+
+        assert hyp == ref, (graph_name, num_streams)
+
+        logging.info(
+            f"{graph_name} num_streams={num_streams:3d}: per chunk "
+            f"rebuild {ref_time * 1000:9.2f} ms, "
+            f"pool {hyp_time * 1000:9.2f} ms, "
+            f"speedup {ref_time / hyp_time:5.2f}"
+        )
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    torch.manual_seed(20221017)
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    decoder = Decoder(
+        vocab_size=args.vocab_size,
+        decoder_dim=args.decoder_dim,
+        blank_id=0,
+        context_size=args.context_size,
+    )
+    joiner = Joiner(
+        encoder_dim=args.encoder_dim,
+        decoder_dim=args.decoder_dim,
+        joiner_dim=args.joiner_dim,
+        vocab_size=args.vocab_size,
+    )
+    model = DecoderJoiner(decoder=decoder, joiner=joiner)
+    model.to(device)
+    model.eval()
+
+    trivial_graph = k2.trivial_graph(args.vocab_size - 1, device=device)
+    benchmark(args, model, trivial_graph, "trivial", device)
+
+    if args.lg is not None:
+        LG = k2.Fsa.from_dict(torch.load(args.lg, map_location=device))
+        benchmark(args, model, LG, "LG", device)
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
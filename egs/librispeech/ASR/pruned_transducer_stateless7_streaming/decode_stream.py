@@ -19,6 +19,7 @@ import math
 from typing import List, Optional, Tuple
 
 import k2
+import kaldifeat
 import torch
 from beam_search import Hypothesis, HypothesisList
 
@@ -33,6 +34,7 @@ class DecodeStream(object):
         initial_states: List[torch.Tensor],
         decoding_graph: Optional[k2.Fsa] = None,
         device: torch.device = torch.device("cpu"),
+        fbank_opts: Optional[kaldifeat.FbankOptions] = None,
     ) -> None:
         """
         Args:
@@ -44,6 +46,11 @@ class DecodeStream(object):
             Used only when decoding_method is fast_beam_search.
           device:
             The device to run this stream.
+          fbank_opts:
+            If not None, the audio can be given by :meth:`accept_waveform`
+            and features are computed incrementally with these options.
+            Set `fbank_opts.frame_opts.max_feature_vectors` to bound the
+            number of frames kept by the online fbank.
         """
         if params.decoding_method == "fast_beam_search":
             assert decoding_graph is not None
@@ -55,9 +62,17 @@ class DecodeStream(object):
 
         self.states = initial_states
 
-        # It contains a 2-D tensors representing the feature frames.
+        # The slot of this stream in a StreamStatePool, if the states are
+        # kept there instead of in self.states
+        self.slot: Optional[int] = None
+
+        # It contains a 2-D tensors representing the feature frames that
+        # have not been consumed yet. self.features[0] is the
+        # self.features_offset-th frame of the utterance.
         self.features: torch.Tensor = None
+        self.features_offset: int = 0
 
+        # Number of feature frames given so far
         self.num_frames: int = 0
         # how many frames have been processed. (before subsampling).
         # we only modify this value in `func:get_feature_frames`.
@@ -65,6 +80,24 @@ class DecodeStream(object):
 
         self._done: bool = False
 
+        # True if all the features of the utterance have been given, either
+        # by `set_features` or by `accept_features` and `input_finished`.
+        self._input_finished: bool = False
+
+        self.online_fbank: Optional[kaldifeat.OnlineFbank] = None
+        # Number of samples passed to online_fbank in one call, so that
+        # frames are moved out before it discards them
+        self.max_samples_per_call: int = -1
+        if fbank_opts is not None:
+            self.online_fbank = kaldifeat.OnlineFbank(fbank_opts)
+            self.sample_rate = fbank_opts.frame_opts.samp_freq
+            max_feature_vectors = fbank_opts.frame_opts.max_feature_vectors
+            if max_feature_vectors > 0:
+                frame_shift = int(
+                    self.sample_rate * fbank_opts.frame_opts.frame_shift_ms / 1000
+                )
+                self.max_samples_per_call = max_feature_vectors // 2 * frame_shift
+
         # The transcript of current utterance.
         self.ground_truth: str = ""
 
@@ -114,14 +147,83 @@ class DecodeStream(object):
         tail_pad_len: int = 0,
     ) -> None:
         """Set features tensor of current utterance."""
+        assert self.num_frames == 0, self.num_frames
+        self.accept_features(features)
+        self.input_finished(tail_pad_len=tail_pad_len)
+
+    def accept_features(self, features: torch.Tensor) -> None:
+        """Append newly computed feature frames of the current utterance,
+        for utterances whose audio arrives incrementally. Call
+        :meth:`input_finished` after the last frames are given."""
         assert features.dim() == 2, features.dim()
+        assert not self._input_finished
+        if self.features is None or self.features.size(0) == 0:
+            self.features = features
+        else:
+            self.features = torch.cat([self.features, features])
+        self.num_frames += features.size(0)
+
+    def accept_waveform(self, samples: torch.Tensor) -> None:
+        """Compute the feature frames of newly received audio samples and
+        append them. Only usable if `fbank_opts` was given to the
+        constructor.
+
+        Args:
+          samples:
+            A 1-D float32 tensor containing samples in the range [-1, 1].
+        """
+        assert self.online_fbank is not None
+        assert samples.dim() == 1, samples.dim()
+        step = self.max_samples_per_call
+        if step <= 0:
+            step = max(samples.numel(), 1)
+        for start in range(0, samples.numel(), step):
+            self.online_fbank.accept_waveform(
+                sampling_rate=self.sample_rate,
+                waveform=samples[start : start + step],
+            )
+            self._move_online_features()
+
+    def _move_online_features(self) -> None:
+        num_frames = self.online_fbank.num_frames_ready
+        if num_frames > self.num_frames:
+            frames = [
+                self.online_fbank.get_frame(i)
+                for i in range(self.num_frames, num_frames)
+            ]
+            self.accept_features(torch.cat(frames, dim=0))
+
+    def input_finished(self, tail_pad_len: int = 0) -> None:
+        """Signal that no more audio or features will be given."""
+        if self.online_fbank is not None:
+            self.online_fbank.input_finished()
+            self._move_online_features()
+            # It is not needed any more
+            self.online_fbank = None
+
+        self._input_finished = True
+        if self.num_frames == 0:
+            # No audio is received
+            self._done = True
+            return
+
         self.features = torch.nn.functional.pad(
-            features,
+            self.features,
             (0, 0, 0, self.pad_length + tail_pad_len),
             mode="constant",
             value=self.LOG_EPS,
         )
-        self.num_frames = self.features.size(0)
+        self.num_frames += self.pad_length + tail_pad_len
+
+    def is_ready(self, chunk_size: int) -> bool:
+        """Return True if there are enough feature frames to decode the next
+        chunk of `chunk_size` frames."""
+        if self._done:
+            return False
+        num_frames = self.num_frames - self.num_processed_frames
+        if self._input_finished:
+            return num_frames > 0
+        return num_frames >= chunk_size + self.pad_length
 
     def get_feature_frames(self, chunk_size: int) -> Tuple[torch.Tensor, int]:
         """Consume chunk_size frames of features"""
@@ -129,14 +231,21 @@ class DecodeStream(object):
 
         ret_length = min(self.num_frames - self.num_processed_frames, chunk_length)
 
-        ret_features = self.features[
-            self.num_processed_frames : self.num_processed_frames + ret_length  # noqa
-        ]
+        start = self.num_processed_frames - self.features_offset
+        ret_features = self.features[start : start + ret_length]
 
         self.num_processed_frames += chunk_size
-        if self.num_processed_frames >= self.num_frames:
+        if self._input_finished and self.num_processed_frames >= self.num_frames:
             self._done = True
 
+        # Drop the frames that are not needed by later chunks. The memory is
+        # released when new frames are appended.
+        num_dropped = (
+            min(self.num_processed_frames, self.num_frames) - self.features_offset
+        )
+        self.features = self.features[num_dropped:]
+        self.features_offset += num_dropped
+
         return ret_features, ret_length
 
     def decoding_result(self) -> List[int]:
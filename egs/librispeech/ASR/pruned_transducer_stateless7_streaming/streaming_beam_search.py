@@ -15,7 +15,7 @@
 # limitations under the License.
 
 import warnings
-from typing import List
+from typing import Dict, List, Optional
 
 import k2
 import torch
@@ -24,6 +24,7 @@ from beam_search import Hypothesis, HypothesisList, get_hyps_shape
 from decode_stream import DecodeStream
 
 from icefall.decode import one_best_decoding
+from icefall.decoder_cache import DecoderOutputCache
 from icefall.utils import get_texts
 
 
@@ -97,6 +98,7 @@ def modified_beam_search(
     encoder_out: torch.Tensor,
     streams: List[DecodeStream],
     num_active_paths: int = 4,
+    decoder_cache: Optional[DecoderOutputCache] = None,
 ) -> None:
     """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
 
@@ -110,6 +112,10 @@ def modified_beam_search(
         A list of stream objects.
       num_active_paths:
         Number of active paths during the beam search.
+      decoder_cache:
+        If not None, it is used to look up the decoder output. Pass the same
+        one for all chunks to share it across chunks and streams. If None,
+        a new one is created and shared by all streams of this chunk.
     """
     assert encoder_out.ndim == 3, encoder_out.shape
     assert len(streams) == encoder_out.size(0)
@@ -120,6 +126,9 @@ def modified_beam_search(
     batch_size = len(streams)
     T = encoder_out.size(1)
 
+    if decoder_cache is None:
+        decoder_cache = DecoderOutputCache(model)
+
     B = [stream.hyps for stream in streams]
 
     for t in range(T):
@@ -135,14 +144,10 @@ def modified_beam_search(
             [hyp.log_prob.reshape(1) for hyps in A for hyp in hyps], dim=0
         )  # (num_hyps, 1)
 
-        decoder_input = torch.tensor(
-            [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
-            device=device,
-            dtype=torch.int64,
-        )  # (num_hyps, context_size)
-
-        decoder_out = model.decoder(decoder_input, need_pad=False).unsqueeze(1)
-        decoder_out = model.joiner.decoder_proj(decoder_out)
+        decoder_out = decoder_cache.get(
+            [hyp.ys[-context_size:] for hyps in A for hyp in hyps]
+        )
+        decoder_out = decoder_out.unsqueeze(1).unsqueeze(1)
         # decoder_out is of shape (num_hyps, 1, 1, decoder_output_dim)
 
         # Note: For torch 1.7.1 and below, it requires a torch.int64 tensor
@@ -197,6 +202,322 @@ def modified_beam_search(
         streams[i].hyps = B[i]
 
 
+class RnntDecodingStreamsPool(object):
+    """Keep the fast_beam_search states of the streams in one
+    k2.RnntDecodingStreams across chunks.
+
+    k2.RnntDecodingStreams copies the states of its k2.RnntDecodingStream
+    objects when it is created and writes them back in
+    `terminate_and_flush_to_streams()`, after which it can no longer be
+    advanced. All of its streams are advanced together. So the streams are
+    kept in slots of it:
+
+      - num_spare_slots spare slots are created with it, so that new streams
+        are added without creating it again. They are advanced like the other
+        slots, which costs about as much as decoding a stream in the start
+        state of the graph, so there are only a few of them.
+      - Slots that are not decoded in a chunk, i.e., spare slots, slots of
+        removed streams and slots of streams not in the batch, are advanced
+        with blank-only log-probs. This leaves their paths unchanged and adds
+        only blank arcs to their lattices.
+      - If track_partial_results is True, the partial result of each stream
+        is tracked while decoding. It is the greedy path through the contexts
+        kept in the beam, so it can differ from the best path of the lattice,
+        which is the final result.
+      - Lattices are generated only for finished streams. It is then flushed
+        and created again without the finished and the removed streams.
+
+    Streams added to the pool must not have been decoded, and must use the
+    decoding graph of the pool.
+    """
+
+    def __init__(
+        self,
+        config: k2.RnntDecodingConfig,
+        decoding_graph: k2.Fsa,
+        num_spare_slots: int = 1,
+        track_partial_results: bool = True,
+    ):
+        self.config = config
+        self.decoding_graph = decoding_graph
+        self.num_spare_slots = num_spare_slots
+        self.track_partial_results = track_partial_results
+
+        self.decoding_streams: Optional[k2.RnntDecodingStreams] = None
+        # slots[i] is the stream in slot i, or None if it is not used
+        self.slots: List[Optional[DecodeStream]] = []
+        # The k2.RnntDecodingStream of each slot
+        self.rnnt_streams: List[k2.RnntDecodingStream] = []
+        # Number of frames advanced in each slot
+        self.num_frames: List[int] = []
+        # offsets[i] is the number of frames advanced in slot i that are
+        # not frames of its stream
+        self.offsets: List[int] = []
+        # Slots that have never been used
+        self.spare_slots: List[int] = []
+        # Map id() of a stream to its slot
+        self.slot_of: Dict[int, int] = {}
+
+        # The last context on the greedy path of each slot, of shape
+        # (num_slots, context_size)
+        self.contexts: Optional[torch.Tensor] = None
+        # The token on the greedy path of each slot, for each frame that
+        # is not in self.hyps yet. 0 means no token.
+        self.tokens: List[torch.Tensor] = []
+        # The tokens on the greedy path of each slot
+        self.hyps: List[List[int]] = []
+
+        # Number of chunks decoded with this pool
+        self.num_chunks = 0
+        self.num_created = 0
+        self.num_added = 0
+
+    def _create(self, num_new_slots: int) -> None:
+        """Create self.decoding_streams with the used slots, followed by
+        num_new_slots + self.num_spare_slots new slots."""
+        self._collect_tokens()
+        if self.decoding_streams is not None:
+            self.decoding_streams.terminate_and_flush_to_streams()
+
+        kept = [i for i, s in enumerate(self.slots) if s is not None]
+        num_new_slots += self.num_spare_slots
+        self.slots = [self.slots[i] for i in kept] + [None] * num_new_slots
+        new_streams = [
+            k2.RnntDecodingStream(self.decoding_graph) for _ in range(num_new_slots)
+        ]
+        self.rnnt_streams = [self.rnnt_streams[i] for i in kept] + new_streams
+        new_frames = [0] * num_new_slots
+        self.num_frames = [self.num_frames[i] for i in kept] + new_frames
+        self.offsets = [self.offsets[i] for i in kept] + new_frames
+        self.spare_slots = list(range(len(kept), len(self.slots)))
+        self.slot_of = {id(s): i for i, s in enumerate(self.slots[: len(kept)])}
+        new_hyps = [[] for _ in range(num_new_slots)]
+        self.hyps = [self.hyps[i] for i in kept] + new_hyps
+
+        device = self.decoding_graph.device
+        contexts = torch.zeros(
+            num_new_slots,
+            self.config.decoder_history_len,
+            dtype=torch.int64,
+            device=device,
+        )
+        if len(kept) > 0:
+            kept = torch.tensor(kept, device=device)
+            contexts = torch.cat([self.contexts[kept], contexts])
+        self.contexts = contexts
+
+        if len(self.slots) == 0:
+            # k2.RnntDecodingStreams needs at least one stream. It is created
+            # when streams are added.
+            self.decoding_streams = None
+            return
+        self.decoding_streams = k2.RnntDecodingStreams(self.rnnt_streams, self.config)
+        self.num_created += 1
+
+    def _get_slots(self, streams: List[DecodeStream]) -> List[int]:
+        """Return the slots of the given streams, adding the streams that
+        are not in the pool."""
+        new_streams = [s for s in streams if id(s) not in self.slot_of]
+        num_spare_slots = len(self.spare_slots)
+        if self.decoding_streams is None or len(new_streams) > num_spare_slots:
+            self._create(len(new_streams))
+
+        for s in new_streams:
+            i = self.spare_slots.pop(0)
+            self.slots[i] = s
+            self.slot_of[id(s)] = i
+            self.offsets[i] = self.num_frames[i]
+            s.rnnt_decoding_stream = self.rnnt_streams[i]
+            self.num_added += 1
+        return [self.slot_of[id(s)] for s in streams]
+
+    def remove(self, stream: DecodeStream) -> None:
+        """Remove the given stream from the pool, if it is in it. Its slot
+        is freed when self.decoding_streams is created again."""
+        i = self.slot_of.pop(id(stream), None)
+        if i is not None:
+            self.slots[i] = None
+            self.hyps[i] = []
+
+    def advance(
+        self,
+        model: nn.Module,
+        encoder_out: torch.Tensor,
+        streams: List[DecodeStream],
+    ) -> None:
+        """Decode one chunk of the given streams, adding the streams that
+        are not in the pool.
+
+        Args:
+          model:
+            An instance of `Transducer`.
+          encoder_out:
+            A tensor of shape (N, T, C) from the encoder.
+          streams:
+            A list of N streams.
+        """
+        assert encoder_out.size(0) == len(streams)
+        T = encoder_out.size(1)
+        device = encoder_out.device
+        slots = self._get_slots(streams)
+        self.num_chunks += 1
+
+        decoded = set(slots)
+        for i, s in enumerate(self.slots):
+            if s is not None and i not in decoded:
+                self.offsets[i] += T
+        self.num_frames = [n + T for n in self.num_frames]
+
+        # batch_index[i] is the index in the batch of the stream in slot i,
+        # or -1 if slot i is not decoded
+        batch_index = torch.full(
+            (len(self.slots),), -1, dtype=torch.int64, device=device
+        )
+        batch_index[torch.tensor(slots, device=device)] = torch.arange(
+            len(slots), device=device
+        )
+
+        for t in range(T):
+            # shape is a RaggedShape of shape (num_slots, context)
+            # contexts is a Tensor of shape (shape.NumElements(), context_size)
+            shape, contexts = self.decoding_streams.get_contexts()
+            # `nn.Embedding()` in torch below v1.7.1 supports only torch.int64
+            contexts = contexts.to(torch.int64)
+            row_ids = shape.row_ids(1).to(torch.int64)
+            row_index = batch_index[row_ids]
+            # The contexts of the decoded slots
+            rows = torch.nonzero(row_index >= 0).squeeze(1)
+
+            decoder_out = model.decoder(contexts[rows], need_pad=False)
+            decoder_out = model.joiner.decoder_proj(decoder_out)
+            # fmt: off
+            current_encoder_out = encoder_out[row_index[rows], t:t + 1, :]
+            # fmt: on
+            logits = model.joiner(
+                current_encoder_out.unsqueeze(2),
+                decoder_out.unsqueeze(1),
+                project_input=False,
+            )
+            logits = logits.squeeze(1).squeeze(1)
+
+            # k2 uses 0 as the blank
+            log_probs = torch.full(
+                (row_ids.numel(), logits.size(1)),
+                -1.0e10,
+                dtype=logits.dtype,
+                device=device,
+            )
+            log_probs[:, 0] = 0
+            log_probs[rows] = logits.log_softmax(dim=-1)
+            self.decoding_streams.advance(log_probs)
+            if self.track_partial_results:
+                self._extend_greedy_paths(shape, row_ids, contexts, log_probs)
+
+    def _extend_greedy_paths(
+        self,
+        shape: k2.RaggedShape,
+        row_ids: torch.Tensor,
+        contexts: torch.Tensor,
+        log_probs: torch.Tensor,
+    ) -> None:
+        """Extend the greedy path of each slot by one frame.
+
+        The path continues from the context of the slot that ends the path,
+        if it is kept in the beam, otherwise from the context with the
+        highest log-prob.
+        """
+        best_log_probs, best_tokens = log_probs.max(dim=1)
+        on_path = (contexts == self.contexts[row_ids]).all(dim=1)
+        scores = best_log_probs + on_path.to(log_probs.dtype) * 1.0e5
+        best_rows = k2.RaggedTensor(shape, scores).argmax().to(torch.int64)
+        # It is -1 for slots without contexts
+        has_rows = best_rows >= 0
+        best_rows = best_rows.clamp(min=0)
+
+        tokens = best_tokens[best_rows].masked_fill(~has_rows, 0)
+        emitted = tokens != 0
+        best_contexts = contexts[best_rows]
+        next_contexts = torch.cat([best_contexts[:, 1:], tokens.unsqueeze(1)], dim=1)
+        next_contexts = torch.where(emitted.unsqueeze(1), next_contexts, best_contexts)
+        self.contexts = torch.where(has_rows.unsqueeze(1), next_contexts, self.contexts)
+        self.tokens.append(tokens)
+
+    def _collect_tokens(self) -> None:
+        """Move the tokens in self.tokens to self.hyps."""
+        if len(self.tokens) == 0:
+            return
+        tokens = torch.stack(self.tokens, dim=1).tolist()
+        self.tokens = []
+        for i, s in enumerate(self.slots):
+            if s is not None:
+                self.hyps[i].extend(t for t in tokens[i] if t != 0)
+
+    def get_partial_results(self, streams: List[DecodeStream]) -> List[List[int]]:
+        """Return the tokens on the greedy path of each of the given streams.
+        It does not flush self.decoding_streams."""
+        assert self.track_partial_results
+        self._collect_tokens()
+        return [list(self.hyps[self.slot_of[id(s)]]) for s in streams]
+
+    def finalize(
+        self, streams: List[DecodeStream], num_frames: List[int]
+    ) -> List[List[int]]:
+        """Return the tokens on the best path of each of the given streams
+        and remove them from the pool.
+
+        The lattices are generated only for the given streams.
+
+        Args:
+          streams:
+            The finished streams.
+          num_frames:
+            num_frames[i] is the number of frames decoded in streams[i].
+        Returns:
+          Return a list of token lists.
+        """
+        assert len(streams) == len(num_frames)
+        slots = [self.slot_of[id(s)] for s in streams]
+        # Empty lattices are generated for the other slots
+        slot_num_frames = [0] * len(self.slots)
+        for i, n in zip(slots, num_frames):
+            slot_num_frames[i] = self.offsets[i] + n
+
+        self._collect_tokens()
+        self.decoding_streams.terminate_and_flush_to_streams()
+        lattice = self.decoding_streams.format_output(slot_num_frames)
+        self.decoding_streams = None
+
+        best_path = one_best_decoding(lattice)
+        hyp_tokens = get_texts(best_path)
+
+        for s in streams:
+            self.remove(s)
+        self._create(0)
+        return [hyp_tokens[i] for i in slots]
+
+    def __str__(self) -> str:
+        return (
+            f"RnntDecodingStreamsPool: {self.num_chunks} chunks, "
+            f"{self.num_added} streams added, "
+            f"created {self.num_created} times"
+        )
+
+
+def get_rnnt_decoding_config(
+    model: nn.Module,
+    beam: float,
+    max_states: int,
+    max_contexts: int,
+) -> k2.RnntDecodingConfig:
+    return k2.RnntDecodingConfig(
+        vocab_size=model.decoder.vocab_size,
+        decoder_history_len=model.decoder.context_size,
+        beam=beam,
+        max_contexts=max_contexts,
+        max_states=max_states,
+    )
+
+
 def fast_beam_search_one_best(
     model: nn.Module,
     encoder_out: torch.Tensor,
@@ -205,6 +526,9 @@ def fast_beam_search_one_best(
     beam: float,
     max_states: int,
     max_contexts: int,
+    decoding_streams_pool: Optional[RnntDecodingStreamsPool] = None,
+    need_results: Optional[List[bool]] = None,
+    finished: Optional[List[bool]] = None,
 ) -> None:
     """It limits the maximum number of symbols per frame to 1.
 
@@ -227,20 +551,46 @@ def fast_beam_search_one_best(
         Max states per stream per frame.
       max_contexts:
         Max contexts pre stream per frame.
+      decoding_streams_pool:
+        If not None, the streams are decoded in it across chunks. Its config
+        overrides `beam`, `max_states` and `max_contexts`. Otherwise,
+        `streams[i].hyp` is updated with the final result of all streams.
+      need_results:
+        Used only with `decoding_streams_pool`. If need_results[i] is True,
+        `streams[i].hyp` is updated with its partial result.
+      finished:
+        Used only with `decoding_streams_pool`. If finished[i] is True, this
+        is the last chunk of streams[i]. `streams[i].hyp` is updated with its
+        final result and it is removed from the pool.
     """
     assert encoder_out.ndim == 3
     B, T, C = encoder_out.shape
     assert B == len(streams)
 
-    context_size = model.decoder.context_size
-    vocab_size = model.decoder.vocab_size
+    if decoding_streams_pool is not None:
+        decoding_streams_pool.advance(model, encoder_out, streams)
 
-    config = k2.RnntDecodingConfig(
-        vocab_size=vocab_size,
-        decoder_history_len=context_size,
-        beam=beam,
-        max_contexts=max_contexts,
-        max_states=max_states,
+        indexes = [i for i in range(B) if need_results and need_results[i]]
+        if len(indexes) > 0:
+            hyp_tokens = decoding_streams_pool.get_partial_results(
+                [streams[i] for i in indexes]
+            )
+            for i, hyp in zip(indexes, hyp_tokens):
+                streams[i].hyp = hyp
+
+        indexes = [i for i in range(B) if finished and finished[i]]
+        if len(indexes) > 0:
+            num_frames = processed_lens.tolist()
+            hyp_tokens = decoding_streams_pool.finalize(
+                [streams[i] for i in indexes],
+                [num_frames[i] for i in indexes],
+            )
+            for i, hyp in zip(indexes, hyp_tokens):
+                streams[i].hyp = hyp
+        return
+
+    config = get_rnnt_decoding_config(
+        model, beam=beam, max_states=max_states, max_contexts=max_contexts
     )
     individual_streams = []
     for i in range(B):
@@ -277,6 +627,5 @@ def fast_beam_search_one_best(
     lattice = decoding_streams.format_output(processed_lens.tolist())
     best_path = one_best_decoding(lattice)
     hyp_tokens = get_texts(best_path)
-
     for i in range(B):
         streams[i].hyp = hyp_tokens[i]
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A load generator for ./pruned_transducer_stateless7_streaming/streaming_server.py
+
+It opens --num-streams concurrent connections. Each connection sends one
+of the given sound files in chunks of --chunk-ms milliseconds. By default,
+chunks are sent in real time.
+
+It reports:
+  - The chunk latency, i.e., the time from sending a chunk to receiving
+    the first result that covers the whole chunk.
+  - The real-time factor (RTF), i.e., the time from sending the first
+    chunk to receiving the final result, divided by the audio duration.
+
+Usage:
+
+./pruned_transducer_stateless7_streaming/streaming_client.py \
+  --server-addr localhost \
+  --server-port 6006 \
+  --num-streams 100 \
+  /path/to/foo.wav \
+  /path/to/bar.wav
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import struct
+import time
+from typing import List, Optional
+
+import numpy as np
+import torch
+import torchaudio
+
+from icefall.utils import str2bool
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--server-addr",
+        type=str,
+        default="localhost",
+        help="Address of the server",
+    )
+
+    parser.add_argument(
+        "--server-port",
+        type=int,
+        default=6006,
+        help="Port of the server",
+    )
+
+    parser.add_argument(
+        "--num-streams",
+        type=int,
+        default=10,
+        help="Number of concurrent streams",
+    )
+
+    parser.add_argument(
+        "--chunk-ms",
+        type=float,
+        default=100,
+        help="Duration of the audio in each message, in milliseconds",
+    )
+
+    parser.add_argument(
+        "--real-time",
+        type=str2bool,
+        default=True,
+        help="""If True, send the audio in real time. Otherwise, send it as
+        fast as possible.""",
+    )
+
+    parser.add_argument(
+        "--sample-rate",
+        type=int,
+        default=16000,
+        help="The sample rate of the server",
+    )
+
+    parser.add_argument(
+        "--max-message-size",
+        type=int,
+        default=1 << 20,
+        help="""Maximum size in bytes of a message from the server. The
+        connection is closed if a larger one is received.""",
+    )
+
+    parser.add_argument(
+        "sound_files",
+        type=str,
+        nargs="+",
+        help="The input sound file(s) to send. "
+        "The i-th stream sends the (i % num_files)-th file.",
+    )
+
+    return parser
+
+
+def read_sound_files(
+    filenames: List[str], expected_sample_rate: float
+) -> List[np.ndarray]:
+    """Read a list of sound files into a list 1-D float32 arrays.
+    Args:
+      filenames:
+        A list of sound filenames.
+      expected_sample_rate:
+        The expected sample rate of the sound files.
+    Returns:
+      Return a list of 1-D float32 arrays.
+    """
+    ans = []
+    for f in filenames:
+        wave, sample_rate = torchaudio.load(f)
+        assert (
+            sample_rate == expected_sample_rate
+        ), f"expected sample rate: {expected_sample_rate}. Given: {sample_rate}"
+        # We use only the first channel
+        ans.append(wave[0].numpy().astype(np.float32))
+    return ans
+
+
+async def read_message(
+    reader: asyncio.StreamReader, max_length: int
+) -> Optional[bytes]:
+    try:
+        header = await reader.readexactly(4)
+        (length,) = struct.unpack(">I", header)
+        if length > max_length:
+            logging.warning(
+                f"Received a message of {length} bytes, "
+                f"larger than {max_length} bytes"
+            )
+            return None
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def write_message(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    writer.write(struct.pack(">I", len(payload)) + payload)
+
+
+class StreamStats(object):
+    def __init__(self, duration: float):
+        self.duration = duration
+        self.chunk_latencies: List[float] = []
+        self.elapsed = 0.0
+        self.text = ""
+
+
+async def run_stream(
+    args: argparse.Namespace, samples: np.ndarray, stats: StreamStats
+) -> None:
+    reader, writer = await asyncio.open_connection(args.server_addr, args.server_port)
+
+    chunk_size = int(args.sample_rate * args.chunk_ms / 1000)
+    # (end sample of the chunk, time when it is sent)
+    pending = []
+
+    async def receive():
+        while True:
+            payload = await read_message(reader, args.max_message_size)
+            if payload is None:
+                writer.close()
+                raise RuntimeError(
+                    "The server closed the connection or sent an invalid message"
+                )
+            now = time.time()
+            result = json.loads(payload.decode("utf-8"))
+            while pending and pending[0][0] <= result["num_samples"]:
+                stats.chunk_latencies.append(now - pending.pop(0)[1])
+            if result["final"]:
+                stats.text = result["text"]
+                return
+
+    receiver = asyncio.create_task(receive())
+
+    start = time.time()
+    for i, offset in enumerate(range(0, samples.size, chunk_size)):
+        if args.real_time:
+            # Wait until the audio of this chunk has been "recorded"
+            delay = start + (offset + chunk_size) / args.sample_rate - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        chunk = samples[offset : offset + chunk_size]
+        pending.append((offset + chunk.size, time.time()))
+        write_message(writer, chunk.astype("<f4").tobytes())
+        await writer.drain()
+
+    write_message(writer, b"")
+    await writer.drain()
+
+    await receiver
+    stats.elapsed = time.time() - start
+
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run(args: argparse.Namespace, waves: List[np.ndarray]) -> List[StreamStats]:
+    stats = [
+        StreamStats(duration=waves[i % len(waves)].size / args.sample_rate)
+        for i in range(args.num_streams)
+    ]
+    await asyncio.gather(
+        *[
+            run_stream(args, waves[i % len(waves)], stats[i])
+            for i in range(args.num_streams)
+        ]
+    )
+    return stats
+
+
+def main():
+    args = get_parser().parse_args()
+
+    waves = read_sound_files(args.sound_files, expected_sample_rate=args.sample_rate)
+
+    start = time.time()
+    stats = asyncio.run(run(args, waves))
+    elapsed = time.time() - start
+
+    for i, s in enumerate(stats[: len(waves)]):
+        logging.info(f"{args.sound_files[i]}: {s.text}")
+
+    latencies = torch.tensor([t for s in stats for t in s.chunk_latencies]) * 1000
+    p50, p95, p99 = latencies.quantile(torch.tensor([0.5, 0.95, 0.99])).tolist()
+    logging.info(
+        f"Chunk latency over {latencies.numel()} chunks: "
+        f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, "
+        f"max {latencies.max().item():.1f} ms"
+    )
+
+    rtf = [s.elapsed / s.duration for s in stats]
+    total_duration = sum(s.duration for s in stats)
+    logging.info(
+        f"{args.num_streams} streams, {total_duration:.2f} s of audio "
+        f"in {elapsed:.2f} s. "
+        f"RTF per stream: mean {sum(rtf) / len(rtf):.3f}, max {max(rtf):.3f}. "
+        f"Aggregate RTF: {elapsed / total_duration:.4f}"
+    )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
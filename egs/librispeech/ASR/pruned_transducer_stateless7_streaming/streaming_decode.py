@@ -38,17 +38,20 @@ import sentencepiece as spm
 import torch
 import torch.nn as nn
 from asr_datamodule import LibriSpeechAsrDataModule
+from beam_search import DecoderOutputCache
 from decode_stream import DecodeStream
-from kaldifeat import Fbank, FbankOptions
+from kaldifeat import FbankOptions
 from lhotse import CutSet
 from streaming_beam_search import (
+    RnntDecodingStreamsPool,
     fast_beam_search_one_best,
+    get_rnnt_decoding_config,
     greedy_search,
     modified_beam_search,
 )
 from torch.nn.utils.rnn import pad_sequence
 from train import add_model_arguments, get_params, get_transducer_model
-from zipformer import stack_states, unstack_states
+from zipformer import StreamStatePool, stack_states, unstack_states
 
 from icefall.checkpoint import (
     average_checkpoints,
@@ -177,6 +180,16 @@ def get_parser():
         help="The context size in the decoder. 1 means bigram; 2 means tri-gram",
     )
 
+    parser.add_argument(
+        "--partial-result-interval",
+        type=int,
+        default=0,
+        help="""Compute the partial results of the streams every this number
+        of decoded chunks. 0 means only the final result is computed. Results of other
+        decoding methods are always up to date, so it is used only when
+        --decoding-method is fast_beam_search""",
+    )
+
     parser.add_argument(
         "--num-decode-streams",
         type=int,
@@ -193,6 +206,9 @@ def decode_one_chunk(
     params: AttributeDict,
     model: nn.Module,
     decode_streams: List[DecodeStream],
+    decoder_cache: Optional[DecoderOutputCache] = None,
+    state_pool: Optional[StreamStatePool] = None,
+    decoding_streams_pool: Optional[RnntDecodingStreamsPool] = None,
 ) -> List[int]:
     """Decode one chunk frames of features for each decode_streams and
     return the indexes of finished streams in a List.
@@ -204,6 +220,15 @@ def decode_one_chunk(
         The neural model.
       decode_streams:
         A List of DecodeStream, each belonging to a utterance.
+      decoder_cache:
+        The cache of decoder outputs shared across chunks and streams.
+        Used only when --decoding-method is modified_beam_search.
+      state_pool:
+        If not None, the encoder states of the streams are kept in it, in
+        the slots given by `DecodeStream.slot`, instead of `DecodeStream.states`.
+      decoding_streams_pool:
+        The pool of k2 decoding streams shared across chunks. Used only when
+        --decoding-method is fast_beam_search.
     Returns:
       Return a List containing which DecodeStreams are finished.
     """
@@ -218,7 +243,8 @@ def decode_one_chunk(
         feat, feat_len = stream.get_feature_frames(params.decode_chunk_len)
         features.append(feat)
         feature_lens.append(feat_len)
-        states.append(stream.states)
+        if state_pool is None:
+            states.append(stream.states)
         processed_lens.append(stream.done_frames)
 
     feature_lens = torch.tensor(feature_lens, device=device)
@@ -238,7 +264,14 @@ def decode_one_chunk(
             value=LOG_EPS,
         )
 
-    states = stack_states(states)
+    if state_pool is None:
+        states = stack_states(states)
+    else:
+        slots = [stream.slot for stream in decode_streams]
+        if slots == list(range(state_pool.num_streams)):
+            # All streams, in the order of their slots. Use views of the pool.
+            slots = None
+        states = state_pool.get_states(slots)
     processed_lens = torch.tensor(processed_lens, device=device)
 
     encoder_out, encoder_out_lens, new_states = model.encoder.streaming_forward(
@@ -253,6 +286,12 @@ def decode_one_chunk(
         greedy_search(model=model, encoder_out=encoder_out, streams=decode_streams)
     elif params.decoding_method == "fast_beam_search":
         processed_lens = processed_lens + encoder_out_lens
+        # Partial results are computed for all streams of the chunk at once
+        interval = params.partial_result_interval
+        is_due = interval > 0 and (
+            decoding_streams_pool is None
+            or (decoding_streams_pool.num_chunks + 1) % interval == 0
+        )
         fast_beam_search_one_best(
             model=model,
             encoder_out=encoder_out,
@@ -261,6 +300,9 @@ def decode_one_chunk(
             beam=params.beam,
             max_states=params.max_states,
             max_contexts=params.max_contexts,
+            decoding_streams_pool=decoding_streams_pool,
+            need_results=[is_due] * len(decode_streams),
+            finished=[stream.done for stream in decode_streams],
         )
     elif params.decoding_method == "modified_beam_search":
         modified_beam_search(
@@ -268,15 +310,20 @@ def decode_one_chunk(
             streams=decode_streams,
             encoder_out=encoder_out,
             num_active_paths=params.num_active_paths,
+            decoder_cache=decoder_cache,
         )
     else:
         raise ValueError(f"Unsupported decoding method: {params.decoding_method}")
 
-    states = unstack_states(new_states)
+    if state_pool is None:
+        states = unstack_states(new_states)
+        for i in range(len(decode_streams)):
+            decode_streams[i].states = states[i]
+    else:
+        state_pool.set_states(new_states, slots)
 
     finished_streams = []
     for i in range(len(decode_streams)):
-        decode_streams[i].states = states[i]
         decode_streams[i].done_frames += encoder_out_lens[i]
         if decode_streams[i].done:
             finished_streams.append(i)
@@ -284,6 +331,55 @@ def decode_one_chunk(
     return finished_streams
 
 
+def feed_samples(
+    params: AttributeDict,
+    decode_streams: List[DecodeStream],
+    pending_samples: Dict[str, torch.Tensor],
+) -> None:
+    """Give each stream the audio samples needed by its next chunk, as
+    if the audio were arriving in real time.
+
+    Args:
+      params:
+        It's the return value of :func:`get_params`.
+      decode_streams:
+        A List of DecodeStream, created with `fbank_opts`.
+      pending_samples:
+        pending_samples[stream.id] contains the samples of the stream that
+        have not been given to it. It is removed when all of them are given.
+    """
+    for stream in decode_streams:
+        # The frame shift is 10 ms
+        chunk_samples = params.decode_chunk_len * int(stream.sample_rate) // 100
+        samples = pending_samples.get(stream.id)
+        while samples is not None and not stream.is_ready(params.decode_chunk_len):
+            stream.accept_waveform(samples[:chunk_samples])
+            samples = samples[chunk_samples:]
+            if samples.numel() == 0:
+                stream.input_finished(tail_pad_len=params.decode_chunk_len)
+                del pending_samples[stream.id]
+                samples = None
+        if samples is not None:
+            pending_samples[stream.id] = samples
+
+
+def remove_decode_stream(
+    decode_streams: List[DecodeStream],
+    i: int,
+    state_pool: StreamStatePool,
+) -> None:
+    """Remove decode_streams[i] and free its slot in state_pool.
+
+    decode_streams[j] is assumed to be in slot j of state_pool. The last
+    stream is moved into slot i, and so it is moved to decode_streams[i].
+    """
+    assert decode_streams[i].slot == i, (decode_streams[i].slot, i)
+    last = state_pool.remove(i)
+    decode_streams[i] = decode_streams[last]
+    decode_streams[i].slot = i
+    decode_streams.pop()
+
+
 def decode_dataset(
     cuts: CutSet,
     params: AttributeDict,
@@ -320,21 +416,46 @@ def decode_dataset(
     opts.frame_opts.snip_edges = False
     opts.frame_opts.samp_freq = 16000
     opts.mel_opts.num_bins = 80
+    # Frames are moved to the decode stream as soon as they are computed
+    opts.frame_opts.max_feature_vectors = 2 * params.decode_chunk_len
 
     log_interval = 50
 
+    decoder_cache = None
+    if params.decoding_method == "modified_beam_search":
+        decoder_cache = DecoderOutputCache(model)
+
+    decoding_streams_pool = None
+    if params.decoding_method == "fast_beam_search":
+        decoding_streams_pool = RnntDecodingStreamsPool(
+            get_rnnt_decoding_config(
+                model,
+                beam=params.beam,
+                max_states=params.max_states,
+                max_contexts=params.max_contexts,
+            ),
+            decoding_graph,
+            track_partial_results=params.partial_result_interval > 0,
+        )
+
+    initial_states = model.encoder.get_init_state(device=device)
+    state_pool = StreamStatePool(initial_states, max_streams=params.num_decode_streams)
+
     decode_results = []
     # Contain decode streams currently running.
+    # decode_streams[i] is in slot i of state_pool.
     decode_streams = []
+    # The audio samples of each stream that have not been given to it
+    pending_samples = {}
     for num, cut in enumerate(cuts):
         # each utterance has a DecodeStream.
-        initial_states = model.encoder.get_init_state(device=device)
         decode_stream = DecodeStream(
             params=params,
             cut_id=cut.id,
             initial_states=initial_states,
             decoding_graph=decoding_graph,
             device=device,
+            fbank_opts=opts,
         )
 
         audio: np.ndarray = cut.load_audio()
@@ -348,16 +469,21 @@ def decode_dataset(
 
         samples = torch.from_numpy(audio).squeeze(0)
 
-        fbank = Fbank(opts)
-        feature = fbank(samples.to(device))
-        decode_stream.set_features(feature, tail_pad_len=params.decode_chunk_len)
+        pending_samples[decode_stream.id] = samples.to(device)
         decode_stream.ground_truth = cut.supervisions[0].text
+        decode_stream.slot = state_pool.add()
 
         decode_streams.append(decode_stream)
 
         while len(decode_streams) >= params.num_decode_streams:
+            feed_samples(params, decode_streams, pending_samples)
             finished_streams = decode_one_chunk(
-                params=params, model=model, decode_streams=decode_streams
+                params=params,
+                model=model,
+                decode_streams=decode_streams,
+                decoder_cache=decoder_cache,
+                state_pool=state_pool,
+                decoding_streams_pool=decoding_streams_pool,
             )
             for i in sorted(finished_streams, reverse=True):
                 decode_results.append(
@@ -367,15 +493,21 @@ def decode_dataset(
                         sp.decode(decode_streams[i].decoding_result()).split(),
                     )
                 )
-                del decode_streams[i]
+                remove_decode_stream(decode_streams, i, state_pool)
 
         if num % log_interval == 0:
             logging.info(f"Cuts processed until now is {num}.")
 
     # decode final chunks of last sequences
     while len(decode_streams):
+        feed_samples(params, decode_streams, pending_samples)
         finished_streams = decode_one_chunk(
-            params=params, model=model, decode_streams=decode_streams
+            params=params,
+            model=model,
+            decode_streams=decode_streams,
+            decoder_cache=decoder_cache,
+            state_pool=state_pool,
+            decoding_streams_pool=decoding_streams_pool,
         )
         for i in sorted(finished_streams, reverse=True):
             decode_results.append(
@@ -385,7 +517,12 @@ def decode_dataset(
                     sp.decode(decode_streams[i].decoding_result()).split(),
                 )
             )
-            del decode_streams[i]
+            remove_decode_stream(decode_streams, i, state_pool)
+
+    if decoder_cache is not None:
+        logging.info(f"{decoder_cache}")
+    if decoding_streams_pool is not None:
+        logging.info(f"{decoding_streams_pool}")
 
     if params.decoding_method == "greedy_search":
         key = "greedy_search"
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A real-time streaming ASR server. Each TCP connection sends the audio of
+one utterance in chunks and receives partial and final results while it
+is sending.
+
+Chunks that are ready to decode, from all connections, are grouped into
+micro-batches. A micro-batch is decoded as soon as it has
+--max-batch-size streams or its oldest chunk has waited for
+--max-wait-ms milliseconds.
+
+Protocol: every message is a 4-byte big-endian length followed by the
+payload.
+  - client -> server: float32 little-endian samples in the range [-1, 1]
+    at --sample-rate Hz. An empty message marks the end of the utterance.
+  - server -> client: a UTF-8 JSON object
+    {"text": str, "final": bool, "num_samples": int}, where num_samples is
+    the number of samples that have been decoded so far.
+
+Usage:
+
+./pruned_transducer_stateless7_streaming/streaming_server.py \
+  --checkpoint ./pruned_transducer_stateless7_streaming/exp/pretrained.pt \
+  --bpe-model ./data/lang_bpe_500/bpe.model \
+  --decode-chunk-len 32 \
+  --decoding-method greedy_search \
+  --port 6006
+
+You can use ./pruned_transducer_stateless7_streaming/streaming_client.py
+to send requests to it.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import k2
+import kaldifeat
+import numpy as np
+import sentencepiece as spm
+import torch
+from beam_search import DecoderOutputCache
+from decode_stream import DecodeStream
+from streaming_beam_search import RnntDecodingStreamsPool, get_rnnt_decoding_config
+from streaming_decode import decode_one_chunk
+from train import add_model_arguments, get_params, get_transducer_model
+from zipformer import StreamStatePool
+
+from icefall.utils import AttributeDict
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        required=True,
+        help="Path to the checkpoint. "
+        "The checkpoint is assumed to be saved by "
+        "icefall.checkpoint.save_checkpoint().",
+    )
+
+    parser.add_argument(
+        "--bpe-model",
+        type=str,
+        help="""Path to bpe.model.""",
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=6006,
+        help="The port on which the server listens",
+    )
+
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=50,
+        help="Max number of streams in a micro-batch",
+    )
+
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=10,
+        help="""Max time in milliseconds that a chunk that is ready to
+        decode waits for other streams to join its micro-batch""",
+    )
+
+    parser.add_argument(
+        "--sample-rate",
+        type=int,
+        default=16000,
+        help="The sample rate of the received audio",
+    )
+
+    parser.add_argument(
+        "--decoding-method",
+        type=str,
+        default="greedy_search",
+        help="""Supported decoding methods are:
+        greedy_search
+        modified_beam_search
+        fast_beam_search
+        """,
+    )
+
+    parser.add_argument(
+        "--num_active_paths",
+        type=int,
+        default=4,
+        help="""An interger indicating how many candidates we will keep for each
+        frame. Used only when --decoding-method is modified_beam_search.""",
+    )
+
+    parser.add_argument(
+        "--beam",
+        type=float,
+        default=4,
+        help="""A floating point value to calculate the cutoff score during beam
+        search (i.e., `cutoff = max-score - beam`), which is the same as the
+        `beam` in Kaldi.
+        Used only when --decoding-method is fast_beam_search""",
+    )
+
+    parser.add_argument(
+        "--max-contexts",
+        type=int,
+        default=4,
+        help="""Used only when --decoding-method is
+        fast_beam_search""",
+    )
+
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=32,
+        help="""Used only when --decoding-method is
+        fast_beam_search""",
+    )
+
+    parser.add_argument(
+        "--partial-result-interval",
+        type=int,
+        default=1,
+        help="""Compute the partial results of the streams every this number
+        of decoded chunks. 0 means only the final result is computed. Partial
+        results are the greedy paths through the beam and can differ from
+        the final results. Results of other decoding methods are always up to
+        date, so it is used only when --decoding-method is fast_beam_search""",
+    )
+
+    parser.add_argument(
+        "--max-message-size",
+        type=int,
+        default=1 << 20,
+        help="""Maximum size in bytes of a message from the client. The
+        connection is closed if a larger one is received.""",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; 2 means tri-gram",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+async def read_message(
+    reader: asyncio.StreamReader, max_length: int
+) -> Optional[bytes]:
+    """Return the payload of the next message, or None if the connection
+    is closed or the message is longer than `max_length` bytes."""
+    try:
+        header = await reader.readexactly(4)
+        (length,) = struct.unpack(">I", header)
+        if length > max_length:
+            logging.warning(
+                f"Received a message of {length} bytes, "
+                f"larger than {max_length} bytes"
+            )
+            return None
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def write_message(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    writer.write(struct.pack(">I", len(payload)) + payload)
+
+
+class Connection(object):
+    """A client connection, which sends the audio of one utterance."""
+
+    def __init__(
+        self,
+        server: "StreamingServer",
+        writer: asyncio.StreamWriter,
+        stream: DecodeStream,
+    ):
+        self.server = server
+        self.writer = writer
+        self.stream = stream
+
+        self.num_samples = 0
+
+        # True while the stream is being decoded in the executor. Audio
+        # received meanwhile is kept in pending_samples and given to the
+        # stream after decoding, as the stream is not thread safe.
+        self.decoding = False
+        self.pending_samples: List[torch.Tensor] = []
+        self.pending_input_finished = False
+
+        # True if the stream is in the ready queue of the server
+        self.queued = False
+        # The time when the stream was put into the ready queue
+        self.ready_time = 0.0
+        # True if the client has gone
+        self.closed = False
+        # Set when the final result is sent
+        self.finished = asyncio.Event()
+
+    def accept_waveform(self, samples: torch.Tensor) -> None:
+        self.num_samples += samples.numel()
+        samples = samples.to(self.server.device)
+        if self.decoding:
+            self.pending_samples.append(samples)
+        else:
+            self.stream.accept_waveform(samples)
+
+    def input_finished(self) -> None:
+        if self.decoding:
+            self.pending_input_finished = True
+        else:
+            self.stream.input_finished(tail_pad_len=self.server.params.decode_chunk_len)
+
+    def decoding_finished(self) -> None:
+        """Give the audio received during decoding to the stream."""
+        self.decoding = False
+        if self.pending_samples:
+            self.stream.accept_waveform(torch.cat(self.pending_samples))
+            self.pending_samples = []
+        if self.pending_input_finished:
+            self.pending_input_finished = False
+            self.input_finished()
+
+    def send_result(self) -> None:
+        params = self.server.params
+        frame_shift = params.sample_rate // 100
+        result = {
+            "text": self.server.sp.decode(self.stream.decoding_result()),
+            "final": self.stream.done,
+            "num_samples": min(
+                self.stream.num_processed_frames * frame_shift, self.num_samples
+            ),
+        }
+        write_message(self.writer, json.dumps(result).encode("utf-8"))
+        if self.stream.done:
+            self.finished.set()
+
+
+class StreamingServer(object):
+    def __init__(
+        self,
+        params: AttributeDict,
+        model: torch.nn.Module,
+        sp: spm.SentencePieceProcessor,
+        decoding_graph: Optional[k2.Fsa] = None,
+    ):
+        self.params = params
+        self.model = model
+        self.sp = sp
+        self.decoding_graph = decoding_graph
+        self.device = model.device
+
+        opts = kaldifeat.FbankOptions()
+        opts.device = self.device
+        opts.frame_opts.dither = 0
+        opts.frame_opts.snip_edges = False
+        opts.frame_opts.samp_freq = params.sample_rate
+        opts.mel_opts.num_bins = params.feature_dim
+        # Frames are moved to the decode stream as soon as they are
+        # computed, so the online fbank needs to keep only a few of them
+        opts.frame_opts.max_feature_vectors = 2 * params.decode_chunk_len
+        self.fbank_opts = opts
+
+        self.initial_states = model.encoder.get_init_state(device=self.device)
+        self.state_pool = StreamStatePool(
+            self.initial_states, max_streams=params.max_batch_size
+        )
+        # slot_to_connection[i] is the connection whose stream is in slot i
+        self.slot_to_connection: List[Connection] = []
+        # Pool slots are only changed by the decoding loop, between batches
+        self.pending_add: List[Connection] = []
+        self.pending_remove: List[Connection] = []
+
+        self.decoder_cache = None
+        if params.decoding_method == "modified_beam_search":
+            self.decoder_cache = DecoderOutputCache(model)
+
+        self.decoding_streams_pool = None
+        if params.decoding_method == "fast_beam_search":
+            self.decoding_streams_pool = RnntDecodingStreamsPool(
+                get_rnnt_decoding_config(
+                    model,
+                    beam=params.beam,
+                    max_states=params.max_states,
+                    max_contexts=params.max_contexts,
+                ),
+                decoding_graph,
+                track_partial_results=params.partial_result_interval > 0,
+            )
+
+        # The model runs in this thread so that the event loop keeps
+        # receiving audio while a micro-batch is being decoded
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.ready_queue: Optional[asyncio.Queue] = None
+
+        self.num_batches = 0
+        self.num_decoded_chunks = 0
+
+    def schedule(self, conn: Connection) -> None:
+        """Put the stream of the given connection into the ready queue if it
+        has a chunk to decode.
+
+        Streams that are being decoded are not scheduled, since their frame
+        counts are changed by the decoding thread. decode_loop() schedules
+        them again after decoding.
+        """
+        if conn.queued or conn.closed or conn.decoding:
+            return
+        if conn.stream.is_ready(self.params.decode_chunk_len):
+            conn.queued = True
+            conn.ready_time = asyncio.get_running_loop().time()
+            self.ready_queue.put_nowait(conn)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        peer = writer.get_extra_info("peername")
+        stream = DecodeStream(
+            params=self.params,
+            cut_id=str(peer),
+            initial_states=self.initial_states,
+            decoding_graph=self.decoding_graph,
+            device=self.device,
+            fbank_opts=self.fbank_opts,
+        )
+        conn = Connection(self, writer, stream)
+        self.pending_add.append(conn)
+
+        try:
+            while True:
+                payload = await read_message(reader, self.params.max_message_size)
+                if payload is None:
+                    # The client has gone without finishing the utterance,
+                    # or has sent an invalid message
+                    return
+                if len(payload) == 0:
+                    break
+                samples = torch.from_numpy(np.frombuffer(payload, dtype="<f4").copy())
+                conn.accept_waveform(samples)
+                self.schedule(conn)
+
+            conn.input_finished()
+            if not conn.decoding and conn.stream.done:
+                conn.send_result()
+            self.schedule(conn)
+            await conn.finished.wait()
+            await writer.drain()
+        finally:
+            conn.closed = True
+            self.pending_remove.append(conn)
+            writer.close()
+
+    def _update_slots(self) -> None:
+        for conn in self.pending_remove:
+            if conn.stream.slot is None:
+                # It is never added
+                self.pending_add.remove(conn)
+                continue
+            slot = conn.stream.slot
+            last = self.state_pool.remove(slot)
+            moved = self.slot_to_connection.pop()
+            if last != slot:
+                self.slot_to_connection[slot] = moved
+                moved.stream.slot = slot
+            conn.stream.slot = None
+            if self.decoding_streams_pool is not None:
+                # The stream is still in it if it is not finished
+                self.decoding_streams_pool.remove(conn.stream)
+        self.pending_remove = []
+
+        for conn in self.pending_add:
+            conn.stream.slot = self.state_pool.add()
+            self.slot_to_connection.append(conn)
+        self.pending_add = []
+
+    async def _get_batch(self) -> List[Connection]:
+        """Wait for the next micro-batch."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.ready_queue.get()]
+        deadline = batch[0].ready_time + self.params.max_wait_ms / 1000
+        while len(batch) < self.params.max_batch_size:
+            if not self.ready_queue.empty():
+                batch.append(self.ready_queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                conn = await asyncio.wait_for(self.ready_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(conn)
+        return batch
+
+    def _decode(self, streams: List[DecodeStream]) -> None:
+        with torch.no_grad():
+            decode_one_chunk(
+                params=self.params,
+                model=self.model,
+                decode_streams=streams,
+                decoder_cache=self.decoder_cache,
+                state_pool=self.state_pool,
+                decoding_streams_pool=self.decoding_streams_pool,
+            )
+
+    async def decode_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._get_batch()
+            for conn in batch:
+                conn.queued = False
+            batch = [conn for conn in batch if not conn.closed]
+
+            self._update_slots()
+            if len(batch) == 0:
+                continue
+
+            for conn in batch:
+                conn.decoding = True
+            await loop.run_in_executor(
+                self.executor, self._decode, [conn.stream for conn in batch]
+            )
+            self.num_batches += 1
+            self.num_decoded_chunks += len(batch)
+
+            for conn in batch:
+                conn.decoding_finished()
+                if conn.closed:
+                    continue
+                conn.send_result()
+                self.schedule(conn)
+
+    async def log_stats(self, interval: float = 10) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self.num_batches == 0:
+                continue
+            logging.info(
+                f"streams: {self.state_pool.num_streams}, "
+                f"batches: {self.num_batches}, "
+                f"average batch size: "
+                f"{self.num_decoded_chunks / self.num_batches:.2f}"
+            )
+            self.num_batches = 0
+            self.num_decoded_chunks = 0
+
+    async def run(self, port: int) -> None:
+        self.ready_queue = asyncio.Queue()
+        server = await asyncio.start_server(self.handle_connection, port=port)
+        logging.info(f"Listening on port {port}")
+        async with server:
+            await asyncio.gather(
+                server.serve_forever(), self.decode_loop(), self.log_stats()
+            )
+
+
+@torch.no_grad()
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    params = get_params()
+    params.update(vars(args))
+
+    sp = spm.SentencePieceProcessor()
+    sp.load(params.bpe_model)
+
+    # <blk> and <unk> is defined in local/train_bpe_model.py
+    params.blank_id = sp.piece_to_id("<blk>")
+    params.unk_id = sp.piece_to_id("<unk>")
+    params.vocab_size = sp.get_piece_size()
+
+    logging.info(params)
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    logging.info(f"Device: {device}")
+
+    logging.info("About to create model")
+    model = get_transducer_model(params)
+
+    checkpoint = torch.load(args.checkpoint, map_location="cpu")
+    model.load_state_dict(checkpoint["model"], strict=True)
+    model.to(device)
+    model.eval()
+    model.device = device
+
+    decoding_graph = None
+    if params.decoding_method == "fast_beam_search":
+        decoding_graph = k2.trivial_graph(params.vocab_size - 1, device=device)
+
+    server = StreamingServer(
+        params=params, model=model, sp=sp, decoding_graph=decoding_graph
+    )
+    asyncio.run(server.run(params.port))
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+To run this file, do:
+
+    cd icefall/egs/librispeech/ASR
+    python ./pruned_transducer_stateless7_streaming/test_streaming_beam_search.py
+"""
+
+import random
+from typing import List, Optional
+
+import k2
+import torch
+import torch.nn as nn
+from decode_stream import DecodeStream
+from decoder import Decoder
+from joiner import Joiner
+from streaming_beam_search import (
+    RnntDecodingStreamsPool,
+    fast_beam_search_one_best,
+    get_rnnt_decoding_config,
+)
+
+from icefall.utils import AttributeDict
+
+VOCAB_SIZE = 20
+CHUNK_FRAMES = 4
+BEAM = 4
+MAX_STATES = 32
+MAX_CONTEXTS = 8
+
+
+class DecoderJoiner(nn.Module):
+    """The encoder output is used as the logits, adjusted by the decoder
+    output, so that the paths are like those of a trained model."""
+
+    def __init__(self):
+        super().__init__()
+        self.decoder = Decoder(
+            vocab_size=VOCAB_SIZE,
+            decoder_dim=16,
+            blank_id=0,
+            context_size=2,
+        )
+        self.joiner = Joiner(
+            encoder_dim=VOCAB_SIZE,
+            decoder_dim=16,
+            joiner_dim=VOCAB_SIZE,
+            vocab_size=VOCAB_SIZE,
+        )
+        with torch.no_grad():
+            self.joiner.output_linear.weight.copy_(torch.eye(VOCAB_SIZE))
+            self.joiner.output_linear.bias.zero_()
+
+
+def get_encoder_out(num_frames: int) -> torch.Tensor:
+    encoder_out = 4 * torch.randn(num_frames, VOCAB_SIZE)
+    # Favor blanks
+    encoder_out[:, 0] += 4
+    return encoder_out
+
+
+def get_stream(decoding_graph: k2.Fsa) -> DecodeStream:
+    params = AttributeDict(
+        decoding_method="fast_beam_search",
+        blank_id=0,
+        context_size=2,
+    )
+    return DecodeStream(
+        params=params,
+        cut_id="",
+        initial_states=[],
+        decoding_graph=decoding_graph,
+    )
+
+
+def decode_chunk(
+    model: nn.Module,
+    streams: List[DecodeStream],
+    chunks: List[torch.Tensor],
+    processed_lens: List[int],
+    finished: List[bool],
+    pool: Optional[RnntDecodingStreamsPool],
+) -> None:
+    fast_beam_search_one_best(
+        model=model,
+        encoder_out=torch.stack(chunks),
+        processed_lens=torch.tensor(processed_lens),
+        streams=streams,
+        beam=BEAM,
+        max_states=MAX_STATES,
+        max_contexts=MAX_CONTEXTS,
+        decoding_streams_pool=pool,
+        need_results=[True] * len(streams),
+        finished=finished,
+    )
+
+
+def run_pool(num_spare_slots: int):
+    torch.manual_seed(20221017)
+    random.seed(20221017)
+
+    model = DecoderJoiner()
+    model.eval()
+    decoding_graph = k2.trivial_graph(VOCAB_SIZE - 1)
+    pool = RnntDecodingStreamsPool(
+        get_rnnt_decoding_config(
+            model,
+            beam=BEAM,
+            max_states=MAX_STATES,
+            max_contexts=MAX_CONTEXTS,
+        ),
+        decoding_graph,
+        num_spare_slots=num_spare_slots,
+    )
+
+    # (first chunk, number of chunks, frames in the last chunk)
+    utterances = [(0, 5, 2), (0, 3, 4), (1, 6, 1), (2, 2, 3), (4, 3, 4)]
+    encoder_out = [
+        get_encoder_out(num_chunks * CHUNK_FRAMES).view(num_chunks, CHUNK_FRAMES, -1)
+        for _, num_chunks, _ in utterances
+    ]
+    streams = [get_stream(decoding_graph) for _ in utterances]
+    # Stream 2 is removed before it is finished
+    removed = 2
+    removed_after = 3
+    num_decoded = [0] * len(utterances)
+
+    for c in range(12):
+        batch = []
+        for i, (start, num_chunks, _) in enumerate(utterances):
+            if c < start or num_decoded[i] == num_chunks:
+                continue
+            if i == removed and num_decoded[i] == removed_after:
+                continue
+            # Some streams are not ready in some chunks
+            if c > start and random.random() < 0.3:
+                continue
+            batch.append(i)
+        if c == 8:
+            pool.remove(streams[removed])
+        if len(batch) == 0:
+            continue
+
+        processed_lens = []
+        finished = []
+        for i in batch:
+            num_decoded[i] += 1
+            num_chunks, last_frames = utterances[i][1:]
+            finished.append(num_decoded[i] == num_chunks)
+            processed_lens.append((num_decoded[i] - 1) * CHUNK_FRAMES)
+            if finished[-1]:
+                processed_lens[-1] += last_frames
+            else:
+                processed_lens[-1] += CHUNK_FRAMES
+        decode_chunk(
+            model,
+            [streams[i] for i in batch],
+            [encoder_out[i][num_decoded[i] - 1] for i in batch],
+            processed_lens,
+            finished,
+            pool,
+        )
+
+    assert num_decoded[removed] == removed_after
+    assert all(
+        n == u[1]
+        for i, (n, u) in enumerate(zip(num_decoded, utterances))
+        if i != removed
+    )
+    assert len(pool.slot_of) == 0, pool.slot_of
+
+    # Decode each stream alone, creating k2.RnntDecodingStreams for each
+    # chunk
+    for i, (_, num_chunks, last_frames) in enumerate(utterances):
+        if i == removed:
+            continue
+        expected = get_stream(decoding_graph)
+        for c in range(num_chunks):
+            processed_len = c * CHUNK_FRAMES + CHUNK_FRAMES
+            if c + 1 == num_chunks:
+                processed_len += last_frames - CHUNK_FRAMES
+            decode_chunk(
+                model,
+                [expected],
+                [encoder_out[i][c]],
+                [processed_len],
+                [c + 1 == num_chunks],
+                None,
+            )
+        assert streams[i].hyp == expected.hyp, (i, streams[i].hyp, expected.hyp)
+
+
+def test_pool():
+    run_pool(num_spare_slots=2)
+
+
+def test_pool_without_spare_slots():
+    run_pool(num_spare_slots=0)
+
+
+def main():
+    test_pool()
+    test_pool_without_spare_slots()
+
+
+if __name__ == "__main__":
+    main()
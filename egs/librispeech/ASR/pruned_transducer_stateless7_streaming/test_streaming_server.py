@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+To run this file, do:
+
+    cd icefall/egs/librispeech/ASR
+    python ./pruned_transducer_stateless7_streaming/test_streaming_server.py
+"""
+
+import asyncio
+import threading
+from typing import List
+
+import torch
+from streaming_server import Connection, StreamingServer
+
+from icefall.utils import AttributeDict
+
+CHUNK_LEN = 4
+
+
+class FakeStream(object):
+    """Each sample is a feature frame. A chunk of CHUNK_LEN frames is
+    consumed per decoding."""
+
+    def __init__(self):
+        self.num_frames = 0
+        self.num_processed_frames = 0
+        self.done = False
+        self.slot = None
+
+    def accept_waveform(self, samples: torch.Tensor) -> None:
+        self.num_frames += samples.numel()
+
+    def input_finished(self, tail_pad_len: int) -> None:
+        pass
+
+    def is_ready(self, chunk_size: int) -> bool:
+        return self.num_frames - self.num_processed_frames >= chunk_size
+
+    def decoding_result(self) -> List[int]:
+        return []
+
+
+class FakeWriter(object):
+    def write(self, data: bytes) -> None:
+        pass
+
+
+class FakeSp(object):
+    def decode(self, token_ids: List[int]) -> str:
+        return ""
+
+
+def get_server() -> StreamingServer:
+    server = StreamingServer.__new__(StreamingServer)
+    server.params = AttributeDict(
+        decode_chunk_len=CHUNK_LEN,
+        max_batch_size=4,
+        max_wait_ms=0,
+        sample_rate=100,
+    )
+    server.sp = FakeSp()
+    server.device = torch.device("cpu")
+    server.pending_add = []
+    server.pending_remove = []
+    server.num_batches = 0
+    server.num_decoded_chunks = 0
+    server.ready_queue = asyncio.Queue()
+    return server
+
+
+async def wait_for(event: threading.Event, timeout: float = 10) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not event.is_set():
+        assert loop.time() < deadline, "Timed out"
+        await asyncio.sleep(0.001)
+
+
+async def run_audio_during_decoding():
+    server = get_server()
+    started = threading.Event()
+    release = threading.Event()
+    # Whether a full chunk is available when each decoding starts
+    ready_at_start = []
+
+    def decode(streams):
+        ready_at_start.append([s.is_ready(CHUNK_LEN) for s in streams])
+        started.set()
+        release.wait()
+        for s in streams:
+            s.num_processed_frames += CHUNK_LEN
+
+    server._decode = decode
+    server.executor = None
+
+    conn = Connection(server, FakeWriter(), FakeStream())
+    loop_task = asyncio.ensure_future(server.decode_loop())
+    try:
+        conn.accept_waveform(torch.zeros(CHUNK_LEN))
+        server.schedule(conn)
+        await wait_for(started)
+        started.clear()
+
+        # The next chunk arrives while the first one is being decoded
+        assert conn.decoding
+        conn.accept_waveform(torch.zeros(CHUNK_LEN // 2))
+        server.schedule(conn)
+        conn.accept_waveform(torch.zeros(CHUNK_LEN // 2))
+        server.schedule(conn)
+        assert not conn.queued
+        assert server.ready_queue.empty()
+
+        # It is scheduled after decoding, with the audio received meanwhile
+        release.set()
+        await wait_for(started)
+        assert conn.stream.num_frames == 2 * CHUNK_LEN
+        await asyncio.sleep(0.01)
+    finally:
+        release.set()
+        loop_task.cancel()
+        try:
+            await loop_task
+        except asyncio.CancelledError:
+            pass
+
+    assert ready_at_start == [[True], [True]], ready_at_start
+    assert conn.stream.num_processed_frames == 2 * CHUNK_LEN
+
+
+def test_audio_during_decoding():
+    asyncio.run(run_audio_during_decoding())
+
+
+def main():
+    test_audio_during_decoding()
+
+
+if __name__ == "__main__":
+    main()
@@ -260,6 +260,134 @@ def unstack_states(states: List[Tensor]) -> List[List[Tensor]]:
     return state_list
 
 
+class StreamStatePool(object):
+    """Preallocated zipformer states of all streams being decoded.
+
+    Each stream occupies a slot, i.e., an index along the batch dim of the
+    cached tensors, from admission (:meth:`add`) to eviction
+    (:meth:`remove`). Active streams always occupy the slots
+    0, 1, ..., num_streams - 1, so the states of all of them are views
+    into the preallocated tensors and can be passed to
+    `Zipformer.streaming_forward()` without :func:`stack_states` and
+    :func:`unstack_states`, which concatenate and split all cached
+    tensors on every chunk.
+    """
+
+    # The batch dim of the 7 kinds of states, see Zipformer.get_init_state()
+    state_batch_dims = (1, 1, 2, 2, 2, 1, 1)
+
+    def __init__(self, initial_states: List[Tensor], max_streams: int = 200):
+        """
+        Args:
+          initial_states:
+            The initial states of a single stream, i.e., the return value of
+            `Zipformer.get_init_state()`.
+          max_streams:
+            The number of preallocated slots. The pool grows if more streams
+            are added.
+        """
+        assert len(initial_states) % 7 == 0, len(initial_states)
+        num_encoders = len(initial_states) // 7
+        self.batch_dims = [
+            d for d in self.state_batch_dims for _ in range(num_encoders)
+        ]
+
+        self.initial_states = initial_states
+        self.max_streams = max_streams
+        self.num_streams = 0
+        self.states = [
+            self._allocate(s, d, max_streams)
+            for s, d in zip(initial_states, self.batch_dims)
+        ]
+
+    @staticmethod
+    def _allocate(state: Tensor, dim: int, num_slots: int) -> Tensor:
+        shape = list(state.shape)
+        shape[dim] = num_slots
+        return torch.zeros(shape, dtype=state.dtype, device=state.device)
+
+    def _grow(self) -> None:
+        max_streams = self.max_streams * 2
+        states = []
+        for s, d in zip(self.states, self.batch_dims):
+            new_s = self._allocate(s, d, max_streams)
+            new_s.narrow(d, 0, self.max_streams).copy_(s)
+            states.append(new_s)
+        self.states = states
+        self.max_streams = max_streams
+
+    def add(self, states: Optional[List[Tensor]] = None) -> int:
+        """Admit a new stream.
+
+        Args:
+          states:
+            The states of the stream with batch size 1. If None, the initial
+            states are used.
+        Returns:
+          Return the slot of the stream.
+        """
+        if self.num_streams == self.max_streams:
+            self._grow()
+
+        if states is None:
+            states = self.initial_states
+
+        slot = self.num_streams
+        for s, d, new_s in zip(self.states, self.batch_dims, states):
+            s.narrow(d, slot, 1).copy_(new_s)
+        self.num_streams += 1
+        return slot
+
+    def remove(self, slot: int) -> int:
+        """Evict the stream in the given slot.
+
+        The stream in the last slot is moved into the given slot to keep the
+        active slots contiguous.
+
+        Returns:
+          Return the previous slot of the moved stream, which is `slot` if the
+          evicted stream is in the last slot, in which case nothing is moved.
+        """
+        assert 0 <= slot < self.num_streams, (slot, self.num_streams)
+        last = self.num_streams - 1
+        if slot != last:
+            for s, d in zip(self.states, self.batch_dims):
+                s.narrow(d, slot, 1).copy_(s.narrow(d, last, 1))
+        self.num_streams -= 1
+        return last
+
+    def get_states(self, slots: Optional[List[int]] = None) -> List[Tensor]:
+        """Return the states of the streams in the given slots in the format
+        of :func:`stack_states`.
+
+        If `slots` is None, the states of all streams are returned as views
+        into the pool, ordered by slot. Otherwise, they are gathered with
+        `index_select()`.
+        """
+        if slots is None:
+            return [
+                s.narrow(d, 0, self.num_streams)
+                for s, d in zip(self.states, self.batch_dims)
+            ]
+
+        index = torch.tensor(slots, dtype=torch.int64, device=self.states[0].device)
+        return [s.index_select(d, index) for s, d in zip(self.states, self.batch_dims)]
+
+    def set_states(
+        self, states: List[Tensor], slots: Optional[List[int]] = None
+    ) -> None:
+        """Write the states of the streams in the given slots back to the pool.
+        It is the inverse of :meth:`get_states`."""
+        if slots is None:
+            for s, d, new_s in zip(self.states, self.batch_dims, states):
+                s.narrow(d, 0, self.num_streams).copy_(new_s)
+            return
+
+        index = torch.tensor(slots, dtype=torch.int64, device=self.states[0].device)
+        for s, d, new_s in zip(self.states, self.batch_dims, states):
+            s.index_copy_(d, index, new_s)
+
+
 class Zipformer(EncoderInterface):
     """
     Args:
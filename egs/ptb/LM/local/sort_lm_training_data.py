@@ -86,17 +86,18 @@ def main():
         sorted_sentences.dim0,
     )
 
-    cur = None
-    for i in range(num_sentences):
-        word_ids = sorted_sentences[i]
-        token_ids = words2bpe[word_ids]
-        if isinstance(token_ids, k2.RaggedTensor):
-            token_ids = token_ids.values
-        if cur is not None:
-            assert cur >= token_ids.numel(), (cur, token_ids.numel())
-
-        cur = token_ids.numel()
-        assert cur == sorted_sentence_lengths[i]
+    # The number of tokens of each sorted sentence, computed from the row
+    # splits instead of indexing each sentence separately
+    word_row_splits = words2bpe.shape.row_splits(1).to(torch.int64)
+    word_lengths = word_row_splits[1:] - word_row_splits[:-1]
+    token_counts = torch.cumsum(
+        word_lengths[sorted_sentences.values.to(torch.int64)], dim=0
+    )
+    token_counts = torch.cat([torch.zeros(1, dtype=torch.int64), token_counts])
+    row_splits = sorted_sentences.shape.row_splits(1).to(torch.int64)
+    lengths = token_counts[row_splits[1:]] - token_counts[row_splits[:-1]]
+    assert torch.equal(lengths, sorted_sentence_lengths.to(torch.int64))
+    assert torch.all(lengths[:-1] >= lengths[1:])
 
     data["sentences"] = sorted_sentences
     data["sentence_lengths"] = sorted_sentence_lengths
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+To run this file, do:
+
+    cd icefall/egs/ptb/LM
+    python ./local/test_prepare_lm_training_data_shards.py
+"""
+
+import random
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import List
+
+import sentencepiece as spm
+import torch
+
+PREPARE = Path(__file__).resolve().parent / "prepare_lm_training_data.py"
+
+
+def prepare(tmp_dir: Path, lm_archive: str, extra_args: List[str]) -> None:
+    subprocess.run(
+        [
+            sys.executable,
+            str(PREPARE),
+            "--bpe-model",
+            str(tmp_dir / "bpe.model"),
+            "--lm-data",
+            str(tmp_dir / "lm.txt"),
+            "--lm-archive",
+            str(tmp_dir / lm_archive),
+        ]
+        + extra_args,
+        check=True,
+    )
+
+
+def get_sentences(data: dict) -> List[List[int]]:
+    sentences = data["sentences"]
+    return [sentences[i].tolist() for i in range(sentences.dim0)]
+
+
+def test_shards_and_sort():
+    random.seed(20221017)
+    vocab = [
+        "".join(random.choices("abcdefgh", k=random.randint(1, 6))) for _ in range(40)
+    ]
+    lines = []
+    for i in range(101):
+        lines.append(" ".join(random.choices(vocab, k=random.randint(0, 12))))
+    # Windows line endings and spaces around the words are allowed
+    lines[7] = f"  {lines[7]} \r"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        with open(tmp_dir / "lm.txt", "w") as f:
+            for line in lines:
+                f.write(f"{line}\n")
+
+        spm.SentencePieceTrainer.train(
+            input=str(tmp_dir / "lm.txt"),
+            model_prefix=str(tmp_dir / "bpe"),
+            vocab_size=30,
+            model_type="unigram",
+        )
+
+        prepare(tmp_dir, "expected.pt", [])
+        prepare(
+            tmp_dir,
+            "lm_data.pt",
+            ["--num-jobs", "3", "--num-shards", "2", "--sort"],
+        )
+
+        expected = torch.load(tmp_dir / "expected.pt")
+        shards = [torch.load(tmp_dir / f"lm_data.{i}.pt") for i in range(2)]
+
+    expected_sentences = get_sentences(expected)
+    assert len(expected_sentences) == len(lines)
+    expected_lengths = expected["sentence_lengths"].tolist()
+    words = expected["words"]
+    for sentence, length in zip(expected_sentences, expected_lengths):
+        assert sum(words[w].numel() for w in sentence) == length
+
+    # Shard 0 has the first 50 sentences and shard 1 the others, each
+    # sorted by the number of tokens in descending order. Sentences of the
+    # same length keep their order.
+    for shard, (start, end) in zip(shards, [(0, 50), (50, 101)]):
+        assert shard["words"] == words
+        indexes = sorted(range(start, end), key=lambda i: -expected_lengths[i])
+        assert get_sentences(shard) == [expected_sentences[i] for i in indexes]
+        assert shard["sentence_lengths"].tolist() == [
+            expected_lengths[i] for i in indexes
+        ]
+
+
+def main():
+    test_shards_and_sort()
+
+
+if __name__ == "__main__":
+    main()
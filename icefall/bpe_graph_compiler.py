@@ -16,12 +16,14 @@
 
 
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
 
 import k2
 import sentencepiece as spm
 import torch
 
+from icefall.fsa_cache import FsaCache
+
 
 class BpeCtcTrainingGraphCompiler(object):
     def __init__(
@@ -30,6 +32,7 @@ class BpeCtcTrainingGraphCompiler(object):
         device: Union[str, torch.device] = "cpu",
         sos_token: str = "<sos/eos>",
         eos_token: str = "<sos/eos>",
+        graph_cache: Optional[FsaCache] = None,
     ) -> None:
         """
         Args:
@@ -44,6 +47,9 @@ class BpeCtcTrainingGraphCompiler(object):
             The word piece that represents sos.
           eos_token:
             The word piece that represents eos.
+          graph_cache:
+            If not None, the graph of each piece ID list is cached in it by
+            :meth:`compile`.
         """
         lang_dir = Path(lang_dir)
         model_file = lang_dir / "bpe.model"
@@ -59,6 +65,8 @@ class BpeCtcTrainingGraphCompiler(object):
         assert self.sos_id != self.sp.unk_id()
         assert self.eos_id != self.sp.unk_id()
 
+        self.graph_cache = graph_cache
+
     def texts_to_ids(self, texts: List[str]) -> List[List[int]]:
         """Convert a list of texts to a list-of-list of piece IDs.
 
@@ -90,5 +98,17 @@ class BpeCtcTrainingGraphCompiler(object):
           CTC topology with linear FSAs constructed from the given
           piece IDs.
         """
-        graph = k2.ctc_graph(piece_ids, modified=modified, device=self.device)
-        return graph
+        if self.graph_cache is None:
+            return k2.ctc_graph(piece_ids, modified=modified, device=self.device)
+
+        # The graph depends only on the piece IDs and `modified`
+        keys = [
+            f"ctc_graph:{int(modified)}:{','.join(map(str, ids))}" for ids in piece_ids
+        ]
+        return self.graph_cache.compile(
+            keys,
+            lambda indexes: k2.ctc_graph(
+                [piece_ids[i] for i in indexes], modified=modified, device=self.device
+            ),
+            device=self.device,
+        )
@@ -16,12 +16,18 @@
 # limitations under the License.
 
 
+import copy
 import glob
+import hashlib
+import json
 import logging
 import os
 import re
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import torch
 import torch.nn as nn
@@ -46,6 +52,8 @@ def save_checkpoint(
     scaler: Optional[GradScaler] = None,
     sampler: Optional[CutSampler] = None,
     rank: int = 0,
+    save_model_only: bool = True,
+    writer: Optional["AsyncCheckpointWriter"] = None,
 ) -> None:
     """Save training information to a file.
 
@@ -66,6 +74,15 @@ def save_checkpoint(
         The GradScaler to be saved. We only save its `state_dict()`.
       rank:
         Used in DDP. We save checkpoint only for the node whose rank is 0.
+      save_model_only:
+        If True, also save the model, the averaged model and `params`, but
+        not the states of the optimizer, etc., to the file returned by
+        :func:`get_model_only_filename`, which is used by
+        :func:`average_checkpoints` and
+        :func:`average_checkpoints_with_averaged_model`.
+      writer:
+        If not None, the checkpoint is copied to CPU and written to the file
+        in the background by this writer. See :class:`AsyncCheckpointWriter`.
     Returns:
       Return None.
     """
@@ -93,7 +110,238 @@ def save_checkpoint(
             assert k not in checkpoint
             checkpoint[k] = v
 
-    torch.save(checkpoint, filename)
+    if writer is not None:
+        start = time.time()
+        checkpoint = writer.snapshot(checkpoint)
+        logging.info(
+            f"Copied checkpoint {filename} to CPU in {time.time() - start:.3f} s"
+        )
+        writer.submit(_write_checkpoint, checkpoint, filename, save_model_only)
+    else:
+        _write_checkpoint(checkpoint, filename, save_model_only)
+
+
+def _write_checkpoint(
+    checkpoint: Dict[str, Any],
+    filename: Union[str, Path],
+    save_model_only: bool,
+) -> None:
+    """Write a checkpoint created by :func:`save_checkpoint` to a file, and
+    its model-only copy if `save_model_only` is True.
+
+    The files are written to temporary files first and then renamed, so a
+    checkpoint is either complete or absent even if the training is killed.
+    """
+    start = time.time()
+    filename = Path(filename)
+    _save_atomically(checkpoint, filename)
+
+    if save_model_only:
+        model_only = {
+            k: v
+            for k, v in checkpoint.items()
+            if k not in ("optimizer", "scheduler", "grad_scaler", "sampler")
+        }
+        model_only_filename = get_model_only_filename(filename)
+        model_only_filename.parent.mkdir(parents=True, exist_ok=True)
+        _save_atomically(model_only, model_only_filename)
+
+    logging.info(f"Saved checkpoint to {filename} in {time.time() - start:.3f} s")
+
+
+def _save_atomically(obj: Any, filename: Path) -> None:
+    tmp_filename = filename.with_name(f"{filename.name}.tmp")
+    torch.save(obj, tmp_filename)
+    os.replace(tmp_filename, filename)
+
+
+class AsyncCheckpointWriter(object):
+    """Write checkpoints in a background thread.
+
+    :func:`save_checkpoint` with a writer only copies the checkpoint to CPU,
+    into pinned memory for CUDA tensors, which is the only part that blocks
+    the training. Serializing it is done by the writer, as well as anything
+    else passed to :meth:`submit`, e.g., :func:`remove_checkpoints`, in the
+    order they are submitted.
+
+    At most one checkpoint is being written at a time. If the previous one is
+    not finished when the next is saved, :meth:`snapshot` waits for it, so
+    the pinned buffers can be reused.
+
+    Call :meth:`close` at the end of the training to wait for the pending
+    writes. Errors raised in the background are re-raised by :meth:`wait`,
+    :meth:`snapshot` and :meth:`close`.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures: List[Future] = []
+        # Pinned CPU buffers for CUDA tensors, keyed by their position in
+        # the checkpoint
+        self.pinned: Dict[str, Tensor] = dict()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Run fn(*args, **kwargs) in the background after the work
+        submitted before."""
+        future = self.executor.submit(fn, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+    def wait(self) -> None:
+        """Wait for all submitted work to finish."""
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self.wait()
+        self.executor.shutdown()
+
+    def snapshot(self, obj: Any) -> Any:
+        """Return a copy of `obj`, in which tensors are copied to CPU, so
+        that it is not changed by the training while it is being written.
+
+        Tensors sharing the same data in `obj` are copied only once and
+        still share data in the returned copy.
+        """
+        self.wait()
+        memo: Dict[tuple, Tensor] = dict()
+        devices = set()
+        ans = self._snapshot(obj, "", memo, devices)
+        for device in devices:
+            torch.cuda.current_stream(device).synchronize()
+        return ans
+
+    def _snapshot(
+        self, obj: Any, key: str, memo: Dict[tuple, Tensor], devices: set
+    ) -> Any:
+        if isinstance(obj, Tensor):
+            return self._snapshot_tensor(obj, key, memo, devices)
+        if isinstance(obj, dict):
+            ans = copy.copy(obj)
+            for k, v in obj.items():
+                ans[k] = self._snapshot(v, f"{key}/{k}", memo, devices)
+            return ans
+        if type(obj) in (list, tuple):
+            return type(obj)(
+                self._snapshot(v, f"{key}/{i}", memo, devices)
+                for i, v in enumerate(obj)
+            )
+        return copy.deepcopy(obj)
+
+    def _snapshot_tensor(
+        self, t: Tensor, key: str, memo: Dict[tuple, Tensor], devices: set
+    ) -> Tensor:
+        t = t.detach()
+        memo_key = (
+            t.device,
+            t.data_ptr(),
+            t.dtype,
+            tuple(t.shape),
+            t.stride(),
+        )
+        if t.numel() > 0 and memo_key in memo:
+            return memo[memo_key]
+
+        if t.is_cuda:
+            buf = self.pinned.get(key)
+            if buf is None or buf.shape != t.shape or buf.dtype != t.dtype:
+                buf = torch.empty(t.shape, dtype=t.dtype, pin_memory=True)
+                self.pinned[key] = buf
+            buf.copy_(t, non_blocking=True)
+            devices.add(t.device)
+            ans = buf
+        else:
+            ans = t.clone()
+
+        memo[memo_key] = ans
+        return ans
+
+
+def get_model_only_filename(filename: Union[str, Path]) -> Path:
+    """Return the filename of the model-only copy of a checkpoint saved by
+    :func:`save_checkpoint`. It is in a subdirectory so that it is not
+    found by :func:`find_checkpoints`.
+    """
+    filename = Path(filename)
+    return filename.parent / "model-only" / filename.name
+
+
+def load_checkpoint_for_averaging(filename: Union[str, Path]) -> Dict[str, Any]:
+    """Load a checkpoint saved by :func:`save_checkpoint` on CPU, in which
+    only the models and `params` are used.
+
+    The model-only copy is loaded instead if it is up to date. The file is
+    memory-mapped if supported, so that tensors are read from it only when
+    they are used.
+    """
+    filename = Path(filename)
+    model_only_filename = get_model_only_filename(filename)
+    if (
+        model_only_filename.is_file()
+        and model_only_filename.stat().st_mtime >= filename.stat().st_mtime
+    ):
+        filename = model_only_filename
+
+    try:
+        return torch.load(str(filename), map_location="cpu", mmap=True)
+    except (TypeError, RuntimeError):
+        # mmap requires torch >= 2.1 and the zipfile serialization format
+        return torch.load(filename, map_location="cpu")
+
+
+def _get_unique_names(state_dict: Dict[str, Tensor]) -> Dict[str, str]:
+    """Identify shared parameters. Two parameters are said to be shared
+    if they have the same data_ptr.
+
+    Returns:
+      Return a dict mapping each name to the first name sharing its data.
+    """
+    uniqued: Dict[int, str] = dict()
+    ans = dict()
+    for k, v in state_dict.items():
+        if v.numel() == 0:
+            # The data_ptr of empty tensors may be 0
+            ans[k] = k
+        else:
+            ans[k] = uniqued.setdefault(v.data_ptr(), k)
+    return ans
+
+
+def _average_with_cache(
+    cache_dir: Optional[Union[str, Path]],
+    name: str,
+    filenames: List[Union[str, Path]],
+    average_fn: Callable[[], Dict[str, Tensor]],
+    device: torch.device,
+) -> Dict[str, Tensor]:
+    """Return average_fn(). If cache_dir is not None, the result is cached in
+    it, keyed by `name` and `filenames`, and is reused if it is newer than
+    all of `filenames`.
+    """
+    if cache_dir is None:
+        return average_fn()
+
+    key = json.dumps([name] + [str(Path(f).resolve()) for f in filenames])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    cache_dir = Path(cache_dir)
+    cache_filename = cache_dir / f"{name}-{digest}.pt"
+
+    if cache_filename.is_file():
+        mtime = cache_filename.stat().st_mtime
+        if all(os.path.getmtime(f) <= mtime for f in filenames):
+            logging.info(f"Loading averaged model from {cache_filename}")
+            return torch.load(cache_filename, map_location=device)
+
+    avg = average_fn()
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_filename = cache_filename.with_suffix(f".tmp.{os.getpid()}")
+    torch.save(avg, tmp_filename)
+    os.replace(tmp_filename, cache_filename)
+    logging.info(f"Saved averaged model to {cache_filename}")
+
+    return avg
 
 
 def load_checkpoint(
@@ -147,48 +395,64 @@ def load_checkpoint(
 
 
 def average_checkpoints(
-    filenames: List[Path], device: torch.device = torch.device("cpu")
+    filenames: List[Path],
+    device: torch.device = torch.device("cpu"),
+    cache_dir: Optional[Union[str, Path]] = None,
 ) -> dict:
     """Average a list of checkpoints.
 
+    The checkpoints are loaded with :func:`load_checkpoint_for_averaging`
+    one by one and the floating point tensors are accumulated in float64,
+    so only the model parameters, not the optimizer states, etc., are read
+    and at most one checkpoint is in memory at a time.
+
     Args:
       filenames:
         Filenames of the checkpoints to be averaged. We assume all
         checkpoints are saved by :func:`save_checkpoint`.
       device:
         Move checkpoints to this device before averaging.
+      cache_dir:
+        If not None, the result is saved to this directory and reused by
+        later calls with the same `filenames`, if they are not modified.
     Returns:
       Return a dict (i.e., state_dict) which is the average of all
       model state dicts contained in the checkpoints.
     """
-    n = len(filenames)
-
-    avg = torch.load(filenames[0], map_location=device)["model"]
-
-    # Identify shared parameters. Two parameters are said to be shared
-    # if they have the same data_ptr
-    uniqued: Dict[int, str] = dict()
-
-    for k, v in avg.items():
-        v_data_ptr = v.data_ptr()
-        if v_data_ptr in uniqued:
-            continue
-        uniqued[v_data_ptr] = k
-
-    uniqued_names = list(uniqued.values())
-
-    for i in range(1, n):
-        state_dict = torch.load(filenames[i], map_location=device)["model"]
-        for k in uniqued_names:
-            avg[k] += state_dict[k]
 
-    for k in uniqued_names:
-        if avg[k].is_floating_point():
-            avg[k] /= n
-        else:
-            avg[k] //= n
-
-    return avg
+    def average() -> Dict[str, Tensor]:
+        n = len(filenames)
+        avg: Dict[str, Tensor] = dict()
+
+        for i, filename in enumerate(filenames):
+            state_dict = load_checkpoint_for_averaging(filename)["model"]
+            if i == 0:
+                names = _get_unique_names(state_dict)
+                dtypes = {k: v.dtype for k, v in state_dict.items()}
+                for k, v in state_dict.items():
+                    if names[k] == k:
+                        dtype = torch.float64 if v.is_floating_point() else v.dtype
+                        avg[k] = v.to(device=device, dtype=dtype, copy=True)
+            else:
+                for k in avg.keys():
+                    avg[k] += state_dict[k].to(device)
+            del state_dict
+
+        for k, v in avg.items():
+            if v.is_floating_point():
+                avg[k] = (v / n).to(dtypes[k])
+            else:
+                v //= n
+
+        return {k: avg[names[k]] for k in names.keys()}
+
+    return _average_with_cache(
+        cache_dir=cache_dir,
+        name="average-checkpoints",
+        filenames=filenames,
+        average_fn=average,
+        device=device,
+    )
 
 
 def save_checkpoint_with_global_batch_idx(
@@ -202,6 +466,7 @@ def save_checkpoint_with_global_batch_idx(
     scaler: Optional[GradScaler] = None,
     sampler: Optional[CutSampler] = None,
     rank: int = 0,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ):
     """Save training info after processing given number of batches.
 
@@ -233,6 +498,8 @@ def save_checkpoint_with_global_batch_idx(
       rank:
         The rank ID used in DDP training of the current node. Set it to 0
         if DDP is not used.
+      writer:
+        If not None, the checkpoint is written in the background by it.
     """
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -247,6 +514,7 @@ def save_checkpoint_with_global_batch_idx(
         scaler=scaler,
         sampler=sampler,
         rank=rank,
+        writer=writer,
     )
 
 
@@ -317,6 +585,7 @@ def remove_checkpoints(
     out_dir: Path,
     topk: int,
     rank: int = 0,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ):
     """Remove checkpoints from the given directory.
 
@@ -333,10 +602,16 @@ def remove_checkpoints(
       rank:
         If using DDP for training, it is the rank of the current node.
         Use 0 if no DDP is used for training.
+      writer:
+        If not None, the checkpoints are removed in the background by it,
+        after the checkpoints it is writing are saved.
     """
     assert topk >= 1, topk
     if rank != 0:
         return
+    if writer is not None:
+        writer.submit(remove_checkpoints, out_dir=out_dir, topk=topk)
+        return
     checkpoints = find_checkpoints(out_dir)
 
     if len(checkpoints) == 0:
@@ -349,6 +624,9 @@ def remove_checkpoints(
     to_remove = checkpoints[topk:]
     for c in to_remove:
         os.remove(c)
+        model_only_filename = get_model_only_filename(c)
+        if model_only_filename.is_file():
+            os.remove(model_only_filename)
 
 
 def update_averaged_model(
@@ -360,6 +638,9 @@ def update_averaged_model(
     model_avg = model_cur * (average_period / batch_idx_train)
       + model_avg * ((batch_idx_train - average_period) / batch_idx_train)
 
+    It uses an :class:`AveragedModelUpdater`, which is created in the first
+    call and reused as long as `model_cur` and `model_avg` are the same.
+
     Args:
       params:
         User defined parameters, e.g., epoch, loss.
@@ -369,26 +650,121 @@ def update_averaged_model(
         The averaged model to be updated.
     """
     weight_cur = params.average_period / params.batch_idx_train
-    weight_avg = 1 - weight_cur
 
     if isinstance(model_cur, DDP):
         model_cur = model_cur.module
 
-    cur = model_cur.state_dict()
-    avg = model_avg.state_dict()
+    updater = _averaged_model_updaters.get(model_avg)
+    if updater is None or updater.model_cur_id != id(model_cur):
+        updater = AveragedModelUpdater(model_cur=model_cur, model_avg=model_avg)
+        _averaged_model_updaters[model_avg] = updater
 
-    average_state_dict(
-        state_dict_1=avg,
-        state_dict_2=cur,
-        weight_1=weight_avg,
-        weight_2=weight_cur,
-    )
+    updater.update(weight_cur)
+
+
+class AveragedModelUpdater(object):
+    """Update an averaged model with the current model:
+
+        model_avg = model_avg * (1 - weight_cur) + model_cur * weight_cur
+
+    for the floating point parameters and buffers. Other buffers are not
+    changed.
+
+    The parameters and buffers of both models are looked up once when it is
+    created, instead of calling `state_dict()` in every update, and the
+    update is done with multi-tensor `torch._foreach_*` ops.
+
+    `model_avg` may be on a different device or of a different dtype than
+    `model_cur`, e.g., a float64 copy on CPU of a model trained on GPU. In
+    that case, the tensors of `model_cur` are concatenated and copied to the
+    device of `model_avg` at once, into a buffer that is reused.
+    """
+
+    def __init__(self, model_cur: Union[nn.Module, DDP], model_avg: nn.Module):
+        if isinstance(model_cur, DDP):
+            model_cur = model_cur.module
+        self.model_cur_id = id(model_cur)
+
+        # A tensor is looked up by (the dict containing it, its name) in each
+        # update, since model.to() and assignments to buffers replace them
+        self.cur_refs = []
+        self.avg_refs = []
+        named_tensors = [
+            ("_parameters", model_avg.named_parameters()),
+            ("_buffers", model_avg.named_buffers()),
+        ]
+        for attr, named in named_tensors:
+            for name, v in named:
+                if not v.is_floating_point():
+                    continue
+                prefix, _, key = name.rpartition(".")
+                self.avg_refs.append(
+                    (getattr(model_avg.get_submodule(prefix), attr), key)
+                )
+                self.cur_refs.append(
+                    (getattr(model_cur.get_submodule(prefix), attr), key)
+                )
+
+        self.buffer: Optional[Tensor] = None
+        self.buffer_views: List[Tensor] = []
+
+    def update(self, weight_cur: float) -> None:
+        """Update the averaged model in-place.
+
+        Args:
+          weight_cur:
+            The weight of the current model.
+        """
+        with torch.no_grad():
+            avg = [d[k] for d, k in self.avg_refs]
+            cur = [d[k] for d, k in self.cur_refs]
+            if len(avg) == 0:
+                return
+            cur = self._to_device(cur, avg)
+
+            torch._foreach_mul_(avg, 1 - weight_cur)
+            torch._foreach_add_(avg, cur, alpha=weight_cur)
+
+    def _to_device(self, cur: List[Tensor], avg: List[Tensor]) -> List[Tensor]:
+        """Return the tensors in `cur` on the device of those in `avg`."""
+        device = avg[0].device
+        if all(c.device == device for c in cur):
+            return cur
+
+        if any(a.device != device for a in avg):
+            return [c.to(a.device) for c, a in zip(cur, avg)]
+
+        flat = torch.cat([c.reshape(-1) for c in cur])
+        if (
+            self.buffer is None
+            or self.buffer.numel() != flat.numel()
+            or self.buffer.dtype != flat.dtype
+        ):
+            pin_memory = device.type == "cpu" and flat.is_cuda
+            self.buffer = torch.empty(
+                flat.numel(), dtype=flat.dtype, device=device, pin_memory=pin_memory
+            )
+            self.buffer_views = [
+                v.view(c.shape)
+                for v, c in zip(self.buffer.split([c.numel() for c in cur]), cur)
+            ]
+
+        self.buffer.copy_(flat, non_blocking=True)
+        if flat.is_cuda and device.type == "cpu":
+            torch.cuda.current_stream(flat.device).synchronize()
+
+        return self.buffer_views
+
+
+# Map each averaged model to its AveragedModelUpdater
+_averaged_model_updaters = weakref.WeakKeyDictionary()
 
 
 def average_checkpoints_with_averaged_model(
     filename_start: str,
     filename_end: str,
     device: torch.device = torch.device("cpu"),
+    cache_dir: Optional[Union[str, Path]] = None,
 ) -> Dict[str, Tensor]:
     """Average model parameters over the range with given
     start model (excluded) and end model.
@@ -411,6 +787,10 @@ def average_checkpoints_with_averaged_model(
 
     The model index could be epoch number or iteration number.
 
+    Like :func:`average_checkpoints`, it loads the checkpoints with
+    :func:`load_checkpoint_for_averaging` and computes the average tensor by
+    tensor in float64.
+
     Args:
       filename_start:
         Checkpoint filename of the start model. We assume it
@@ -420,31 +800,48 @@ def average_checkpoints_with_averaged_model(
         is saved by :func:`save_checkpoint`.
       device:
         Move checkpoints to this device before averaging.
+      cache_dir:
+        If not None, the result is saved to this directory and reused by
+        later calls with the same filenames, if they are not modified.
     """
-    state_dict_start = torch.load(filename_start, map_location=device)
-    state_dict_end = torch.load(filename_end, map_location=device)
-
-    batch_idx_train_start = state_dict_start["batch_idx_train"]
-    batch_idx_train_end = state_dict_end["batch_idx_train"]
-    interval = batch_idx_train_end - batch_idx_train_start
-    assert interval > 0, interval
-    weight_end = batch_idx_train_end / interval
-    weight_start = 1 - weight_end
-
-    model_end = state_dict_end["model_avg"]
-    model_start = state_dict_start["model_avg"]
-    avg = model_end
-
-    # scale the weight to avoid overflow
-    average_state_dict(
-        state_dict_1=avg,
-        state_dict_2=model_start,
-        weight_1=1.0,
-        weight_2=weight_start / weight_end,
-        scaling_factor=weight_end,
-    )
 
-    return avg
+    def average() -> Dict[str, Tensor]:
+        state_dict_start = load_checkpoint_for_averaging(filename_start)
+        state_dict_end = load_checkpoint_for_averaging(filename_end)
+
+        batch_idx_train_start = state_dict_start["batch_idx_train"]
+        batch_idx_train_end = state_dict_end["batch_idx_train"]
+        interval = batch_idx_train_end - batch_idx_train_start
+        assert interval > 0, interval
+        weight_end = batch_idx_train_end / interval
+        weight_start = 1 - weight_end
+
+        model_end = state_dict_end["model_avg"]
+        model_start = state_dict_start["model_avg"]
+        names = _get_unique_names(model_end)
+
+        avg = dict()
+        for k, v in model_end.items():
+            if names[k] != k:
+                continue
+            if v.is_floating_point():
+                # scale the weight to avoid overflow
+                w = v.to(device=device, dtype=torch.float64)
+                w += model_start[k].to(device) * (weight_start / weight_end)
+                w *= weight_end
+                avg[k] = w.to(v.dtype)
+            else:
+                avg[k] = v.to(device=device, copy=True)
+
+        return {k: avg[names[k]] for k in names.keys()}
+
+    return _average_with_cache(
+        cache_dir=cache_dir,
+        name="average-checkpoints-with-averaged-model",
+        filenames=[filename_start, filename_end],
+        average_fn=average,
+        device=device,
+    )
 
 
 def average_state_dict(
@@ -15,7 +15,9 @@
 # limitations under the License.
 
 import logging
-from typing import Dict, List, Optional, Union
+import math
+import weakref
+from typing import Dict, List, Optional, Tuple, Union
 
 import k2
 import torch
@@ -93,6 +95,205 @@ def _intersect_device(
     return k2.cat(ans)
 
 
+def _get_kbest_paths(
+    src_states: torch.Tensor,
+    dest_states: torch.Tensor,
+    scores: torch.Tensor,
+    start_states: torch.Tensor,
+    final_states: torch.Tensor,
+    num_states: int,
+    k: int,
+    labels: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Find the k best paths from each start state to the corresponding
+    final state of a vector of acyclic graphs, in the tropical semiring.
+
+    The states of the graphs are processed level by level, where the level
+    of a state is the maximum number of arcs from a start state to it, so
+    the number of iterations in Python is the maximum path length instead of
+    the number of states.
+
+    Args:
+      src_states:
+        A 1-D tensor containing the source state of each arc. States are
+        numbered across all graphs.
+      dest_states:
+        A 1-D tensor containing the destination state of each arc.
+      scores:
+        A 1-D tensor containing the score of each arc.
+      start_states:
+        A 1-D tensor containing the start state of each graph.
+      final_states:
+        A 1-D tensor containing the final state of each graph.
+      num_states:
+        Total number of states.
+      k:
+        Number of paths to find for each graph.
+      labels:
+        If not None, a 1-D tensor containing the label of each arc. Paths
+        with the same sequence of positive labels are treated as the same
+        path and only the best of them is kept. Label sequences are compared
+        by a 64-bit hash.
+    Returns:
+      Return a tuple (num_paths, path_arcs, path_scores):
+
+        - num_paths, a 1-D tensor of dtype torch.int64 containing the number
+          of paths of each graph, which is k if the graph has at least k
+          paths from its start state to its final state
+
+        - path_arcs, a 2-D tensor of dtype torch.int64. Row i contains the
+          arcs of the i-th path, left padded with -1. Paths of the same graph
+          are consecutive and are sorted by score in descending order.
+
+        - path_scores, a 1-D tensor of dtype torch.float64 containing the
+          score of each path
+    """
+    device = scores.device
+    src_states = src_states.to(torch.int64)
+    dest_states = dest_states.to(torch.int64)
+    scores = scores.to(torch.float64)
+    start_states = start_states.to(torch.int64)
+    final_states = final_states.to(torch.int64)
+
+    # The level of a state is the maximum of level[src] + 1 over the arcs
+    # entering it. With the arcs sorted by destination state and
+    # level[src] + 1 offset by dest * (num_states + 1), the values of
+    # different states do not overlap, so cummax() gives the maximum of
+    # each state at its last arc.
+    level = torch.zeros(num_states, dtype=torch.int64, device=device)
+    by_dest = torch.sort(dest_states, stable=True).indices
+    sorted_src = src_states[by_dest]
+    sorted_dest = dest_states[by_dest]
+    is_last = torch.ones_like(sorted_dest, dtype=torch.bool)
+    is_last[:-1] = sorted_dest[1:] != sorted_dest[:-1]
+    offsets = sorted_dest * (num_states + 1)
+    while sorted_dest.numel() > 0:
+        max_level = (level[sorted_src] + 1 + offsets).cummax(0).values
+        new_level = level.clone()
+        new_level[sorted_dest[is_last]] = (max_level - offsets)[is_last]
+        if torch.equal(new_level, level):
+            break
+        level = new_level
+
+    # All arcs entering states of the same level are processed together.
+    # Their source states are in lower levels, which are already done.
+    arc_level = level[dest_states]
+    arc_order = torch.sort(arc_level, stable=True).indices
+    level_splits = torch.zeros(
+        int(level.max()) + 2 if num_states > 0 else 1,
+        dtype=torch.int64,
+        device=device,
+    )
+    level_splits[1:] = torch.cumsum(
+        torch.bincount(arc_level, minlength=level_splits.numel() - 1), 0
+    )
+    level_splits = level_splits.tolist()
+
+    # best_scores[s, r] is the score of the r-th best path from the start
+    # state to state s, which ends with the arc back_arcs[s, r] and
+    # continues the back_ranks[s, r]-th best path to the source state of it.
+    best_scores = torch.full(
+        (num_states, k), float("-inf"), dtype=torch.float64, device=device
+    )
+    best_scores[start_states, 0] = 0
+    back_arcs = torch.full((num_states, k), -1, dtype=torch.int64, device=device)
+    back_ranks = torch.full((num_states, k), -1, dtype=torch.int64, device=device)
+    # best_hashes[s, r] is the hash of the labels on the r-th best path to s.
+    # Overflows wrap around.
+    best_hashes = torch.zeros((num_states, k), dtype=torch.int64, device=device)
+    if labels is not None:
+        labels = labels.to(torch.int64)
+
+    ranks = torch.arange(k, device=device)
+    for i in range(1, len(level_splits) - 1):
+        arcs = arc_order[level_splits[i] : level_splits[i + 1]]
+        if arcs.numel() == 0:
+            continue
+        cand_scores = (best_scores[src_states[arcs]] + scores[arcs, None]).reshape(-1)
+        cand_arcs = arcs.repeat_interleave(k)
+        cand_ranks = ranks.repeat(arcs.numel())
+
+        valid = cand_scores > float("-inf")
+        cand_scores = cand_scores[valid]
+        cand_arcs = cand_arcs[valid]
+        cand_ranks = cand_ranks[valid]
+        cand_dests = dest_states[cand_arcs]
+        cand_hashes = best_hashes[src_states[cand_arcs], cand_ranks]
+
+        # Sort by score in descending order
+        order = torch.sort(cand_scores, descending=True, stable=True).indices
+
+        if labels is not None:
+            cand_labels = labels[cand_arcs]
+            cand_hashes = torch.where(
+                cand_labels > 0,
+                cand_hashes * 1000003 + cand_labels,
+                cand_hashes,
+            )
+            # Keep only the best candidate of each label sequence
+            # for each destination state
+            order = order[torch.sort(cand_hashes[order], stable=True).indices]
+            order = order[torch.sort(cand_dests[order], stable=True).indices]
+            is_dup = torch.zeros_like(order, dtype=torch.bool)
+            is_dup[1:] = (cand_dests[order[1:]] == cand_dests[order[:-1]]) & (
+                cand_hashes[order[1:]] == cand_hashes[order[:-1]]
+            )
+            order = order[~is_dup]
+            kept_scores = cand_scores[order]
+            kept_order = kept_scores.sort(descending=True, stable=True).indices
+            order = order[kept_order]
+
+        # Sort by destination state, then by score in descending order
+        order = order[torch.sort(cand_dests[order], stable=True).indices]
+        cand_dests = cand_dests[order]
+
+        # The rank of each candidate among those of the same destination state
+        positions = torch.arange(cand_dests.numel(), device=device)
+        is_first = torch.ones_like(cand_dests, dtype=torch.bool)
+        is_first[1:] = cand_dests[1:] != cand_dests[:-1]
+        group_starts = positions.masked_fill(~is_first, 0).cummax(0).values
+        cand_new_ranks = positions - group_starts
+
+        kept = cand_new_ranks < k
+        cand_dests = cand_dests[kept]
+        cand_new_ranks = cand_new_ranks[kept]
+        order = order[kept]
+        best_scores[cand_dests, cand_new_ranks] = cand_scores[order]
+        back_arcs[cand_dests, cand_new_ranks] = cand_arcs[order]
+        back_ranks[cand_dests, cand_new_ranks] = cand_ranks[order]
+        best_hashes[cand_dests, cand_new_ranks] = cand_hashes[order]
+
+    # The ranks of the paths to a state are consecutive starting from 0
+    num_paths = (best_scores[final_states] > float("-inf")).sum(dim=1)
+    path_to_graph = torch.repeat_interleave(
+        torch.arange(final_states.numel(), device=device), num_paths
+    )
+    path_offsets = torch.cumsum(num_paths, 0) - num_paths
+    cur_ranks = torch.arange(path_to_graph.numel(), device=device)
+    cur_ranks -= path_offsets[path_to_graph]
+    cur_states = final_states[path_to_graph]
+    path_scores = best_scores[cur_states, cur_ranks]
+
+    # Trace back. Arcs are collected from the last to the first one.
+    reversed_arcs = []
+    active = cur_states != start_states[path_to_graph]
+    while active.any():
+        arcs = back_arcs[cur_states, cur_ranks].masked_fill(~active, -1)
+        reversed_arcs.append(arcs)
+        prev_ranks = back_ranks[cur_states, cur_ranks]
+        cur_states = torch.where(active, src_states[arcs.clamp(min=0)], cur_states)
+        cur_ranks = torch.where(active, prev_ranks, cur_ranks)
+        active &= cur_states != start_states[path_to_graph]
+
+    if reversed_arcs:
+        path_arcs = torch.stack(reversed_arcs, dim=1).flip(dims=[1])
+    else:
+        path_arcs = torch.zeros(
+            (path_to_graph.numel(), 0), dtype=torch.int64, device=device
+        )
+    return num_paths, path_arcs, path_scores
+
+
 def get_lattice(
     nnet_output: torch.Tensor,
     decoding_graph: k2.Fsa,
@@ -213,6 +414,7 @@ class Nbest(object):
         num_paths: int,
         use_double_scores: bool = True,
         nbest_scale: float = 0.5,
+        exact_kbest: bool = False,
     ) -> "Nbest":
         """Construct an Nbest object by **sampling** `num_paths` from a lattice.
 
@@ -234,9 +436,16 @@ class Nbest(object):
             Scale `lattice.score` before passing it to :func:`k2.random_paths`.
             A smaller value leads to more unique paths at the risk of being not
             to sample the path with the best score.
+          exact_kbest:
+            True to return the `num_paths` best distinct word sequences
+            instead of sampling. See :func:`Nbest.from_lattice_kbest`.
+            `nbest_scale` does not affect the result in this case.
         Returns:
           Return an Nbest instance.
         """
+        if exact_kbest:
+            return Nbest.from_lattice_kbest(lattice=lattice, num_paths=num_paths)
+
         saved_scores = lattice.scores.clone()
         lattice.scores *= nbest_scale
         # path is a ragged tensor with dtype torch.int32.
@@ -304,6 +513,93 @@ class Nbest(object):
         # `fsa` has only one extra attribute: aux_labels.
         return Nbest(fsa=fsa, shape=utt_to_path_shape)
 
+    @staticmethod
+    def from_lattice_kbest(lattice: k2.Fsa, num_paths: int) -> "Nbest":
+        """Construct an Nbest object containing the `num_paths` distinct word
+        sequences with the highest scores (in the tropical semiring) of each
+        utterance, or all of them if there are fewer.
+
+        Unlike :func:`Nbest.from_lattice`, it is deterministic and no path
+        is wasted on repeated word sequences. The k best paths with distinct
+        word sequences of the word acceptor of the lattice are found by
+        dynamic programming over all utterances at once, on the device of the
+        lattice. Epsilon arcs are not removed, so it runs one iteration per
+        frame.
+
+        Caution:
+          Each path is a linear FSA whose `labels` and `aux_labels` are both
+          word IDs; there are no token IDs. Use :func:`Nbest.intersect` to
+          get the best token sequence of each word sequence.
+
+        Args:
+          lattice:
+            An FsaVec with axes [utt][state][arc]. If it has `aux_labels`,
+            we assume its `labels` are token IDs and `aux_labels` are word
+            IDs. Otherwise, we assume its `labels` are word IDs.
+          num_paths:
+            Number of word sequences to extract for each utterance.
+        Returns:
+          Return an Nbest instance. Paths of each utterance are sorted by
+          score in descending order.
+        """
+        device = lattice.device
+        if hasattr(lattice, "aux_labels"):
+            word_lattice = k2.invert(lattice)
+        else:
+            word_lattice = lattice
+
+        # Keep only word IDs and scores. It is not determinized, since
+        # _get_kbest_paths() keeps only the best path of each word sequence.
+        # States that are not on any path get a score of -inf in it.
+        word_lattice = k2.Fsa(word_lattice.arcs)
+
+        shape = word_lattice.arcs.shape()
+        state_splits = shape.row_splits(1).to(torch.int64)
+        src_states = shape.row_ids(2).to(torch.int64)
+        arc_to_utt = shape.row_ids(1).to(torch.int64)[src_states]
+        dest_states = state_splits[arc_to_utt] + word_lattice.arcs.values()[:, 1]
+
+        # Empty FSAs have no paths. The final state of an FSA is its last state.
+        non_empty = state_splits[1:] > state_splits[:-1]
+        num_paths_per_utt, path_arcs, _ = _get_kbest_paths(
+            src_states=src_states,
+            dest_states=dest_states,
+            scores=word_lattice.scores,
+            start_states=state_splits[:-1][non_empty],
+            final_states=state_splits[1:][non_empty] - 1,
+            num_states=int(state_splits[-1]),
+            k=num_paths,
+            labels=word_lattice.labels,
+        )
+        counts = torch.zeros(lattice.shape[0], dtype=torch.int64, device=device)
+        counts[non_empty] = num_paths_per_utt
+
+        # Remove padding and the -1 of final arcs
+        word_ids = word_lattice.labels.to(torch.int64)[path_arcs.clamp(min=0)]
+        mask = (path_arcs >= 0) & (word_ids > 0)
+        word_ids = word_ids[mask].to(torch.int32)
+        word_seq_splits = torch.zeros(
+            path_arcs.shape[0] + 1, dtype=torch.int32, device=device
+        )
+        word_seq_splits[1:] = torch.cumsum(mask.sum(dim=1), 0)
+        word_seq_shape = k2.ragged.create_ragged_shape2(
+            word_seq_splits, None, word_ids.numel()
+        )
+        # word_seq has axes [path][word]
+        word_seq = k2.RaggedTensor(word_seq_shape, word_ids)
+
+        fsa = k2.linear_fsa(word_seq)
+        fsa.aux_labels = fsa.labels.clone()
+
+        path_splits = torch.zeros(
+            lattice.shape[0] + 1, dtype=torch.int32, device=device
+        )
+        path_splits[1:] = torch.cumsum(counts, 0)
+        utt_to_path_shape = k2.ragged.create_ragged_shape2(
+            path_splits, None, int(path_splits[-1])
+        )
+        return Nbest(fsa=fsa, shape=utt_to_path_shape)
+
     def intersect(self, lattice: k2.Fsa, use_double_scores=True) -> "Nbest":
         """Intersect this Nbest object with a lattice, get 1-best
         path from the resulting FsaVec, and return a new Nbest object.
@@ -492,6 +788,7 @@ def nbest_decoding(
     num_paths: int,
     use_double_scores: bool = True,
     nbest_scale: float = 1.0,
+    exact_kbest: bool = False,
 ) -> k2.Fsa:
     """It implements something like CTC prefix beam search using n-best lists.
 
@@ -522,6 +819,9 @@ def nbest_decoding(
       nbest_scale:
         It's the scale applied to the `lattice.scores`. A smaller value
         leads to more unique paths at the risk of missing the correct path.
+      exact_kbest:
+        True to use the `num_paths` best distinct word sequences instead of
+        sampling paths. See :func:`Nbest.from_lattice_kbest`.
     Returns:
       An FsaVec containing **linear** FSAs. It axes are [utt][state][arc].
     """
@@ -530,6 +830,7 @@ def nbest_decoding(
         num_paths=num_paths,
         use_double_scores=use_double_scores,
         nbest_scale=nbest_scale,
+        exact_kbest=exact_kbest,
     )
     # nbest.fsa.scores contains 0s
 
@@ -637,6 +938,7 @@ def rescore_with_n_best_list(
     lm_scale_list: List[float],
     nbest_scale: float = 1.0,
     use_double_scores: bool = True,
+    exact_kbest: bool = False,
 ) -> Dict[str, k2.Fsa]:
     """Rescore an n-best list with an n-gram LM.
     The path with the maximum score is used as the decoding output.
@@ -658,6 +960,9 @@ def rescore_with_n_best_list(
       use_double_scores:
         True to use double precision during computation. False to use
         single precision.
+      exact_kbest:
+        True to use the `num_paths` best distinct word sequences instead of
+        sampling paths. See :func:`Nbest.from_lattice_kbest`.
     Returns:
       A dict of FsaVec, whose key is an lm_scale and the value is the
       best decoding path for each utterance in the lattice.
@@ -681,6 +986,7 @@ def rescore_with_n_best_list(
                 num_paths=num_paths,
                 use_double_scores=use_double_scores,
                 nbest_scale=nbest_scale,
+                exact_kbest=exact_kbest,
             )
             # nbest.fsa.scores are all 0s at this point
             nbest = nbest.intersect(lattice)
@@ -721,11 +1027,77 @@ def rescore_with_n_best_list(
     return ans
 
 
+class IntersectionSizePredictor(object):
+    """Predict the number of arcs of the intersection of a lattice and G
+    from the number of arcs of the lattice.
+
+    The ratio between them is learned from previous intersections. It follows
+    increases immediately and decreases slowly, so that we rarely
+    under-estimate the size of the intersection.
+    """
+
+    def __init__(self, ratio: float = 10.0, decay: float = 0.9):
+        """
+        Args:
+          ratio:
+            The initial ratio, used before any intersection is done.
+          decay:
+            How slowly the ratio decreases.
+        """
+        self.ratio = ratio
+        self.decay = decay
+
+    def predict(self, num_arcs: int) -> float:
+        return num_arcs * self.ratio
+
+    def update(self, num_arcs_in: int, num_arcs_out: int) -> None:
+        ratio = num_arcs_out / max(num_arcs_in, 1)
+        self.ratio = max(ratio, self.decay * self.ratio + (1 - self.decay) * ratio)
+
+
+# Keyed by G_with_epsilon_loops
+_intersection_size_predictors = weakref.WeakKeyDictionary()
+
+
+def _prune_to_max_arcs(
+    fsas: k2.Fsa,
+    max_arcs: float,
+    prune_th_list: List[float],
+) -> Tuple[k2.Fsa, int]:
+    """Prune `fsas` with the smallest threshold in `prune_th_list` that
+    leaves at most `max_arcs` arcs.
+
+    Returns:
+      Return a tuple (pruned_fsas, num_thresholds_used). If all thresholds
+      leave more than `max_arcs` arcs, the largest one is used.
+    """
+    num_arcs = fsas.arcs.num_elements()
+    if num_arcs <= max_arcs:
+        return fsas, 0
+
+    # k2.prune_on_arc_post() keeps arcs whose log posterior is not less than
+    # log(threshold). Count them for all thresholds at once.
+    arc_post = fsas.get_arc_post(use_double_scores=True, log_semiring=True)
+    sorted_arc_post = torch.sort(arc_post).values
+    log_th = torch.tensor(
+        [math.log(th) for th in prune_th_list],
+        dtype=sorted_arc_post.dtype,
+        device=sorted_arc_post.device,
+    )
+    num_kept = num_arcs - torch.searchsorted(sorted_arc_post, log_th)
+    fits = (num_kept <= max_arcs).tolist()
+    index = fits.index(True) if True in fits else len(prune_th_list) - 1
+
+    fsas = k2.prune_on_arc_post(fsas, prune_th_list[index], True)
+    return fsas, index + 1
+
+
 def rescore_with_whole_lattice(
     lattice: k2.Fsa,
     G_with_epsilon_loops: k2.Fsa,
     lm_scale_list: Optional[List[float]] = None,
     use_double_scores: bool = True,
+    max_arcs: Optional[int] = None,
 ) -> Union[k2.Fsa, Dict[str, k2.Fsa]]:
     """Intersect the lattice with an n-gram LM and use shortest path
     to decode.
@@ -752,6 +1124,15 @@ def rescore_with_whole_lattice(
       use_double_scores:
         True to use double precision in the computation.
         False to use single precision.
+      max_arcs:
+        Optional. If None, the lattice is pruned only when the intersection
+        runs out of memory, with increasing thresholds until it succeeds.
+        If not None, it is the expected maximum number of arcs of the
+        intersection. The size of the intersection is predicted from the
+        number of arcs of the lattice and the lattice is pruned before
+        the intersection to fit it. Also, the best paths of all entries in
+        `lm_scale_list` are computed together in as few calls to
+        `k2.shortest_path()` as `max_arcs` allows.
     Returns:
       If `lm_scale_list` is None, return a new lattice which is the intersection
       result of `lattice` and `G_with_epsilon_loops`.
@@ -782,9 +1163,32 @@ def rescore_with_whole_lattice(
     # You may need to fine tune it.
     prune_th_list = [1e-10, 1e-9, 1e-8, 1e-7, 1e-6]
     prune_th_list += [1e-5, 1e-4, 1e-3, 1e-2, 1e-1]
-    max_loop_count = 10
-    loop_count = 0
-    while loop_count <= max_loop_count:
+
+    # Index into prune_th_list of the next threshold to use
+    th_index = 0
+    if max_arcs is not None:
+        predictor = _intersection_size_predictors.get(G_with_epsilon_loops)
+        if predictor is None:
+            predictor = IntersectionSizePredictor()
+            _intersection_size_predictors[G_with_epsilon_loops] = predictor
+
+        num_arcs = inv_lattice.arcs.num_elements()
+        predicted_num_arcs = predictor.predict(num_arcs)
+        if predicted_num_arcs > max_arcs:
+            inv_lattice, th_index = _prune_to_max_arcs(
+                inv_lattice,
+                max_arcs=max_arcs / predictor.ratio,
+                prune_th_list=prune_th_list,
+            )
+            logging.info(
+                f"Predicted {int(predicted_num_arcs)} arcs for the intersection "
+                f"(max_arcs: {max_arcs}). Pruned the lattice with threshold "
+                f"{prune_th_list[th_index - 1]}: "
+                f"num_arcs {num_arcs} -> {inv_lattice.arcs.num_elements()}"
+            )
+
+    num_retries = 0
+    while True:
         try:
             rescoring_lattice = k2.intersect_device(
                 G_with_epsilon_loops,
@@ -792,11 +1196,16 @@ def rescore_with_whole_lattice(
                 b_to_a_map,
                 sorted_match_a=True,
             )
+            if max_arcs is not None:
+                predictor.update(
+                    num_arcs_in=inv_lattice.arcs.num_elements(),
+                    num_arcs_out=rescoring_lattice.arcs.num_elements(),
+                )
             rescoring_lattice = k2.top_sort(k2.connect(rescoring_lattice))
             break
         except RuntimeError as e:
             logging.info(f"Caught exception:\n{e}\n")
-            if loop_count >= max_loop_count:
+            if th_index >= len(prune_th_list):
                 logging.info("Return None as the resulting lattice is too large.")
                 return None
             logging.info(f"num_arcs before pruning: {inv_lattice.arcs.num_elements()}")
@@ -808,11 +1217,22 @@ def rescore_with_whole_lattice(
             )
             inv_lattice = k2.prune_on_arc_post(
                 inv_lattice,
-                prune_th_list[loop_count],
+                prune_th_list[th_index],
                 True,
             )
-            logging.info(f"num_arcs after pruning: {inv_lattice.arcs.num_elements()}")
-        loop_count += 1
+            logging.info(
+                f"Retry {num_retries + 1}: pruned with threshold "
+                f"{prune_th_list[th_index]}, "
+                f"num_arcs after pruning: {inv_lattice.arcs.num_elements()}"
+            )
+            th_index += 1
+            num_retries += 1
+
+    if num_retries > 0:
+        logging.info(
+            f"Intersection succeeded after {num_retries} retries "
+            f"with threshold {prune_th_list[th_index - 1]}"
+        )
 
     # lat has token IDs as labels
     # and word IDs as aux_labels.
@@ -821,6 +1241,14 @@ def rescore_with_whole_lattice(
     if lm_scale_list is None:
         return lat
 
+    if max_arcs is not None:
+        return _get_best_paths_for_lm_scales(
+            lat,
+            lm_scale_list=lm_scale_list,
+            max_arcs=max_arcs,
+            use_double_scores=use_double_scores,
+        )
+
     ans = dict()
     saved_am_scores = lat.scores - lat.lm_scores
     for lm_scale in lm_scale_list:
@@ -833,6 +1261,176 @@ def rescore_with_whole_lattice(
     return ans
 
 
+def _get_best_paths_for_lm_scales(
+    lat: k2.Fsa,
+    lm_scale_list: List[float],
+    max_arcs: int,
+    use_double_scores: bool = True,
+) -> Dict[str, k2.Fsa]:
+    """Like the loop over `lm_scale_list` in :func:`rescore_with_whole_lattice`,
+    but the lattice is replicated once per LM scale and the best paths
+    of the copies are computed by a single call to `k2.shortest_path()`.
+    The copies of at most `max_arcs` arcs in total are processed together.
+
+    Args:
+      lat:
+        An FsaVec with axes [utt][state][arc]. It must have an attribute
+        `lm_scores`.
+      lm_scale_list:
+        A list of values to scale LM scores.
+      max_arcs:
+        The maximum number of arcs processed together.
+      use_double_scores:
+        True to use double precision in the computation.
+        False to use single precision.
+    Returns:
+      Return a dict whose key is "lm_scale_{lm_scale}" for each entry in
+      `lm_scale_list` and the value is the decoding result.
+    """
+    device = lat.device
+    num_seqs = lat.shape[0]
+    saved_am_scores = lat.scores - lat.lm_scores
+    num_arcs = lat.arcs.num_elements()
+    num_scales_per_pass = max(1, max_arcs // max(num_arcs, 1))
+
+    ans = dict()
+    for start in range(0, len(lm_scale_list), num_scales_per_pass):
+        lm_scales = lm_scale_list[start : start + num_scales_per_pass]
+        indexes = torch.arange(num_seqs, dtype=torch.int32, device=device)
+        # The arcs of the i-th copy are in [i * num_arcs, (i + 1) * num_arcs)
+        # and are in the same order as those of `lat`
+        replicated = k2.index_fsa(lat, indexes.repeat(len(lm_scales)))
+        replicated.scores = torch.cat(
+            [saved_am_scores / lm_scale + lat.lm_scores for lm_scale in lm_scales]
+        )
+
+        best_paths = k2.shortest_path(replicated, use_double_scores=use_double_scores)
+        for i, lm_scale in enumerate(lm_scales):
+            key = f"lm_scale_{lm_scale}"
+            ans[key] = k2.index_fsa(best_paths, indexes + i * num_seqs)
+    return ans
+
+
+def _compute_attention_scores(
+    model: torch.nn.Module,
+    memory: torch.Tensor,
+    memory_key_padding_mask: Optional[torch.Tensor],
+    token_ids: List[List[int]],
+    path_to_utt_map: torch.Tensor,
+    sos_id: int,
+    eos_id: int,
+    max_tokens: int,
+) -> torch.Tensor:
+    """Compute the attention decoder scores of paths in batches.
+
+    Paths are sorted by length and split into batches of at most
+    `max_tokens` tokens after padding, so that paths of similar lengths are
+    processed together and the memory is only replicated for the paths of
+    one batch at a time.
+
+    Args:
+      model:
+        A transformer model with a method `decoder_nll`.
+      memory:
+        The encoder memory of shape `(T, N, C)`.
+      memory_key_padding_mask:
+        The padding mask for memory with shape `(N, T)`.
+      token_ids:
+        The token IDs of each path.
+      path_to_utt_map:
+        A 1-D tensor mapping from path index to utterance index.
+      sos_id:
+        The token ID for SOS.
+      eos_id:
+        The token ID for EOS.
+      max_tokens:
+        Maximum number of tokens, including padding, in a batch.
+    Returns:
+      Return a 1-D tensor containing the attention decoder score, i.e., the
+      log-likelihood, of each path.
+    """
+    device = memory.device
+    # plus 1 for SOS or EOS
+    lengths = torch.tensor([len(t) + 1 for t in token_ids])
+    order = torch.sort(lengths, descending=True, stable=True).indices.tolist()
+    lengths = lengths.tolist()
+
+    scores = torch.empty(len(token_ids), dtype=memory.dtype, device=device)
+    start = 0
+    while start < len(order):
+        # The first path of a batch is the longest one
+        batch_size = max(1, max_tokens // lengths[order[start]])
+        indexes = order[start : start + batch_size]
+        start += batch_size
+
+        utt_indexes = path_to_utt_map[indexes]
+        # the shape of memory is (T, N, C), so we use axis=1 here
+        batch_memory = memory.index_select(1, utt_indexes)
+        if memory_key_padding_mask is not None:
+            batch_memory_key_padding_mask = memory_key_padding_mask.index_select(
+                0, utt_indexes
+            )
+        else:
+            batch_memory_key_padding_mask = None
+
+        nll = model.decoder_nll(
+            memory=batch_memory,
+            memory_key_padding_mask=batch_memory_key_padding_mask,
+            token_ids=[token_ids[i] for i in indexes],
+            sos_id=sos_id,
+            eos_id=eos_id,
+        )
+        assert nll.ndim == 2
+        assert nll.shape[0] == len(indexes)
+        scores[torch.tensor(indexes, device=device)] = -nll.sum(dim=1)
+    return scores
+
+
+def _get_best_path_indexes(
+    tot_scores: torch.Tensor,
+    path_to_utt_map: torch.Tensor,
+    num_utts: int,
+) -> torch.Tensor:
+    """Find the path with the maximum score of each utterance for several
+    sets of scores at once.
+
+    Args:
+      tot_scores:
+        A 2-D tensor of shape (num_sets, num_paths).
+      path_to_utt_map:
+        A 1-D tensor of dtype torch.int64 mapping from path index to
+        utterance index. Paths of the same utterance are consecutive.
+      num_utts:
+        Number of utterances.
+    Returns:
+      Return a 2-D tensor of shape (num_sets, num_utts) and dtype torch.int64
+      containing the index of the best path of each utterance, i.e., the
+      first path with the maximum score, or -1 if the utterance has no paths.
+    """
+    num_sets = tot_scores.shape[0]
+    device = tot_scores.device
+
+    # Sort the paths of each set by score in descending order, and then by
+    # utterance. Both sorts are stable, so the first path of each utterance
+    # is the first one with the maximum score.
+    order = torch.sort(tot_scores, dim=1, descending=True, stable=True).indices
+    utt_order = torch.sort(path_to_utt_map[order], dim=1, stable=True).indices
+    order = order.gather(1, utt_order)
+
+    num_paths_per_utt = torch.bincount(path_to_utt_map, minlength=num_utts)
+    starts = torch.cumsum(num_paths_per_utt, 0) - num_paths_per_utt
+    has_paths = num_paths_per_utt > 0
+
+    best = torch.full(
+        (num_sets, num_utts),
+        -1,
+        dtype=torch.int64,
+        device=device,
+    )
+    best[:, has_paths] = order[:, starts[has_paths]]
+    return best
+
+
 def rescore_with_attention_decoder(
     lattice: k2.Fsa,
     num_paths: int,
@@ -845,11 +1443,17 @@ def rescore_with_attention_decoder(
     ngram_lm_scale: Optional[float] = None,
     attention_scale: Optional[float] = None,
     use_double_scores: bool = True,
+    exact_kbest: bool = False,
+    max_tokens: int = 10000,
 ) -> Dict[str, k2.Fsa]:
     """This function extracts `num_paths` paths from the given lattice and uses
     an attention decoder to rescore them. The path with the highest score is
     the decoding output.
 
+    Paths are rescored in batches of similar lengths, see
+    :func:`_compute_attention_scores`, and the best paths for all
+    combinations of scales are selected together.
+
     Args:
       lattice:
         An FsaVec with axes [utt][state][arc].
@@ -875,6 +1479,12 @@ def rescore_with_attention_decoder(
         Optional. It specifies the scale for n-gram LM scores.
       attention_scale:
         Optional. It specifies the scale for attention decoder scores.
+      exact_kbest:
+        True to use the `num_paths` best distinct word sequences instead of
+        sampling paths. See :func:`Nbest.from_lattice_kbest`.
+      max_tokens:
+        Maximum number of tokens, including padding, of the paths passed
+        to the attention decoder at a time.
     Returns:
       A dict of FsaVec, whose key contains a string
       ngram_lm_scale_attention_scale and the value is the
@@ -889,6 +1499,7 @@ def rescore_with_attention_decoder(
                 num_paths=num_paths,
                 use_double_scores=use_double_scores,
                 nbest_scale=nbest_scale,
+                exact_kbest=exact_kbest,
             )
             # nbest.fsa.scores are all 0s at this point
             nbest = nbest.intersect(lattice)
@@ -921,17 +1532,6 @@ def rescore_with_attention_decoder(
     assert isinstance(nbest.fsa.tokens, torch.Tensor)
 
     path_to_utt_map = nbest.shape.row_ids(1).to(torch.long)
-    # the shape of memory is (T, N, C), so we use axis=1 here
-    expanded_memory = memory.index_select(1, path_to_utt_map)
-
-    if memory_key_padding_mask is not None:
-        # The shape of memory_key_padding_mask is (N, T), so we
-        # use axis=0 here.
-        expanded_memory_key_padding_mask = memory_key_padding_mask.index_select(
-            0, path_to_utt_map
-        )
-    else:
-        expanded_memory_key_padding_mask = None
 
     # remove axis corresponding to states.
     tokens_shape = nbest.fsa.arcs.shape().remove_axis(1)
@@ -943,18 +1543,17 @@ def rescore_with_attention_decoder(
         print("Warning: rescore_with_attention_decoder(): empty token-ids")
         return None
 
-    nll = model.decoder_nll(
-        memory=expanded_memory,
-        memory_key_padding_mask=expanded_memory_key_padding_mask,
+    attention_scores = _compute_attention_scores(
+        model=model,
+        memory=memory,
+        memory_key_padding_mask=memory_key_padding_mask,
         token_ids=token_ids,
+        path_to_utt_map=path_to_utt_map,
         sos_id=sos_id,
         eos_id=eos_id,
+        max_tokens=max_tokens,
     )
-    assert nll.ndim == 2
-    assert nll.shape[0] == len(token_ids)
 
-    attention_scores = -nll.sum(dim=1)
-    
     if ngram_lm_scale is None:
         ngram_lm_scale_list = [0]
         #ngram_lm_scale_list = [0.01, 0.05, 0.08]
@@ -972,20 +1571,41 @@ def rescore_with_attention_decoder(
     else:
         attention_scale_list = [attention_scale]
 
+    am_scores = am_scores.values
+    ngram_lm_scores = ngram_lm_scores.values
+    attention_scores = attention_scores.to(am_scores.dtype)
+    n_scales = torch.tensor(
+        ngram_lm_scale_list, dtype=am_scores.dtype, device=am_scores.device
+    )
+    a_scales = torch.tensor(
+        attention_scale_list, dtype=am_scores.dtype, device=am_scores.device
+    )
+    # tot_scores has shape (len(ngram_lm_scale_list), len(attention_scale_list),
+    # num_paths)
+    tot_scores = (
+        am_scores
+        + n_scales[:, None, None] * ngram_lm_scores
+        + a_scales[None, :, None] * attention_scores
+    )
+    best_indexes = _get_best_path_indexes(
+        tot_scores.reshape(-1, tot_scores.shape[-1]),
+        path_to_utt_map=path_to_utt_map,
+        num_utts=nbest.shape.dim0,
+    ).to(torch.int32)
+
+    # Different combinations of scales often select the same paths,
+    # so best paths are extracted only once for each distinct selection.
+    best_paths = dict()
     ans = dict()
-    for n_scale in ngram_lm_scale_list:
-        for a_scale in attention_scale_list:
-            tot_scores = (
-                am_scores.values
-                + n_scale * ngram_lm_scores.values
-                + a_scale * attention_scores
-            )
-            ragged_tot_scores = k2.RaggedTensor(nbest.shape, tot_scores)
-            max_indexes = ragged_tot_scores.argmax()
-            best_path = k2.index_fsa(nbest.fsa, max_indexes)
-
-            key = f"ngram_lm_scale_{n_scale}_attention_scale_{a_scale}"
-            ans[key] = best_path
+    for i, (n_scale, a_scale) in enumerate(
+        (n, a) for n in ngram_lm_scale_list for a in attention_scale_list
+    ):
+        selection = tuple(best_indexes[i].tolist())
+        if selection not in best_paths:
+            best_paths[selection] = k2.index_fsa(nbest.fsa, best_indexes[i])
+
+        key = f"ngram_lm_scale_{n_scale}_attention_scale_{a_scale}"
+        ans[key] = best_paths[selection]
     return ans
 
 
@@ -1004,6 +1624,7 @@ def rescore_with_rnn_lm(
     attention_scale: Optional[float] = None,
     rnn_lm_scale: Optional[float] = None,
     use_double_scores: bool = True,
+    exact_kbest: bool = False,
 ) -> Dict[str, k2.Fsa]:
     """This function extracts `num_paths` paths from the given lattice and uses
     an attention decoder to rescore them. The path with the highest score is
@@ -1038,6 +1659,9 @@ def rescore_with_rnn_lm(
         Optional. It specifies the scale for attention decoder scores.
       rnn_lm_scale:
         Optional. It specifies the scale for RNN LM scores.
+      exact_kbest:
+        True to use the `num_paths` best distinct word sequences instead of
+        sampling paths. See :func:`Nbest.from_lattice_kbest`.
     Returns:
       A dict of FsaVec, whose key contains a string
       ngram_lm_scale_attention_scale and the value is the
@@ -1048,6 +1672,7 @@ def rescore_with_rnn_lm(
         num_paths=num_paths,
         use_double_scores=use_double_scores,
         nbest_scale=nbest_scale,
+        exact_kbest=exact_kbest,
     )
     # nbest.fsa.scores are all 0s at this point
 
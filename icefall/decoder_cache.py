@@ -0,0 +1,152 @@
+# Copyright    2026  The icefall authors
+#
+# See ../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+import torch
+
+
+class DecoderOutputCache(object):
+    """A bounded LRU cache of the decoder output projected by
+    `model.joiner.decoder_proj`, keyed by the decoder input, i.e., the last
+    `context_size` tokens of a hypothesis.
+
+    The output of the stateless decoder depends only on its input, which
+    does not change when a hypothesis is extended with blank. As most frames
+    emit blank, most decoder calls in beam search are redundant. A cache is
+    shared by all hypotheses and all frames it is used for, and may also be
+    shared across streams and chunks in streaming decoding.
+
+    Caution:
+      A cache is bound to the parameters of the model. Create a new one
+      if the model is changed.
+    """
+
+    def __init__(self, model: torch.nn.Module, max_size: int = 10000) -> None:
+        """
+        Args:
+          model:
+            The transducer model. It must have `model.decoder` and
+            `model.joiner.decoder_proj`.
+          max_size:
+            Max number of decoder outputs to keep. The least recently used
+            one is evicted when it is full.
+        """
+        assert max_size > 0, max_size
+        self.model = model
+        self.max_size = max_size
+        self.device = next(model.parameters()).device
+
+        # It maps a decoder input to a row of self._data
+        self._rows: "OrderedDict[Tuple[int, ...], int]" = OrderedDict()
+
+        # It is allocated on first use, of shape (max_size, joiner_dim)
+        self._data: Optional[torch.Tensor] = None
+
+        # Number of decoder outputs returned from the cache
+        # and computed by the model, respectively
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.num_hits + self.num_misses
+        return self.num_hits / total if total > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"DecoderOutputCache(size={len(self)}, max_size={self.max_size}, "
+            f"hits={self.num_hits}, misses={self.num_misses}, "
+            f"hit_rate={self.hit_rate:.3f})"
+        )
+
+    def _run_decoder(self, contexts: List[Tuple[int, ...]]) -> torch.Tensor:
+        decoder_input = torch.tensor(
+            contexts,
+            device=self.device,
+            dtype=torch.int64,
+        )
+        decoder_out = self.model.decoder(decoder_input, need_pad=False)
+        decoder_out = self.model.joiner.decoder_proj(decoder_out)
+        # decoder_out is of shape (len(contexts), 1, joiner_dim)
+        return decoder_out.squeeze(1)
+
+    def get(
+        self,
+        contexts: Union[torch.Tensor, List[List[int]]],
+    ) -> torch.Tensor:
+        """Return the projected decoder output for the given decoder inputs.
+
+        Args:
+          contexts:
+            A 2-D tensor of shape (num_contexts, context_size), or a list of
+            `num_contexts` lists, each containing `context_size` tokens.
+        Returns:
+          Return a tensor of shape (num_contexts, joiner_dim).
+        """
+        if isinstance(contexts, torch.Tensor):
+            contexts = contexts.tolist()
+        keys = [tuple(c) for c in contexts]
+
+        # dict.fromkeys() removes duplicates and keeps the order
+        unique_keys = list(dict.fromkeys(keys))
+        if len(unique_keys) > self.max_size:
+            # They cannot fit into the cache
+            self.num_misses += len(unique_keys)
+            self.num_hits += len(keys) - len(unique_keys)
+            return self._run_decoder(keys)
+
+        misses = []
+        for key in unique_keys:
+            if key in self._rows:
+                self._rows.move_to_end(key)
+            else:
+                misses.append(key)
+
+        self.num_misses += len(misses)
+        self.num_hits += len(keys) - len(misses)
+
+        if misses:
+            decoder_out = self._run_decoder(misses)
+            if self._data is None:
+                self._data = decoder_out.new_empty(
+                    (self.max_size, decoder_out.size(-1))
+                )
+
+            rows = []
+            for key in misses:
+                if len(self._rows) < self.max_size:
+                    row = len(self._rows)
+                else:
+                    # Evict the least recently used one. It cannot be
+                    # one of `keys` since they are the most recently used.
+                    _, row = self._rows.popitem(last=False)
+                self._rows[key] = row
+                rows.append(row)
+
+            rows = torch.tensor(rows, device=self.device, dtype=torch.int64)
+            self._data.index_copy_(0, rows, decoder_out)
+
+        index = torch.tensor(
+            [self._rows[key] for key in keys],
+            device=self.device,
+            dtype=torch.int64,
+        )
+        return self._data.index_select(0, index)
@@ -17,9 +17,12 @@
 # limitations under the License.
 
 
+import json
 import random
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
 
 import torch
 from torch import Tensor, nn
@@ -380,6 +383,235 @@ def attach_diagnostics(
     return ans
 
 
+# The stats accumulated by SampledModelDiagnostic for each tensor
+_SAMPLED_STATS = ["count", "sum", "abs", "sq", "positive", "nonfinite", "max", "min"]
+
+
+def get_sampled_tensor_stats(x: Tensor, max_elements: int) -> Tensor:
+    """Return the stats of at most `max_elements` elements of `x`, in the order
+    of `_SAMPLED_STATS`. The elements are taken with a random offset and a
+    fixed stride, so this is cheap even for large tensors. Non-finite elements
+    are counted but otherwise ignored.
+
+    Args:
+      x:
+        The tensor to be analyzed.
+      max_elements:
+        Max number of elements of `x` used.
+    Returns:
+      A 1-D float tensor on the device of `x`.
+    """
+    x = x.detach().reshape(-1)
+    if x.numel() > max_elements:
+        stride = x.numel() // max_elements
+        offset = random.randrange(x.numel() - stride * (max_elements - 1))
+        x = x[offset::stride][:max_elements]
+    x = x.float()
+    finite = torch.isfinite(x)
+    x = torch.where(finite, x, torch.zeros_like(x))
+    sums = torch.stack([x, x.abs(), x * x, (x > 0).float(), (~finite).float()]).sum(
+        dim=1
+    )
+    count = torch.full_like(sums[:1], x.numel())
+    return torch.cat([count, sums, x.max().unsqueeze(0), x.min().unsqueeze(0)])
+
+
+class SampledModelDiagnostic(object):
+    """Low-overhead diagnostics that can be kept on for a whole training run,
+    unlike :func:`attach_diagnostics`.
+
+    Only a fraction of the steps are sampled. On each sampled step, hooks are
+    attached to a random subset of the modules and are removed at the next
+    call of :meth:`step`, so steps that are not sampled have no overhead.
+    The hooks compute scalar stats (see `_SAMPLED_STATS`) of a subsample of
+    the output, the output gradient, the parameters and the parameter
+    gradients of each module, which are accumulated on the device without
+    synchronization.
+
+    Every `flush_interval` steps, the accumulated stats are copied to the CPU
+    and written to TensorBoard and/or a file by a background thread.
+
+    Usage::
+
+        diagnostic = SampledModelDiagnostic(model, tb_writer=tb_writer)
+        for batch in train_dl:
+            diagnostic.step(params.batch_idx_train)
+            ...  # forward, backward and optimizer step
+        diagnostic.close()
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        step_fraction: float = 0.01,
+        module_fraction: float = 0.1,
+        max_elements: int = 4096,
+        flush_interval: int = 1000,
+        tb_writer: Optional["SummaryWriter"] = None,  # noqa
+        filename: Optional[Union[str, Path]] = None,
+    ):
+        """
+        Args:
+          model:
+            The model to be analyzed.
+          step_fraction:
+            The fraction of steps that are sampled.
+          module_fraction:
+            The fraction of modules analyzed on each sampled step.
+          max_elements:
+            Max number of elements of each tensor used to compute the stats.
+          flush_interval:
+            Write the stats every this number of steps.
+          tb_writer:
+            If not None, the stats are written to it.
+          filename:
+            If not None, the stats are appended to this file, one JSON
+            object per line.
+        """
+        self.step_fraction = step_fraction
+        self.module_fraction = module_fraction
+        self.max_elements = max_elements
+        self.flush_interval = flush_interval
+        self.tb_writer = tb_writer
+        self.filename = filename
+
+        self.modules = []
+        for name, module in model.named_modules():
+            self.modules.append((name if name != "" else "<top-level>", module))
+
+        # Accumulated stats of each tensor, on the device of the tensor
+        self.stats: Dict[str, Tensor] = dict()
+        self.handles = []
+        self.cur_step = None
+        self.last_flush_step = None
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def _accumulate(self, name: str, x: Tensor) -> None:
+        if not isinstance(x, Tensor) or x.numel() == 0:
+            return
+        stats = get_sampled_tensor_stats(x, self.max_elements)
+        acc = self.stats.get(name)
+        if acc is None or acc.device != stats.device:
+            self.stats[name] = stats
+        else:
+            acc[:-2] += stats[:-2]
+            torch.maximum(acc[-2], stats[-2], out=acc[-2])
+            torch.minimum(acc[-1], stats[-1], out=acc[-1])
+
+    def _attach(self) -> None:
+        num_modules = max(1, int(len(self.modules) * self.module_fraction))
+        for name, module in random.sample(self.modules, num_modules):
+
+            def forward_hook(_module, _input, output, _name=name):
+                if not _module.training:
+                    # e.g., validation between two calls of step()
+                    return
+                if isinstance(output, tuple) and len(output) >= 1:
+                    output = output[0]
+                if not isinstance(output, Tensor):
+                    return
+                self._accumulate(f"{_name}.output", output)
+                if output.requires_grad:
+                    output.register_hook(
+                        lambda grad: self._accumulate(f"{_name}.grad", grad)
+                    )
+
+            self.handles.append(module.register_forward_hook(forward_hook))
+
+            for param_name, param in module.named_parameters(recurse=False):
+                if not param.requires_grad:
+                    continue
+
+                def param_hook(grad, _param=param, _name=f"{name}.{param_name}"):
+                    self._accumulate(f"{_name}.param_value", _param)
+                    self._accumulate(f"{_name}.param_grad", grad)
+
+                self.handles.append(param.register_hook(param_hook))
+
+    def _detach(self) -> None:
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def step(self, step: int) -> None:
+        """Call it before the forward pass of each step.
+
+        Args:
+          step:
+            The global step index, e.g., params.batch_idx_train.
+        """
+        self._detach()
+        self.cur_step = step
+        if self.last_flush_step is None:
+            self.last_flush_step = step
+        if step - self.last_flush_step >= self.flush_interval:
+            self.flush(step)
+        if random.random() < self.step_fraction:
+            self._attach()
+
+    def flush(self, step: int) -> None:
+        """Write the stats accumulated so far in a background thread, and
+        reset them."""
+        self.last_flush_step = step
+        if not self.stats:
+            return
+        stats = {name: s.to("cpu", non_blocking=True) for name, s in self.stats.items()}
+        event = None
+        if any(s.is_cuda for s in self.stats.values()):
+            event = torch.cuda.Event()
+            event.record()
+        self.stats = dict()
+
+        if self.pending is not None:
+            # Don't let the writes pile up
+            self.pending.result()
+        self.pending = self.executor.submit(self._write, step, stats, event)
+
+    def _write(
+        self,
+        step: int,
+        stats: Dict[str, Tensor],
+        event: Optional["torch.cuda.Event"],
+    ) -> None:
+        if event is not None:
+            event.synchronize()
+        lines = []
+        for name in sorted(stats.keys()):
+            s = dict(zip(_SAMPLED_STATS, stats[name].tolist()))
+            count = max(s["count"], 1)
+            values = {
+                "mean": s["sum"] / count,
+                "abs": s["abs"] / count,
+                "rms": (s["sq"] / count) ** 0.5,
+                "positive": s["positive"] / count,
+                "nonfinite": s["nonfinite"],
+                "max": s["max"],
+                "min": s["min"],
+            }
+            if self.tb_writer is not None:
+                for k, v in values.items():
+                    self.tb_writer.add_scalar(f"diagnostics/{name}/{k}", v, step)
+            lines.append(json.dumps({"step": step, "name": name, **values}))
+
+        if self.filename is not None:
+            with open(self.filename, "a") as f:
+                for line in lines:
+                    f.write(line + "\n")
+
+    def close(self) -> None:
+        """Remove the hooks, write the remaining stats and wait until all the
+        stats are written."""
+        self._detach()
+        if self.cur_step is not None:
+            self.flush(self.cur_step)
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+        self.executor.shutdown()
+
+
 def _test_tensor_diagnostic():
     opts = TensorDiagnosticOptions(512)
 
@@ -0,0 +1,388 @@
+# Copyright    2026  The icefall authors
+#
+# See ../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Error statistics of recognition results, as written by
+:func:`icefall.utils.write_error_stats` and
+:func:`icefall.utils.write_error_stats_with_timestamps`.
+
+Utterances are aligned in chunks, optionally in a process pool. Each chunk
+returns the aligned words as integer IDs, which are counted with numpy,
+and the per-utterance lines of the output file, so every utterance is
+aligned only once.
+"""
+
+import logging
+from concurrent.futures import Executor, Future
+from typing import Any, Dict, List, Optional, TextIO, Tuple, Union
+
+import kaldialign
+import numpy as np
+
+ERR = "*"
+
+
+def _format_alignment(cut_id: str, ali: List[Tuple[str, str]]) -> str:
+    """Return the line of an utterance in the PER-UTT DETAILS section, in
+    which successive errors are combined."""
+    words = []
+    # The reference and predicted words of the current run of errors
+    refs = []
+    hyps = []
+
+    def add_errors():
+        if refs or hyps:
+            ref_word = " ".join(refs) if refs else ERR
+            hyp_word = " ".join(hyps) if hyps else ERR
+            if ref_word == hyp_word:
+                words.append(ref_word)
+            else:
+                words.append(f"({ref_word}->{hyp_word})")
+            refs.clear()
+            hyps.clear()
+
+    for ref_word, hyp_word in ali:
+        if ref_word != hyp_word:
+            if ref_word != ERR:
+                refs.append(ref_word)
+            if hyp_word != ERR:
+                hyps.append(hyp_word)
+        else:
+            add_errors()
+            if ref_word != ERR:
+                words.append(ref_word)
+    add_errors()
+
+    return f"{cut_id}:\t" + " ".join(words)
+
+
+def _align_chunk(
+    results: List[Tuple[Any, ...]], with_timestamps: bool
+) -> Tuple[List[str], np.ndarray, np.ndarray, List[Tuple[str, List[float]]]]:
+    """Align the utterances in `results`.
+
+    Returns:
+      Return a tuple (words, ref_ids, hyp_ids, utts):
+
+        - words: the words in the alignments, where words[0] is ERR
+        - ref_ids, hyp_ids: the indexes into `words` of the aligned
+          reference and predicted words of all utterances
+        - utts: a list of (line, delays) for each utterance, where line is
+          its line in the PER-UTT DETAILS section and delays are those of
+          the correct words if `with_timestamps` is True
+    """
+    word2id = {ERR: 0}
+    ref_ids = []
+    hyp_ids = []
+    utts = []
+    for r in results:
+        cut_id, ref, hyp = r[:3]
+        ali = kaldialign.align(ref, hyp, ERR)
+        for ref_word, hyp_word in ali:
+            ref_ids.append(word2id.setdefault(ref_word, len(word2id)))
+            hyp_ids.append(word2id.setdefault(hyp_word, len(word2id)))
+
+        delays = []
+        if with_timestamps:
+            time_ref, time_hyp = r[3:5]
+            if len(time_ref) > 0 and len(time_hyp) > 0:
+                delays = _get_delays(ali, ref, hyp, time_ref, time_hyp)
+
+        utts.append((_format_alignment(cut_id, ali), delays))
+
+    return (
+        list(word2id.keys()),
+        np.array(ref_ids, dtype=np.int32),
+        np.array(hyp_ids, dtype=np.int32),
+        utts,
+    )
+
+
+def _get_delays(
+    ali: List[Tuple[str, str]],
+    ref: List[str],
+    hyp: List[str],
+    time_ref: List[float],
+    time_hyp: List[float],
+) -> List[float]:
+    """Return the delays of the correct words in an alignment."""
+    delays = []
+    # pointer to timestamp_hyp
+    p_hyp = 0
+    # pointer to timestamp_ref
+    p_ref = 0
+    for ref_word, hyp_word in ali:
+        if ref_word == ERR:
+            p_hyp += 1
+        elif hyp_word == ERR:
+            p_ref += 1
+        elif hyp_word != ref_word:
+            p_hyp += 1
+            p_ref += 1
+        else:
+            delays.append(time_hyp[p_hyp] - time_ref[p_ref])
+            p_hyp += 1
+            p_ref += 1
+    assert p_hyp == len(hyp), (p_hyp, len(hyp))
+    assert p_ref == len(ref), (p_ref, len(ref))
+    return delays
+
+
+class ErrorStats(object):
+    """Accumulate the error statistics of recognition results and write them
+    in the format of :func:`icefall.utils.write_error_stats`.
+
+    Results can be added as they are decoded, e.g., batch by batch. If an
+    executor is given, e.g., a `ProcessPoolExecutor`, they are aligned in it
+    while the decoding goes on.
+
+    Usage::
+
+        stats = ErrorStats(executor=ProcessPoolExecutor(4))
+        for batch in dl:
+            ...
+            stats.add(this_batch)
+        wer = stats.write(f, test_set_name, sort=True)
+    """
+
+    def __init__(
+        self,
+        with_timestamps: bool = False,
+        executor: Optional[Executor] = None,
+        chunk_size: int = 1000,
+    ):
+        """
+        Args:
+          with_timestamps:
+            If True, the results also contain the timestamps of the reference
+            and predicted words, as in
+            :func:`icefall.utils.write_error_stats_with_timestamps`.
+          executor:
+            If not None, the results are aligned in it. Otherwise, they are
+            aligned in :meth:`add`.
+          chunk_size:
+            Number of utterances aligned in a task of `executor`.
+        """
+        self.with_timestamps = with_timestamps
+        self.executor = executor
+        self.chunk_size = chunk_size
+
+        self.word2id: Dict[str, int] = {ERR: 0}
+        self.ref_len = 0
+
+        # Results not submitted yet
+        self.pending: List[Tuple[Any, ...]] = []
+        # The keys, i.e., (cut_id, ref, hyp), of the added results, in the
+        # same order as the utterances in self.chunks
+        self.keys: List[Tuple[str, List[str], List[str]]] = []
+        # The return values of _align_chunk(), or futures of them
+        self.chunks: List[Union[Future, Tuple]] = []
+
+    def add(self, results: List[Tuple[Any, ...]]) -> None:
+        """Add results.
+
+        Args:
+          results:
+            A list of tuples (cut_id, ref, hyp), where ref and hyp are lists
+            of words, or (cut_id, ref, hyp, time_ref, time_hyp) if
+            `with_timestamps` is True.
+        """
+        for r in results:
+            self.keys.append(tuple(r[:3]))
+            self.ref_len += len(r[1])
+        self.pending.extend(results)
+        if len(self.pending) >= self.chunk_size:
+            self._submit()
+
+    def _submit(self) -> None:
+        for i in range(0, len(self.pending), self.chunk_size):
+            chunk = self.pending[i : i + self.chunk_size]
+            if self.executor is None:
+                self.chunks.append(_align_chunk(chunk, self.with_timestamps))
+            else:
+                self.chunks.append(
+                    self.executor.submit(_align_chunk, chunk, self.with_timestamps)
+                )
+        self.pending = []
+
+    def _collect(self) -> Tuple[np.ndarray, np.ndarray, List[Tuple]]:
+        """Wait for all chunks and return (ref_ids, hyp_ids, utts) of all
+        utterances, where the IDs index into self.word2id."""
+        self._submit()
+        all_ref_ids = []
+        all_hyp_ids = []
+        all_utts = []
+        for i, chunk in enumerate(self.chunks):
+            if isinstance(chunk, Future):
+                chunk = chunk.result()
+                self.chunks[i] = chunk
+            words, ref_ids, hyp_ids, utts = chunk
+            local_to_global = np.array(
+                [self.word2id.setdefault(w, len(self.word2id)) for w in words],
+                dtype=np.int64,
+            )
+            all_ref_ids.append(local_to_global[ref_ids])
+            all_hyp_ids.append(local_to_global[hyp_ids])
+            all_utts.extend(utts)
+
+        if len(all_ref_ids) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, all_utts
+        return np.concatenate(all_ref_ids), np.concatenate(all_hyp_ids), all_utts
+
+    def write(
+        self,
+        f: TextIO,
+        test_set_name: str,
+        enable_log: bool = True,
+        sort: bool = False,
+    ) -> Union[float, Tuple[float, float, float]]:
+        """Write the statistics of all added results to a file.
+
+        Args:
+          f:
+            The file to write to.
+          test_set_name:
+            Used in the log messages.
+          enable_log:
+            If True, also print detailed WER to the console.
+          sort:
+            If True, the utterances are written in the order of
+            `sorted(results)`, instead of the order they are added.
+        Returns:
+          Return the WER, or a tuple of the WER and the mean and variance of
+          the delay if `with_timestamps` is True.
+        """
+        ref_ids, hyp_ids, utts = self._collect()
+        words = list(self.word2id.keys())
+        num_words = len(words)
+
+        if sort:
+            order = sorted(range(len(utts)), key=lambda i: self.keys[i])
+            utts = [utts[i] for i in order]
+
+        ins_mask = ref_ids == 0
+        del_mask = ~ins_mask & (hyp_ids == 0)
+        corr_mask = ~ins_mask & ~del_mask & (ref_ids == hyp_ids)
+        sub_mask = ~ins_mask & ~del_mask & ~corr_mask
+
+        def count(ids: np.ndarray) -> np.ndarray:
+            return np.bincount(ids, minlength=num_words)
+
+        # Counts per word, as follows:
+        #   corr, ref_sub, hyp_sub, ins, dels
+        word_counts = np.stack(
+            [
+                count(ref_ids[corr_mask]),
+                count(ref_ids[sub_mask]),
+                count(hyp_ids[sub_mask]),
+                count(hyp_ids[ins_mask]),
+                count(ref_ids[del_mask]),
+            ],
+            axis=1,
+        )
+        sub_pairs, sub_counts = np.unique(
+            ref_ids[sub_mask] * num_words + hyp_ids[sub_mask], return_counts=True
+        )
+
+        num_corr = int(corr_mask.sum())
+        sub_errs = int(sub_mask.sum())
+        ins_errs = int(ins_mask.sum())
+        del_errs = int(del_mask.sum())
+        ref_len = self.ref_len
+        tot_errs = sub_errs + ins_errs + del_errs
+        tot_err_rate = "%.2f" % (100.0 * tot_errs / ref_len)
+
+        if self.with_timestamps:
+            all_delay = [d for _, delays in utts for d in delays]
+            mean_delay = "inf"
+            var_delay = "inf"
+            num_delay = len(all_delay)
+            if num_delay > 0:
+                mean_delay = sum(all_delay) / num_delay
+                var_delay = sum([(i - mean_delay) ** 2 for i in all_delay]) / num_delay
+                mean_delay = "%.3f" % mean_delay
+                var_delay = "%.3f" % var_delay
+
+        if enable_log:
+            logging.info(
+                f"[{test_set_name}] %WER {tot_errs / ref_len:.2%} "
+                f"[{tot_errs} / {ref_len}, {ins_errs} ins, "
+                f"{del_errs} del, {sub_errs} sub ]"
+            )
+            if self.with_timestamps:
+                logging.info(
+                    f"[{test_set_name}] %symbol-delay mean: {mean_delay}s, variance: {var_delay} "  # noqa
+                    f"computed on {num_delay} correct words"
+                )
+
+        print(f"%WER = {tot_err_rate}", file=f)
+        print(
+            f"Errors: {ins_errs} insertions, {del_errs} deletions, "
+            f"{sub_errs} substitutions, over {ref_len} reference "
+            f"words ({num_corr} correct)",
+            file=f,
+        )
+        print(
+            "Search below for sections starting with PER-UTT DETAILS:, "
+            "SUBSTITUTIONS:, DELETIONS:, INSERTIONS:, PER-WORD STATS:",
+            file=f,
+        )
+
+        print("", file=f)
+        print("PER-UTT DETAILS: corr or (ref->hyp)  ", file=f)
+        for line, _ in utts:
+            print(line, file=f)
+
+        print("", file=f)
+        print("SUBSTITUTIONS: count ref -> hyp", file=f)
+        subs = [
+            (c, (words[k // num_words], words[k % num_words]))
+            for k, c in zip(sub_pairs.tolist(), sub_counts.tolist())
+        ]
+        for c, (ref, hyp) in sorted(subs, reverse=True):
+            print(f"{c}   {ref} -> {hyp}", file=f)
+
+        print("", file=f)
+        print("DELETIONS: count ref", file=f)
+        dels = word_counts[:, 4].tolist()
+        for c, ref in sorted([(c, w) for w, c in zip(words, dels) if c], reverse=True):
+            print(f"{c}   {ref}", file=f)
+
+        print("", file=f)
+        print("INSERTIONS: count hyp", file=f)
+        ins = word_counts[:, 3].tolist()
+        for c, hyp in sorted([(c, w) for w, c in zip(words, ins) if c], reverse=True):
+            print(f"{c}   {hyp}", file=f)
+
+        print("", file=f)
+        print("PER-WORD STATS: word  corr tot_errs count_in_ref count_in_hyp", file=f)
+        nonzero = np.nonzero(word_counts.sum(axis=1))[0]
+        per_word = [
+            (sum(v[1:]), words[i], v)
+            for i, v in zip(nonzero.tolist(), word_counts[nonzero].tolist())
+        ]
+        for _, word, counts in sorted(per_word, reverse=True):
+            (corr, ref_sub, hyp_sub, num_ins, num_dels) = counts
+            errs = ref_sub + hyp_sub + num_ins + num_dels
+            ref_count = corr + ref_sub + num_dels
+            hyp_count = corr + hyp_sub + num_ins
+
+            print(f"{word}   {corr} {errs} {ref_count} {hyp_count}", file=f)
+
+        if self.with_timestamps:
+            return float(tot_err_rate), float(mean_delay), float(var_delay)
+        return float(tot_err_rate)
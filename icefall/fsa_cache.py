@@ -0,0 +1,193 @@
+# Copyright    2026  The icefall authors
+#
+# See ../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import k2
+import torch
+
+
+def get_fsa_digest(fsa: k2.Fsa, *args: Any) -> str:
+    """Return a hex digest of the arcs, the tensor attributes and the given
+    arguments, which is used to tell graph compilers with different
+    configurations apart in an :class:`FsaCache`.
+    """
+    h = hashlib.sha1()
+    h.update(fsa.arcs.values().cpu().numpy().tobytes())
+    h.update(fsa.scores.detach().cpu().numpy().tobytes())
+    for name, value in sorted(fsa.named_tensor_attr(include_scores=False)):
+        h.update(name.encode("utf-8"))
+        if isinstance(value, torch.Tensor):
+            h.update(value.cpu().numpy().tobytes())
+    h.update(repr(args).encode("utf-8"))
+    return h.hexdigest()
+
+
+class FsaCache(object):
+    """A cache of per-utterance graphs, e.g., the training graphs built
+    by graph compilers from the transcripts, which are the same in every
+    epoch.
+
+    Graphs are kept on CPU in an in-memory LRU cache. If `cache_dir` is
+    given, new graphs are also appended to shards in that directory, which
+    are memory-mapped when the cache is created, so that later runs, e.g.,
+    after resuming training, do not need to compile them again.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100000,
+        cache_dir: Optional[Union[str, Path]] = None,
+        shard_size: int = 10000,
+    ):
+        """
+        Args:
+          max_size:
+            Max number of graphs kept in memory.
+          cache_dir:
+            If not None, the directory of the on-disk store.
+          shard_size:
+            New graphs are written to a new shard in `cache_dir` after this
+            number of them is added.
+        """
+        self.max_size = max_size
+        self.shard_size = shard_size
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+
+        self.fsas: "OrderedDict[str, k2.Fsa]" = OrderedDict()
+
+        # Graphs in the on-disk store, in the format of `k2.Fsa.as_dict()`
+        self.stored: Dict[str, Dict[str, Any]] = dict()
+        # Graphs not written to the on-disk store yet
+        self.pending: Dict[str, Dict[str, Any]] = dict()
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_shards()
+
+    @staticmethod
+    def _load_shard(filename: Path) -> Dict[str, Dict[str, Any]]:
+        try:
+            return torch.load(str(filename), map_location="cpu", mmap=True)
+        except TypeError:
+            # mmap requires torch >= 2.1
+            return torch.load(filename, map_location="cpu")
+
+    def _load_shards(self) -> None:
+        for filename in sorted(self.cache_dir.glob("shard-*.pt")):
+            self.stored.update(self._load_shard(filename))
+        if self.stored:
+            logging.info(f"Loaded {len(self.stored)} graphs from {self.cache_dir}")
+
+    def get(self, key: str) -> Optional[k2.Fsa]:
+        """Return the graph with the given key, or None if it is not cached."""
+        fsa = self.fsas.get(key)
+        if fsa is not None:
+            self.fsas.move_to_end(key)
+            self.num_hits += 1
+            return fsa
+
+        d = self.stored.get(key)
+        if d is None:
+            d = self.pending.get(key)
+        if d is None:
+            self.num_misses += 1
+            return None
+
+        self.num_hits += 1
+        fsa = k2.Fsa.from_dict(d)
+        self._add(key, fsa)
+        return fsa
+
+    def put(self, key: str, fsa: k2.Fsa) -> None:
+        """Add a graph, which has to be on CPU, to the cache."""
+        self._add(key, fsa)
+        if self.cache_dir is not None and key not in self.stored:
+            self.pending[key] = fsa.as_dict()
+            if len(self.pending) >= self.shard_size:
+                self.flush()
+
+    def _add(self, key: str, fsa: k2.Fsa) -> None:
+        self.fsas[key] = fsa
+        self.fsas.move_to_end(key)
+        while len(self.fsas) > self.max_size:
+            self.fsas.popitem(last=False)
+
+    def flush(self) -> None:
+        """Write the graphs not in the on-disk store yet to a new shard."""
+        if self.cache_dir is None or not self.pending:
+            return
+        # Processes of DDP training may share the same directory, so
+        # the name of the shard has to be unique.
+        filename = self.cache_dir / f"shard-{uuid.uuid4().hex}.pt"
+        tmp_filename = filename.with_suffix(".tmp")
+        torch.save(self.pending, tmp_filename)
+        os.replace(tmp_filename, filename)
+
+        # Load it back so that the graphs are memory-mapped
+        self.stored.update(self._load_shard(filename))
+        self.pending = dict()
+
+    def compile(
+        self,
+        keys: List[str],
+        compile_fn: Callable[[List[int]], k2.Fsa],
+        device: Union[str, torch.device] = "cpu",
+    ) -> k2.Fsa:
+        """Return an FsaVec whose i-th FSA is the graph of keys[i].
+
+        Args:
+          keys:
+            The key of each graph.
+          compile_fn:
+            compile_fn(indexes) returns an FsaVec containing the graphs of
+            keys[i] for i in `indexes`, which are not in the cache.
+          device:
+            The device of the returned FsaVec.
+        Returns:
+          Return an FsaVec with `len(keys)` FSAs.
+        """
+        fsas = [self.get(key) for key in keys]
+        missing = [i for i, fsa in enumerate(fsas) if fsa is None]
+        if missing:
+            compiled = compile_fn(missing)
+            compiled_cpu = compiled.to("cpu")
+            for j, i in enumerate(missing):
+                # Clone it so that it doesn't share memory with the others
+                fsas[i] = compiled_cpu[j].clone()
+                self.put(keys[i], fsas[i])
+            if len(missing) == len(keys):
+                # Nothing was cached, so there is no need to rebuild it
+                return compiled
+
+        return k2.create_fsa_vec(fsas).to(device)
+
+    def __str__(self) -> str:
+        total = max(self.num_hits + self.num_misses, 1)
+        return (
+            f"FsaCache: {len(self.fsas)} graphs in memory, "
+            f"{len(self.stored)} on disk, "
+            f"hit rate {self.num_hits / total:.3f}"
+        )
@@ -15,11 +15,12 @@
 # limitations under the License.
 
 
-from typing import List
+from typing import List, Optional
 
 import k2
 import torch
 
+from icefall.fsa_cache import FsaCache, get_fsa_digest
 from icefall.lexicon import Lexicon
 
 
@@ -30,6 +31,7 @@ class CtcTrainingGraphCompiler(object):
         device: torch.device,
         oov: str = "<UNK>",
         need_repeat_flag: bool = False,
+        graph_cache: Optional[FsaCache] = None,
     ):
         """
         Args:
@@ -47,6 +49,9 @@ class CtcTrainingGraphCompiler(object):
             ctc loss. See https://github.com/k2-fsa/k2/pull/1086 for more
             details. Note: The above change MUST be included in k2 to open this
             flag.
+          graph_cache:
+            If not None, the graph of each transcript is cached in it by
+            :meth:`compile`.
         """
         L_inv = lexicon.L_inv.to(device)
         assert L_inv.requires_grad is False
@@ -54,8 +59,10 @@ class CtcTrainingGraphCompiler(object):
         assert oov in lexicon.word_table
 
         self.L_inv = k2.arc_sort(L_inv)
+        self.oov = oov
         self.oov_id = lexicon.word_table[oov]
         self.word_table = lexicon.word_table
+        self.lexicon = lexicon
 
         max_token_id = max(lexicon.tokens)
         ctc_topo = k2.ctc_topo(max_token_id, modified=False)
@@ -69,6 +76,16 @@ class CtcTrainingGraphCompiler(object):
 
         self.device = device
 
+        self.graph_cache = graph_cache
+        if graph_cache is not None:
+            self.cache_prefix = get_fsa_digest(
+                self.L_inv,
+                type(self).__name__,
+                self.oov_id,
+                max_token_id,
+                need_repeat_flag,
+            )
+
     def compile(self, texts: List[str]) -> k2.Fsa:
         """Build decoding graphs by composing ctc_topo with
         given transcripts.
@@ -85,6 +102,17 @@ class CtcTrainingGraphCompiler(object):
           An FsaVec, the composition result of `self.ctc_topo` and the
           transcript FSA.
         """
+        if self.graph_cache is None:
+            return self._compile(texts)
+
+        keys = [f"{self.cache_prefix}:{' '.join(text.split())}" for text in texts]
+        return self.graph_cache.compile(
+            keys,
+            lambda indexes: self._compile([texts[i] for i in indexes]),
+            device=self.device,
+        )
+
+    def _compile(self, texts: List[str]) -> k2.Fsa:
         transcript_fsa = self.convert_transcript_to_fsa(texts)
 
         # NOTE: k2.compose runs on CUDA only when treat_epsilons_specially
@@ -113,16 +141,7 @@ class CtcTrainingGraphCompiler(object):
         Returns:
           Return a list-of-list of word IDs.
         """
-        word_ids_list = []
-        for text in texts:
-            word_ids = []
-            for word in text.split():
-                if word in self.word_table:
-                    word_ids.append(self.word_table[word])
-                else:
-                    word_ids.append(self.oov_id)
-            word_ids_list.append(word_ids)
-        return word_ids_list
+        return self.lexicon.texts_to_word_ids(texts, oov=self.oov)
 
     def convert_transcript_to_fsa(self, texts: List[str]) -> k2.Fsa:
         """Convert a list of transcript texts to an FsaVec.
@@ -138,15 +157,7 @@ class CtcTrainingGraphCompiler(object):
         Returns:
           Return an FsaVec, whose `shape[0]` equals to `len(texts)`.
         """
-        word_ids_list = []
-        for text in texts:
-            word_ids = []
-            for word in text.split():
-                if word in self.word_table:
-                    word_ids.append(self.word_table[word])
-                else:
-                    word_ids.append(self.oov_id)
-            word_ids_list.append(word_ids)
+        word_ids_list = self.lexicon.texts_to_word_ids(texts, oov=self.oov)
 
         word_fsa = k2.linear_fsa(word_ids_list, self.device)
 
@@ -16,6 +16,7 @@
 
 import logging
 import random
+from typing import List
 
 import torch
 from torch import Tensor, nn
@@ -80,6 +81,117 @@ def register_inf_check_hooks(model: nn.Module) -> None:
         parameter.register_hook(param_backward_hook)
 
 
+class InfChecker(object):
+    """A cheaper alternative to :func:`register_inf_check_hooks`.
+
+    Instead of checking whether the sum of each module output and gradient is
+    finite in the hooks, which synchronizes with the device once per module,
+    the hooks only record the result on the device. :meth:`check`, which
+    should be called once per step after `backward()`, checks all of them
+    with a single synchronization and, only if something is not finite,
+    looks for the first module whose output or gradient is not finite.
+
+    Nothing is recorded for modules in eval mode.
+
+    Usage::
+
+        inf_checker = InfChecker(model)
+        for batch in train_dl:
+            loss = compute_loss(model, batch)
+            loss.backward()
+            inf_checker.check()
+    """
+
+    def __init__(self, model: nn.Module):
+        """
+        Args:
+          model:
+            the model to be analyzed.
+        """
+        # The name of each recorded tensor, whether it is a module output
+        # (rather than a gradient) and whether its sum is finite, in the
+        # order they are computed, since the last call of check()
+        self.names: List[str] = []
+        self.is_output: List[bool] = []
+        self.flags: List[Tensor] = []
+
+        for name, module in model.named_modules():
+            if name == "":
+                name = "<top-level>"
+            module.register_forward_hook(self._get_forward_hook(name))
+
+        for name, parameter in model.named_parameters():
+
+            def param_backward_hook(grad, _name=name):
+                self._record(f"{_name}.param_grad", grad, is_output=False)
+
+            parameter.register_hook(param_backward_hook)
+
+    def _record(self, name: str, x: Tensor, is_output: bool) -> None:
+        # The same as torch.isfinite(x.to(torch.float32).sum()), without
+        # converting x
+        self.names.append(name)
+        self.is_output.append(is_output)
+        self.flags.append(torch.isfinite(x.detach().sum(dtype=torch.float32)))
+
+    def _get_forward_hook(self, name: str):
+        def forward_hook(_module, _input, _output):
+            if not _module.training:
+                return
+            if isinstance(_output, Tensor):
+                outputs = [("", _output)]
+            elif isinstance(_output, tuple):
+                outputs = []
+                for i, o in enumerate(_output):
+                    if isinstance(o, tuple):
+                        o = o[0]
+                    outputs.append((f"[{i}]", o))
+            else:
+                return
+
+            for suffix, o in outputs:
+                if not isinstance(o, Tensor) or o.numel() == 0:
+                    continue
+                self._record(f"{name}.output{suffix}", o, is_output=True)
+                if o.requires_grad:
+                    o.register_hook(
+                        lambda grad, _name=f"{name}.grad{suffix}": self._record(
+                            _name, grad, is_output=False
+                        )
+                    )
+
+        return forward_hook
+
+    def check(self) -> None:
+        """Check the outputs and gradients recorded since the last call.
+
+        It raises a ValueError if the output of any module is not finite, as
+        :func:`register_inf_check_hooks` does. If only some gradients are not
+        finite, e.g., when the loss is scaled for mixed precision training,
+        it logs a warning.
+        """
+        names, is_output, flags = self.names, self.is_output, self.flags
+        self.names, self.is_output, self.flags = [], [], []
+        if not flags:
+            return
+
+        flags = torch.stack([f.to(flags[0].device) for f in flags])
+        if flags.all():
+            return
+
+        bad = (~flags).nonzero().squeeze(1).tolist()
+        bad_outputs = [names[i] for i in bad if is_output[i]]
+        if bad_outputs:
+            raise ValueError(
+                f"The sum of {bad_outputs[0]} is not finite "
+                f"({len(bad_outputs)} non-finite outputs in total)"
+            )
+        logging.warning(
+            f"The sum of {names[bad[0]]} is not finite "
+            f"({len(bad)} non-finite gradients in total)"
+        )
+
+
 def _test_inf_check_hooks():
     model = nn.Sequential(nn.Linear(100, 50), nn.Linear(50, 80))
 
@@ -0,0 +1,244 @@
+# Copyright    2026  The icefall authors
+#
+# See ../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A lang bundle is a single binary file containing named numpy arrays, e.g.,
+the symbol tables and L_inv of a lang dir. It is memory-mapped when loaded,
+so the arrays are shared read-only by all processes on the same machine
+through the page cache.
+
+File format:
+
+  - 8 bytes: the magic string b"ICEFLANG"
+  - 4 bytes: the format version, little endian uint32
+  - 8 bytes: the length of the header, little endian uint64
+  - the header, a UTF-8 JSON object
+    {"metadata": {...}, "arrays": {name: {"dtype", "shape", "offset"}}}
+  - the data of the arrays. The offset of each array is relative to the
+    beginning of the file and is a multiple of 64.
+"""
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import k2
+import numpy as np
+
+LANG_BUNDLE_VERSION = 1
+
+_MAGIC = b"ICEFLANG"
+_PREFIX = struct.Struct("<8sIQ")
+_ALIGNMENT = 64
+
+
+def _align(n: int) -> int:
+    return (n + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def save_lang_bundle(
+    filename: Union[str, Path],
+    arrays: Dict[str, np.ndarray],
+    metadata: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Save arrays to a lang bundle.
+
+    The file is written to a temporary file first and then renamed, so
+    processes that load it at the same time never see a partial file.
+
+    Args:
+      filename:
+        The filename of the lang bundle.
+      arrays:
+        The arrays to save.
+      metadata:
+        Anything that can be serialized to JSON.
+    """
+    entries = dict()
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + array.nbytes)
+
+    # The offsets above are relative to the beginning of the data. Convert
+    # them to be relative to the beginning of the file.
+    header = {"metadata": metadata or {}, "arrays": entries}
+    header_len = len(json.dumps(header).encode("utf-8"))
+    # Adding data_start to the offsets may make the header a bit longer, so
+    # reserve some space for it.
+    data_start = _align(_PREFIX.size + header_len + 20 * (len(entries) + 1))
+    for entry in entries.values():
+        entry["offset"] += data_start
+    header = json.dumps(header).encode("utf-8")
+    assert _PREFIX.size + len(header) <= data_start
+
+    filename = Path(filename)
+    tmp_filename = filename.with_name(f"{filename.name}.tmp.{os.getpid()}")
+    with open(tmp_filename, "wb") as f:
+        f.write(_PREFIX.pack(_MAGIC, LANG_BUNDLE_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(entries[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_filename, filename)
+
+
+def load_lang_bundle(
+    filename: Union[str, Path]
+) -> Optional[Tuple[Dict[str, np.ndarray], Dict[str, Any]]]:
+    """Load a lang bundle saved by :func:`save_lang_bundle`.
+
+    Returns:
+      Return None if the file is not a lang bundle of the current version.
+      Otherwise, return a tuple (arrays, metadata). The arrays are read-only
+      views of the memory-mapped file.
+    """
+    with open(filename, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            return None
+        magic, version, header_len = _PREFIX.unpack(prefix)
+        if magic != _MAGIC or version != LANG_BUNDLE_VERSION:
+            return None
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    data = np.memmap(filename, dtype=np.uint8, mode="r")
+    arrays = dict()
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape))
+        if count == 0:
+            # Its offset may be past the end of the file
+            arrays[name] = np.zeros(shape, dtype=dtype)
+            arrays[name].flags.writeable = False
+            continue
+        arrays[name] = np.frombuffer(
+            data, dtype=dtype, count=count, offset=entry["offset"]
+        ).reshape(shape)
+    return arrays, header["metadata"]
+
+
+class MappedSymbolTable(object):
+    """A read-only symbol table stored in arrays, which can be saved to and
+    memory-mapped from a lang bundle.
+
+    Unlike `k2.SymbolTable`, it needs no per-symbol Python objects, and it
+    converts many symbols to IDs at once with a binary search.
+    """
+
+    def __init__(
+        self,
+        sorted_symbols: np.ndarray,
+        sorted_ids: np.ndarray,
+        id_to_index: np.ndarray,
+    ):
+        """
+        Args:
+          sorted_symbols:
+            The UTF-8 encoded symbols in ascending order. Its dtype is
+            a numpy bytes type, e.g., `S20`.
+          sorted_ids:
+            sorted_ids[i] is the ID of sorted_symbols[i]. Its dtype is
+            np.int32.
+          id_to_index:
+            id_to_index[k] is the index of the symbol with ID k in
+            sorted_symbols, or -1 if there is no such symbol. Its dtype is
+            np.int32.
+        """
+        self.sorted_symbols = sorted_symbols
+        self.sorted_ids = sorted_ids
+        self.id_to_index = id_to_index
+
+    @staticmethod
+    def from_symbol_table(table: k2.SymbolTable) -> "MappedSymbolTable":
+        ids = np.array(table.ids, dtype=np.int32)
+        symbols = np.array([table[i].encode("utf-8") for i in table.ids])
+        order = np.argsort(symbols, kind="stable")
+        id_to_index = np.full(ids.max() + 1, -1, dtype=np.int32)
+        id_to_index[ids[order]] = np.arange(ids.size, dtype=np.int32)
+        return MappedSymbolTable(
+            sorted_symbols=symbols[order],
+            sorted_ids=ids[order],
+            id_to_index=id_to_index,
+        )
+
+    @staticmethod
+    def from_arrays(arrays: Dict[str, np.ndarray], prefix: str) -> "MappedSymbolTable":
+        return MappedSymbolTable(
+            sorted_symbols=arrays[f"{prefix}.sorted_symbols"],
+            sorted_ids=arrays[f"{prefix}.sorted_ids"],
+            id_to_index=arrays[f"{prefix}.id_to_index"],
+        )
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {
+            f"{prefix}.sorted_symbols": self.sorted_symbols,
+            f"{prefix}.sorted_ids": self.sorted_ids,
+            f"{prefix}.id_to_index": self.id_to_index,
+        }
+
+    def to_symbol_table(self) -> k2.SymbolTable:
+        """Return an equivalent `k2.SymbolTable`."""
+        symbols = [s.decode("utf-8") for s in self.sorted_symbols.tolist()]
+        ids = self.sorted_ids.tolist()
+        table = k2.SymbolTable()
+        table._id2sym = dict(zip(ids, symbols))
+        table._sym2id = dict(zip(symbols, ids))
+        table._next_available_id = max(ids) + 1
+        return table
+
+    def to_ids(self, symbols: List[str], default: int = -1) -> np.ndarray:
+        """Convert symbols to IDs.
+
+        Args:
+          symbols:
+            A list of symbols.
+          default:
+            The ID of symbols not in the table.
+        Returns:
+          Return a 1-D array of IDs with dtype np.int32.
+        """
+        if len(symbols) == 0:
+            return np.zeros(0, dtype=np.int32)
+        queries = np.array([s.encode("utf-8") for s in symbols])
+        indexes = np.searchsorted(self.sorted_symbols, queries)
+        indexes = np.minimum(indexes, self.sorted_symbols.size - 1)
+        found = self.sorted_symbols[indexes] == queries
+        return np.where(found, self.sorted_ids[indexes], default).astype(np.int32)
+
+    def __len__(self) -> int:
+        return self.sorted_ids.size
+
+    def __contains__(self, symbol: str) -> bool:
+        return self.to_ids([symbol])[0] != -1
+
+    def __getitem__(self, key: Union[int, str]) -> Union[str, int]:
+        if isinstance(key, str):
+            i = int(self.to_ids([key])[0])
+            if i == -1:
+                raise KeyError(key)
+            return i
+        index = self.id_to_index[key] if 0 <= key < self.id_to_index.size else -1
+        if index == -1:
+            raise KeyError(key)
+        return self.sorted_symbols[index].decode("utf-8")
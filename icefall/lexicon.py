@@ -15,15 +15,19 @@
 # limitations under the License.
 
 
+import itertools
 import logging
 import re
 import sys
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import k2
+import numpy as np
 import torch
 
+from icefall.lang_bundle import MappedSymbolTable, load_lang_bundle, save_lang_bundle
+
 
 def read_lexicon(filename: str) -> List[Tuple[str, List[str]]]:
     """Read a lexicon from `filename`.
@@ -146,6 +150,8 @@ class Lexicon(object):
         self,
         lang_dir: Path,
         disambig_pattern: str = re.compile(r"^#\d+$"),
+        bundle_filename: Optional[str] = "lang.bundle",
+        save_bundle: bool = False,
     ):
         """
         Args:
@@ -159,8 +165,31 @@ class Lexicon(object):
             should have run that before running the training code.
           disambig_pattern:
             It contains the pattern for disambiguation symbols.
+          bundle_filename:
+            If not None, the symbol tables and L_inv are loaded from this
+            lang bundle inside `lang_dir` if it is newer than the above files.
+            See :mod:`icefall.lang_bundle`.
+          save_bundle:
+            If True and the lang bundle above is not used, save the symbol
+            tables and L_inv loaded from the above files to it.
         """
         lang_dir = Path(lang_dir)
+        self.lang_dir = lang_dir
+        self.disambig_pattern = disambig_pattern
+        self.bundle_filename = (
+            lang_dir / bundle_filename if bundle_filename is not None else None
+        )
+        self.save_bundle = save_bundle and bundle_filename is not None
+        # The arrays and metadata saved to the lang bundle
+        self.bundle_arrays: Dict[str, np.ndarray] = dict()
+        self.bundle_metadata: Dict[str, Any] = dict()
+
+        self._token_table = None
+        self._word_table = None
+
+        if self._load_bundle():
+            return
+
         self.token_table = k2.SymbolTable.from_file(lang_dir / "tokens.txt")
         self.word_table = k2.SymbolTable.from_file(lang_dir / "words.txt")
 
@@ -176,7 +205,118 @@ class Lexicon(object):
         # We save L_inv instead of L because it will be used to intersect with
         # transcript FSAs, both of whose labels are word IDs.
         self.L_inv = L_inv
-        self.disambig_pattern = disambig_pattern
+
+        if self.save_bundle:
+            self._add_to_bundle(L_inv)
+
+    def _add_to_bundle(self, L_inv: k2.Fsa) -> None:
+        """Save the symbol tables and L_inv to the lang bundle.
+
+        Tensor attributes of L_inv are saved as arrays and scalar ones,
+        e.g., `labels_version`, as metadata. Nothing is saved if L_inv has
+        attributes of other types, e.g., ragged tensors.
+        """
+        arrays = dict()
+        scalars = dict()
+        for name, value in L_inv.as_dict().items():
+            if isinstance(value, torch.Tensor):
+                arrays[f"L_inv.{name}"] = value.cpu().numpy()
+            elif isinstance(value, (bool, int, float, str)):
+                scalars[name] = value
+            else:
+                logging.warning(
+                    f"Not saving lang bundle {self.bundle_filename}: "
+                    f"unsupported attribute {name} of L_inv"
+                )
+                return
+
+        self.bundle_arrays.update(self.mapped_token_table.to_arrays("tokens"))
+        self.bundle_arrays.update(self.mapped_word_table.to_arrays("words"))
+        self.bundle_arrays.update(arrays)
+        self.bundle_metadata["L_inv"] = scalars
+        self._save_bundle()
+
+    def _bundle_sources(self) -> List[Path]:
+        """Return the files the lang bundle is built from."""
+        return [
+            self.lang_dir / "tokens.txt",
+            self.lang_dir / "words.txt",
+            self.lang_dir / "L.pt",
+            self.lang_dir / "Linv.pt",
+        ]
+
+    def _load_bundle(self) -> bool:
+        """Load the symbol tables and L_inv from the lang bundle.
+
+        Returns:
+          Return False if there is no lang bundle, or it is older than any of
+          the files it is built from.
+        """
+        filename = self.bundle_filename
+        if filename is None or not filename.is_file():
+            return False
+
+        mtime = filename.stat().st_mtime
+        for f in self._bundle_sources():
+            if f.is_file() and f.stat().st_mtime > mtime:
+                return False
+
+        loaded = load_lang_bundle(filename)
+        if loaded is None:
+            return False
+        arrays, metadata = loaded
+
+        names = [n for n in arrays if n.startswith("L_inv.")]
+        if "L_inv.arcs" not in names:
+            return False
+
+        logging.info(f"Loading lang bundle {filename}")
+        self.bundle_arrays = arrays
+        self.bundle_metadata = metadata
+        self.mapped_token_table = MappedSymbolTable.from_arrays(arrays, "tokens")
+        self.mapped_word_table = MappedSymbolTable.from_arrays(arrays, "words")
+
+        # Make a copy since k2 may modify the attributes of L_inv in-place,
+        # while the arrays of the bundle are read-only.
+        L_inv_dict = dict(metadata.get("L_inv", {}))
+        for n in names:
+            L_inv_dict[n[len("L_inv.") :]] = torch.from_numpy(np.array(arrays[n]))
+        self.L_inv = k2.Fsa.from_dict(L_inv_dict)
+        return True
+
+    def _save_bundle(self) -> None:
+        try:
+            save_lang_bundle(
+                self.bundle_filename,
+                self.bundle_arrays,
+                metadata=self.bundle_metadata,
+            )
+        except OSError as e:
+            logging.warning(f"Failed to save lang bundle {self.bundle_filename}: {e}")
+
+    @property
+    def token_table(self) -> k2.SymbolTable:
+        # It is created on first use since it is slow for large tables
+        if self._token_table is None:
+            self._token_table = self.mapped_token_table.to_symbol_table()
+        return self._token_table
+
+    @token_table.setter
+    def token_table(self, table: k2.SymbolTable) -> None:
+        self._token_table = table
+        self.mapped_token_table = MappedSymbolTable.from_symbol_table(table)
+
+    @property
+    def word_table(self) -> k2.SymbolTable:
+        # It is created on first use since it is slow for large tables
+        if self._word_table is None:
+            self._word_table = self.mapped_word_table.to_symbol_table()
+        return self._word_table
+
+    @word_table.setter
+    def word_table(self, table: k2.SymbolTable) -> None:
+        self._word_table = table
+        self.mapped_word_table = MappedSymbolTable.from_symbol_table(table)
 
     @property
     def tokens(self) -> List[int]:
@@ -196,6 +336,44 @@ class Lexicon(object):
         ans.sort()
         return ans
 
+    def _texts_to_word_ids(
+        self, texts: List[str], oov_id: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return a tuple (row_splits, word_ids), where
+        word_ids[row_splits[i]:row_splits[i+1]] are the word IDs of texts[i].
+        Both of them are of dtype np.int32.
+        """
+        words_list = [text.split() for text in texts]
+        row_splits = np.zeros(len(texts) + 1, dtype=np.int32)
+        np.cumsum([len(words) for words in words_list], out=row_splits[1:])
+        word_ids = self.mapped_word_table.to_ids(
+            list(itertools.chain.from_iterable(words_list)), default=oov_id
+        )
+        return row_splits, word_ids
+
+    def texts_to_word_ids(
+        self, texts: List[str], oov: str = "<UNK>"
+    ) -> List[List[int]]:
+        """
+        Args:
+          texts:
+            A list of transcripts. Each transcript contains space(s)
+            separated words. An example texts is::
+
+                ['HELLO k2', 'HELLO icefall']
+          oov:
+            The OOV word. If a word in `texts` is not in the lexicon, it is
+            replaced with `oov`.
+        Returns:
+          Return a list-of-list of word IDs.
+        """
+        row_splits, word_ids = self._texts_to_word_ids(
+            texts, oov_id=self.mapped_word_table[oov]
+        )
+        row_splits = row_splits.tolist()
+        word_ids = word_ids.tolist()
+        return [word_ids[b:e] for b, e in zip(row_splits[:-1], row_splits[1:])]
+
 
 class UniqLexicon(Lexicon):
     def __init__(
@@ -203,6 +381,8 @@ class UniqLexicon(Lexicon):
         lang_dir: Path,
         uniq_filename: str = "uniq_lexicon.txt",
         disambig_pattern: str = re.compile(r"^#\d+$"),
+        bundle_filename: Optional[str] = "lang.bundle",
+        save_bundle: bool = False,
     ):
         """
         Refer to the help information in Lexicon.__init__.
@@ -212,13 +392,40 @@ class UniqLexicon(Lexicon):
         Each word in the lexicon is assumed to have a unique pronunciation.
         """
         lang_dir = Path(lang_dir)
-        super().__init__(lang_dir=lang_dir, disambig_pattern=disambig_pattern)
-
-        self.ragged_lexicon = convert_lexicon_to_ragged(
-            filename=lang_dir / uniq_filename,
-            word_table=self.word_table,
-            token_table=self.token_table,
+        super().__init__(
+            lang_dir=lang_dir,
+            disambig_pattern=disambig_pattern,
+            bundle_filename=bundle_filename,
+            save_bundle=save_bundle,
         )
+
+        filename = lang_dir / uniq_filename
+        prefix = f"ragged_lexicon.{uniq_filename}"
+        if (
+            f"{prefix}.row_splits" in self.bundle_arrays
+            and filename.stat().st_mtime <= self.bundle_filename.stat().st_mtime
+        ):
+            row_splits = torch.from_numpy(
+                np.array(self.bundle_arrays[f"{prefix}.row_splits"])
+            )
+            values = torch.from_numpy(np.array(self.bundle_arrays[f"{prefix}.values"]))
+            shape = k2.ragged.create_ragged_shape2(row_splits, None, values.numel())
+            self.ragged_lexicon = k2.RaggedTensor(shape, values)
+        else:
+            self.ragged_lexicon = convert_lexicon_to_ragged(
+                filename=filename,
+                word_table=self.word_table,
+                token_table=self.token_table,
+            )
+            if self.save_bundle and self.bundle_arrays:
+                self.bundle_arrays = dict(self.bundle_arrays)
+                self.bundle_arrays[
+                    f"{prefix}.row_splits"
+                ] = self.ragged_lexicon.shape.row_splits(1).numpy()
+                self.bundle_arrays[
+                    f"{prefix}.values"
+                ] = self.ragged_lexicon.values.numpy()
+                self._save_bundle()
         # TODO: should we move it to a certain device ?
 
     def texts_to_token_ids(
@@ -237,18 +444,13 @@ class UniqLexicon(Lexicon):
         Returns:
           Return a ragged int tensor with 2 axes [utterance][token_id]
         """
-        oov_id = self.word_table[oov]
-
-        word_ids_list = []
-        for text in texts:
-            word_ids = []
-            for word in text.split():
-                if word in self.word_table:
-                    word_ids.append(self.word_table[word])
-                else:
-                    word_ids.append(oov_id)
-            word_ids_list.append(word_ids)
-        ragged_indexes = k2.RaggedTensor(word_ids_list, dtype=torch.int32)
+        row_splits, word_ids = self._texts_to_word_ids(
+            texts, oov_id=self.mapped_word_table[oov]
+        )
+        shape = k2.ragged.create_ragged_shape2(
+            torch.from_numpy(row_splits), None, word_ids.size
+        )
+        ragged_indexes = k2.RaggedTensor(shape, torch.from_numpy(word_ids))
         ans = self.ragged_lexicon.index(ragged_indexes)
         ans = ans.remove_axis(ans.num_axes - 2)
         return ans
@@ -258,8 +460,9 @@ class UniqLexicon(Lexicon):
 
         We assume there are no OOVs in "words".
         """
-        word_ids = [self.word_table[w] for w in words]
-        word_ids = torch.tensor(word_ids, dtype=torch.int32)
+        word_ids = self.mapped_word_table.to_ids(words)
+        assert (word_ids != -1).all(), words
+        word_ids = torch.from_numpy(word_ids)
 
         ragged, _ = self.ragged_lexicon.index(
             indexes=word_ids,
@@ -221,6 +221,9 @@ class LmScorer(torch.nn.Module):
             state (optional): LM states
 
         """
+        if self.lm_type == "rnn":
+            # The RNN LM consumes one token per sequence given its state
+            return self.lm.score_token(x, state)
         return self.lm.score_token(x, x_lens, state)
 
 
@@ -56,23 +56,23 @@ def _compute_mmi_loss_exact_optimized(
     # The following code computes a_to_b_map
 
     # [0, 1, 2, ... ]
-    num_graphs_indexes = torch.arange(num_fsas, dtype=torch.int32)
+    num_graphs_indexes = torch.arange(num_fsas, dtype=torch.int32, device=device)
 
     # [num_fsas, num_fsas, num_fsas, ... ]
-    den_graphs_indexes = torch.tensor([num_fsas] * num_fsas, dtype=torch.int32)
+    den_graphs_indexes = torch.full_like(num_graphs_indexes, num_fsas)
 
     # [0, num_fsas, 1, num_fsas, 2, num_fsas, ... ]
-    num_den_graphs_indexes = (
-        torch.stack([num_graphs_indexes, den_graphs_indexes]).t().reshape(-1).to(device)
-    )
-
-    num_den_reordered_graphs = k2.index(num_den_graphs, num_den_graphs_indexes)
+    #
+    # The den graph is copied for each utterance here, in the same call
+    # that reorders num_graphs.
+    num_den_graphs_indexes = torch.stack(
+        [num_graphs_indexes, den_graphs_indexes], dim=1
+    ).reshape(-1)
 
-    # [[0, 1, 2, ...]]
-    a_to_b_map = torch.arange(num_fsas, dtype=torch.int32).reshape(1, -1)
+    num_den_reordered_graphs = k2.index_fsa(num_den_graphs, num_den_graphs_indexes)
 
-    # [[0, 1, 2, ...]] -> [0, 0, 1, 1, 2, 2, ... ]
-    a_to_b_map = a_to_b_map.repeat(2, 1).t().reshape(-1).to(device)
+    # [0, 1, 2, ...] -> [0, 0, 1, 1, 2, 2, ... ]
+    a_to_b_map = num_graphs_indexes.repeat_interleave(2)
 
     num_den_lats = k2.intersect_dense(
         num_den_reordered_graphs,
@@ -180,12 +180,35 @@ class LFMMILoss(nn.Module):
         use_pruned_intersect: bool = False,
         den_scale: float = 1.0,
         beam_size: float = 8.0,
+        use_fused_intersect: bool = False,
     ):
+        """
+        Args:
+          graph_compiler:
+            Used to build num_graphs and den_graphs.
+          use_pruned_intersect:
+            If True, use :func:`_compute_mmi_loss_pruned`. The denominator
+            graph is shared by all utterances of a batch and the loss is
+            not exact.
+          den_scale:
+            The scale applied to the denominator tot_scores.
+          beam_size:
+            The output beam of the intersections.
+          use_fused_intersect:
+            Used only when `use_pruned_intersect` is False. If True, use
+            :func:`_compute_mmi_loss_exact_optimized`, which intersects the
+            numerator graphs and the denominator graphs with a single call
+            of k2.intersect_dense. The denominator graph is still copied for
+            each utterance, since k2.intersect_dense needs one graph per
+            sequence. It is faster but uses more memory. Otherwise, use
+            :func:`_compute_mmi_loss_exact_non_optimized`.
+        """
         super().__init__()
         self.graph_compiler = graph_compiler
         self.den_scale = den_scale
         self.use_pruned_intersect = use_pruned_intersect
         self.beam_size = beam_size
+        self.use_fused_intersect = use_fused_intersect
 
     def forward(
         self,
@@ -204,9 +227,10 @@ class LFMMILoss(nn.Module):
         """
         if self.use_pruned_intersect:
             func = _compute_mmi_loss_pruned
+        elif self.use_fused_intersect:
+            func = _compute_mmi_loss_exact_optimized
         else:
             func = _compute_mmi_loss_exact_non_optimized
-            #  func = _compute_mmi_loss_exact_optimized
 
         return func(
             dense_fsa_vec=dense_fsa_vec,
@@ -1,10 +1,11 @@
 import logging
 from pathlib import Path
-from typing import Iterable, List, Tuple, Union
+from typing import Iterable, List, Optional, Tuple, Union
 
 import k2
 import torch
 
+from icefall.fsa_cache import FsaCache, get_fsa_digest
 from icefall.lexicon import UniqLexicon
 
 
@@ -17,6 +18,7 @@ class MmiTrainingGraphCompiler(object):
         oov: str = "<UNK>",
         sos_id: int = 1,
         eos_id: int = 1,
+        graph_cache: Optional[FsaCache] = None,
     ):
         """
         Args:
@@ -39,6 +41,9 @@ class MmiTrainingGraphCompiler(object):
           oov:
             Out of vocabulary word. When a word in the transcript
             does not exist in the lexicon, it is replaced with `oov`.
+          graph_cache:
+            If not None, the numerator graph of each transcript is cached in
+            it by :meth:`compile`.
         """
         self.lang_dir = Path(lang_dir)
         self.lexicon = UniqLexicon(lang_dir, uniq_filename=uniq_filename)
@@ -46,12 +51,19 @@ class MmiTrainingGraphCompiler(object):
 
         self.L_inv = self.lexicon.L_inv.to(self.device)
 
+        self.oov = oov
         self.oov_id = self.lexicon.word_table[oov]
         self.sos_id = sos_id
         self.eos_id = eos_id
 
         self.build_ctc_topo_P()
 
+        self.graph_cache = graph_cache
+        if graph_cache is not None:
+            self.cache_prefix = get_fsa_digest(
+                self.L_inv, get_fsa_digest(self.ctc_topo_P), self.oov_id
+            )
+
     def build_ctc_topo_P(self):
         """Built ctc_topo_P, the composition result of
         ctc_topo and P, where P is a pre-trained bigram
@@ -74,7 +86,9 @@ class MmiTrainingGraphCompiler(object):
         # CAUTION: The following line is crucial.
         # Arcs entering the back-off state have label equal to #0.
         # We have to change it to 0 here.
-        P.labels[P.labels >= first_token_disambig_id] = 0
+        labels = P.labels.clone()
+        labels[labels >= first_token_disambig_id] = 0
+        P.labels = labels
 
         P = k2.remove_epsilon(P)
         P = k2.arc_sort(P)
@@ -99,6 +113,9 @@ class MmiTrainingGraphCompiler(object):
         self.ctc_topo_P = k2.arc_sort(ctc_topo_P)
         logging.info(f"ctc_topo_P num_arcs: {self.ctc_topo_P.num_arcs}")
 
+        # The denominator graph shared by all utterances
+        self.ctc_topo_P_vec = k2.create_fsa_vec([self.ctc_topo_P])
+
     def compile(
         self, texts: Iterable[str], replicate_den: bool = True
     ) -> Tuple[k2.Fsa, k2.Fsa]:
@@ -126,6 +143,35 @@ class MmiTrainingGraphCompiler(object):
               with the same shape of the `num_graph` if replicate_den is
               True; otherwise, it is an FsaVec containing only a single FSA.
         """
+        texts = list(texts)
+        if self.graph_cache is None:
+            num = self.compile_num(texts)
+        else:
+            keys = [f"{self.cache_prefix}:{' '.join(text.split())}" for text in texts]
+            num = self.graph_cache.compile(
+                keys,
+                lambda indexes: self.compile_num([texts[i] for i in indexes]),
+                device=self.device,
+            )
+
+        if replicate_den:
+            indexes = torch.zeros(len(texts), dtype=torch.int32, device=self.device)
+            den = k2.index_fsa(self.ctc_topo_P_vec, indexes)
+        else:
+            den = self.ctc_topo_P_vec
+
+        return num, den
+
+    def compile_num(self, texts: List[str]) -> k2.Fsa:
+        """Create numerator graphs from transcripts.
+
+        Args:
+          texts:
+            A list of transcripts. Within a transcript, words are
+            separated by spaces.
+        Returns:
+          Return an FsaVec with shape `(len(texts), None, None)`.
+        """
         transcript_fsa = self.build_transcript_fsa(texts)
 
         # remove word IDs from transcript_fsa since it is not needed
@@ -150,15 +196,7 @@ class MmiTrainingGraphCompiler(object):
         num = k2.connect(num)
 
         num = k2.arc_sort(num)
-
-        ctc_topo_P_vec = k2.create_fsa_vec([self.ctc_topo_P])
-        if replicate_den:
-            indexes = torch.zeros(len(texts), dtype=torch.int32, device=self.device)
-            den = k2.index_fsa(ctc_topo_P_vec, indexes)
-        else:
-            den = ctc_topo_P_vec
-
-        return num, den
+        return num
 
     def build_transcript_fsa(self, texts: List[str]) -> k2.Fsa:
         """Convert transcripts to an FsaVec with the help of a lexicon
@@ -174,15 +212,7 @@ class MmiTrainingGraphCompiler(object):
           Return an FST (FsaVec) corresponding to the transcript.
           Its `labels` is token IDs and `aux_labels` is word IDs.
         """
-        word_ids_list = []
-        for text in texts:
-            word_ids = []
-            for word in text.split():
-                if word in self.lexicon.word_table:
-                    word_ids.append(self.lexicon.word_table[word])
-                else:
-                    word_ids.append(self.oov_id)
-            word_ids_list.append(word_ids)
+        word_ids_list = self.lexicon.texts_to_word_ids(texts, oov=self.oov)
 
         fsa = k2.linear_fsa(word_ids_list, self.device)
         fsa = k2.add_epsilon_self_loops(fsa)
@@ -14,9 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import defaultdict
+import functools
+import os
 from typing import List, Optional, Tuple
 
+import numpy as np
+
 from icefall.utils import is_module_available
 
 
@@ -26,8 +29,24 @@ class NgramLm:
         fst_filename: str,
         backoff_id: int,
         is_binary: bool = False,
+        compiled_filename: Optional[str] = None,
+        cache_size: int = 1000000,
     ):
         """
+        The FST is compiled into arrays in CSR format:
+
+          - state_offsets: Arcs leaving state s are in the range
+            [state_offsets[s], state_offsets[s+1]). Its dtype is np.int64.
+          - ilabels: The input label of each arc, sorted for each state.
+            Its dtype is np.int32.
+          - next_states: The destination state of each arc. Its dtype is
+            np.int32.
+          - weights: The weight of each arc. Its dtype is np.float32.
+          - backoff_states: The destination state of the backoff arc leaving
+            each state, or -1 if there is none. Its dtype is np.int32.
+          - backoff_costs: The weight of the backoff arc leaving each state.
+            Its dtype is np.float32.
+
         Args:
           fst_filename:
             Path to the FST.
@@ -35,7 +54,34 @@ class NgramLm:
             ID of the backoff symbol.
           is_binary:
             True if the given file is a binary FST.
+          compiled_filename:
+            If not None, the compiled arrays are loaded from this file if it
+            is newer than `fst_filename`, in which case `kaldifst` is not
+            needed and `self.lm` is None. Otherwise, the FST is compiled and
+            the arrays are saved to this file with `np.savez()`.
+          cache_size:
+            Max number of (state, label) pairs whose results are memoized
+            by :meth:`get_next_state_and_cost`.
         """
+        self.backoff_id = backoff_id
+        self.lm = None
+
+        if compiled_filename is not None and self._load_compiled(
+            compiled_filename, fst_filename
+        ):
+            pass
+        else:
+            self.lm = self._load_fst(fst_filename, is_binary)
+            self._compile()
+            if compiled_filename is not None:
+                self._save_compiled(compiled_filename)
+
+        self.get_next_state_and_cost = functools.lru_cache(maxsize=cache_size)(
+            self._get_next_state_and_cost
+        )
+
+    @staticmethod
+    def _load_fst(fst_filename: str, is_binary: bool):
         if not is_module_available("kaldifst"):
             raise ValueError("Please 'pip install kaldifst' first.")
 
@@ -50,8 +96,107 @@ class NgramLm:
         if not lm.is_ilabel_sorted:
             kaldifst.arcsort(lm, sort_type="ilabel")
 
-        self.lm = lm
-        self.backoff_id = backoff_id
+        return lm
+
+    def _compile(self) -> None:
+        """Compile self.lm into arrays."""
+        import kaldifst
+
+        num_states = self.lm.num_states
+        state_offsets = np.zeros(num_states + 1, dtype=np.int64)
+        ilabels = []
+        next_states = []
+        weights = []
+        for state in range(num_states):
+            for arc in kaldifst.ArcIterator(self.lm, state):
+                ilabels.append(arc.ilabel)
+                next_states.append(arc.nextstate)
+                weights.append(arc.weight.value)
+            state_offsets[state + 1] = len(ilabels)
+
+        self._set_arrays(
+            start_state=self.lm.start,
+            state_offsets=state_offsets,
+            ilabels=np.array(ilabels, dtype=np.int32),
+            next_states=np.array(next_states, dtype=np.int32),
+            weights=np.array(weights, dtype=np.float32),
+        )
+
+    def _set_arrays(
+        self,
+        start_state: int,
+        state_offsets: np.ndarray,
+        ilabels: np.ndarray,
+        next_states: np.ndarray,
+        weights: np.ndarray,
+    ) -> None:
+        self.start_state = int(start_state)
+        self.state_offsets = state_offsets
+        self.ilabels = ilabels
+        self.next_states = next_states
+        self.weights = weights
+
+        num_states = state_offsets.shape[0] - 1
+        arc_states = np.repeat(
+            np.arange(num_states, dtype=np.int64), np.diff(state_offsets)
+        )
+
+        # Since ilabels are sorted for each state, _arc_keys is sorted
+        # and can be searched with np.searchsorted() for all states at once
+        self._label_stride = int(ilabels.max()) + 1 if ilabels.size > 0 else 1
+        self._arc_keys = arc_states * self._label_stride + ilabels
+
+        self.backoff_states = np.full(num_states, -1, dtype=np.int32)
+        self.backoff_costs = np.zeros(num_states, dtype=np.float32)
+        backoff_arcs = np.nonzero(ilabels == self.backoff_id)[0]
+        # If a state has more than one backoff arc, keep the first one
+        backoff_arcs = backoff_arcs[::-1]
+        self.backoff_states[arc_states[backoff_arcs]] = next_states[backoff_arcs]
+        self.backoff_costs[arc_states[backoff_arcs]] = weights[backoff_arcs]
+
+    def _save_compiled(self, filename: str) -> None:
+        with open(filename, "wb") as f:
+            np.savez(
+                f,
+                backoff_id=np.array(self.backoff_id),
+                start_state=np.array(self.start_state),
+                state_offsets=self.state_offsets,
+                ilabels=self.ilabels,
+                next_states=self.next_states,
+                weights=self.weights,
+            )
+
+    def _load_compiled(self, filename: str, fst_filename: str) -> bool:
+        """Load the arrays saved by :meth:`_save_compiled`.
+
+        Returns:
+          Return False if `filename` does not exist, is older than
+          `fst_filename`, or is compiled with a different backoff ID.
+        """
+        if not os.path.isfile(filename):
+            return False
+
+        if os.path.isfile(fst_filename) and os.path.getmtime(
+            fst_filename
+        ) > os.path.getmtime(filename):
+            return False
+
+        with np.load(filename) as f:
+            if int(f["backoff_id"]) != self.backoff_id:
+                return False
+
+            self._set_arrays(
+                start_state=int(f["start_state"]),
+                state_offsets=f["state_offsets"],
+                ilabels=f["ilabels"],
+                next_states=f["next_states"],
+                weights=f["weights"],
+            )
+        return True
+
+    @property
+    def num_states(self) -> int:
+        return self.state_offsets.shape[0] - 1
 
     def _process_backoff_arcs(
         self,
@@ -76,46 +221,42 @@ class NgramLm:
         """
         ans = []
 
-        next_state, next_cost = self._get_next_state_and_cost_without_backoff(
-            state=state,
-            label=self.backoff_id,
-        )
-        if next_state is None:
-            return ans
-        ans.append((next_state, next_cost + cost))
-        ans += self._process_backoff_arcs(next_state, next_cost + cost)
+        next_state = int(self.backoff_states[state])
+        while next_state >= 0:
+            cost = float(self.backoff_costs[state]) + cost
+            ans.append((next_state, cost))
+            state = next_state
+            next_state = int(self.backoff_states[state])
         return ans
 
     def _get_next_state_and_cost_without_backoff(
         self, state: int, label: int
     ) -> Tuple[int, float]:
-        """TODO: Add doc."""
-        import kaldifst
-
-        arc_iter = kaldifst.ArcIterator(self.lm, state)
-        num_arcs = self.lm.num_arcs(state)
+        """Return the destination state and the weight of the arc with the
+        given label leaving the given state, or (None, None) if there is
+        no such arc.
+        """
+        begin = self.state_offsets[state]
+        end = self.state_offsets[state + 1]
 
         # The LM is arc sorted by ilabel, so we use binary search below.
-        left = 0
-        right = num_arcs - 1
-        while left <= right:
-            mid = (left + right) // 2
-            arc_iter.seek(mid)
-            arc = arc_iter.value
-            if arc.ilabel < label:
-                left = mid + 1
-            elif arc.ilabel > label:
-                right = mid - 1
-            else:
-                return arc.nextstate, arc.weight.value
+        i = begin + np.searchsorted(self.ilabels[begin:end], label)
+        if i < end and self.ilabels[i] == label:
+            return int(self.next_states[i]), float(self.weights[i])
 
         return None, None
 
-    def get_next_state_and_cost(
+    def _get_next_state_and_cost(
         self,
         state: int,
         label: int,
     ) -> Tuple[List[int], List[float]]:
+        """Return the states reachable from the given state with the given
+        label, following backoff arcs first, and their costs.
+
+        It is memoized and is called via `self.get_next_state_and_cost()`.
+        Callers must not modify the returned lists.
+        """
         states = [state]
         costs = [0]
 
@@ -138,28 +279,101 @@ class NgramLm:
 
         return next_states, next_costs
 
+    def get_next_states_and_costs(
+        self,
+        states: np.ndarray,
+        labels: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """A vectorized version of :meth:`get_next_state_and_cost` that
+        processes many (state, label) pairs in one call.
+
+        Args:
+          states:
+            A 1-D array of states.
+          labels:
+            A 1-D array of labels. Must have the same shape as `states`.
+        Returns:
+          Return a tuple of three 1-D arrays `(indexes, next_states, costs)`.
+          `indexes[i]` is the index of the (state, label) pair that
+          `(next_states[i], costs[i])` belongs to. Entries of the same pair
+          are in the same order as those returned by
+          :meth:`get_next_state_and_cost`.
+        """
+        states = np.asarray(states, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64)
+        assert states.ndim == 1, states.shape
+        assert states.shape == labels.shape, (states.shape, labels.shape)
+
+        # Follow the backoff arcs, see _process_backoff_arcs()
+        indexes = np.arange(states.shape[0])
+        costs = np.zeros(states.shape[0], dtype=np.float64)
+        all_indexes = [indexes]
+        all_states = [states]
+        all_costs = [costs]
+        while True:
+            next_states = self.backoff_states[states]
+            has_backoff = next_states >= 0
+            if not has_backoff.any():
+                break
+            costs = self.backoff_costs[states[has_backoff]] + costs[has_backoff]
+            states = next_states[has_backoff].astype(np.int64)
+            indexes = indexes[has_backoff]
+            all_indexes.append(indexes)
+            all_states.append(states)
+            all_costs.append(costs)
+
+        indexes = np.concatenate(all_indexes)
+        states = np.concatenate(all_states)
+        costs = np.concatenate(all_costs)
+        labels = labels[indexes]
+
+        # Look up the arcs of all states at once,
+        # see _get_next_state_and_cost_without_backoff()
+        keys = states * self._label_stride + labels
+        pos = np.searchsorted(self._arc_keys, keys)
+        found = (labels >= 0) & (labels < self._label_stride)
+        found &= pos < self._arc_keys.shape[0]
+        pos = pos[found]
+        indexes = indexes[found]
+        costs = costs[found]
+
+        found = self._arc_keys[pos] == keys[found]
+        # Like get_next_state_and_cost(), state 0 is skipped
+        found &= self.next_states[pos] != 0
+
+        indexes = indexes[found]
+        pos = pos[found]
+        costs = costs[found] + self.weights[pos]
+
+        order = np.argsort(indexes, kind="stable")
+        return (
+            indexes[order],
+            self.next_states[pos][order].astype(np.int64),
+            costs[order],
+        )
+
 
 class NgramLmStateCost:
     def __init__(self, ngram_lm: NgramLm, state_cost: Optional[dict] = None):
-        assert ngram_lm.lm.start == 0, ngram_lm.lm.start
+        assert ngram_lm.start_state == 0, ngram_lm.start_state
         self.ngram_lm = ngram_lm
         if state_cost is not None:
             self.state_cost = state_cost
         else:
-            self.state_cost = defaultdict(lambda: float("inf"))
-
             # At the very beginning, we are at the start state with cost 0
-            self.state_cost[0] = 0.0
+            self.state_cost = {0: 0.0}
 
     def forward_one_step(self, label: int) -> "NgramLmStateCost":
-        state_cost = defaultdict(lambda: float("inf"))
+        state_cost = {}
         for s, c in self.state_cost.items():
             next_states, next_costs = self.ngram_lm.get_next_state_and_cost(
                 s,
                 label,
             )
             for ns, nc in zip(next_states, next_costs):
-                state_cost[ns] = min(state_cost[ns], c + nc)
+                cost = c + nc
+                if cost < state_cost.get(ns, float("inf")):
+                    state_cost[ns] = cost
 
         return NgramLmStateCost(ngram_lm=self.ngram_lm, state_cost=state_cost)
 
@@ -14,13 +14,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Tuple
+import logging
+from pathlib import Path
+from typing import List, Tuple, Union
 
 import k2
+import numpy as np
 import torch
+import torch.distributed as dist
 from torch.utils.data import DataLoader
 from torch.utils.data.distributed import DistributedSampler
 
+from icefall.lang_bundle import load_lang_bundle, save_lang_bundle
 from icefall.utils import AttributeDict, add_eos, add_sos
 
 
@@ -162,53 +167,262 @@ class LmDatasetCollate:
         return x.to(torch.int64), y.to(torch.int64), sentence_token_lengths
 
 
+def get_batch_boundaries(
+    sentence_lengths: np.ndarray,
+    max_sent_len: int,
+    batch_size: int,
+) -> np.ndarray:
+    """Split sentences into batches in the same way as :class:`LmDataset`.
+
+    Args:
+      sentence_lengths:
+        A 1-D array containing number of tokens of each sentence.
+      max_sent_len:
+        See :class:`LmDataset`.
+      batch_size:
+        See :class:`LmDataset`.
+    Returns:
+      Return a 1-D array `b` of dtype np.int64, where batch i contains
+      sentences b[i] to b[i+1] - 1.
+    """
+    assert batch_size > 0, batch_size
+    assert max_sent_len > 1, max_sent_len
+
+    num_sentences = sentence_lengths.size
+    sz = sentence_lengths.astype(np.int64) // max_sent_len + 1
+    # The size of a batch starting at each sentence
+    step = np.minimum(batch_size // sz + 1, batch_size)
+
+    # Within a run of sentences with the same step, the batches starting in
+    # it have the same size. There are only a few such runs if the sentences
+    # are sorted by length.
+    changes = np.flatnonzero(step[1:] != step[:-1]) + 1
+    run_ends = np.append(changes, num_sentences)
+
+    starts = []
+    cur = 0
+    for end in run_ends.tolist():
+        if cur >= end:
+            continue
+        s = int(step[cur])
+        n = (end - cur + s - 1) // s
+        starts.append(np.arange(cur, cur + n * s, s, dtype=np.int64))
+        cur += n * s
+
+    starts.append(np.array([num_sentences], dtype=np.int64))
+    return np.minimum(np.concatenate(starts), num_sentences)
+
+
+def lm_archive_to_bundle(archive: Union[str, Path], bundle: Union[str, Path]) -> None:
+    """Convert LM training data generated by `../local/prepare_lm_training_data.py`
+    to a bundle (see `icefall/lang_bundle.py`) containing:
+
+      - "tokens": a 1-D array of dtype np.int32 with the tokens of all
+        sentences
+      - "row_splits": a 1-D array of dtype np.int64, where the tokens of
+        sentence i are tokens[row_splits[i]:row_splits[i+1]]
+    """
+    data = torch.load(archive)
+    words = data["words"]
+    sentences = data["sentences"]
+
+    word_row_splits = words.shape.row_splits(1).numpy().astype(np.int64)
+    word_tokens = words.values.numpy()
+    word_lengths = word_row_splits[1:] - word_row_splits[:-1]
+
+    sentence_words = sentences.values.numpy().astype(np.int64)
+    sentence_row_splits = sentences.shape.row_splits(1).numpy().astype(np.int64)
+
+    # Number of tokens of each word in the sentences
+    num_tokens = word_lengths[sentence_words]
+    cum_num_tokens = np.zeros(num_tokens.size + 1, dtype=np.int64)
+    np.cumsum(num_tokens, out=cum_num_tokens[1:])
+
+    offsets = np.repeat(
+        word_row_splits[sentence_words] - cum_num_tokens[:-1], num_tokens
+    )
+    tokens = word_tokens[offsets + np.arange(cum_num_tokens[-1], dtype=np.int64)]
+
+    save_lang_bundle(
+        bundle,
+        {
+            "tokens": tokens.astype(np.int32),
+            "row_splits": cum_num_tokens[sentence_row_splits],
+        },
+        metadata={"archive": str(archive)},
+    )
+
+
+class MappedLmDataset(torch.utils.data.Dataset):
+    """Like :class:`LmDataset` and :class:`LmDatasetCollate`, but the tokens
+    are in arrays memory-mapped from a bundle created by
+    :func:`lm_archive_to_bundle`, which are shared by all processes, and
+    each item is a collated batch, so collation runs in the dataloader
+    workers.
+    """
+
+    def __init__(
+        self,
+        tokens: np.ndarray,
+        row_splits: np.ndarray,
+        max_sent_len: int,
+        batch_size: int,
+        sos_id: int,
+        eos_id: int,
+        blank_id: int,
+    ):
+        """
+        Args:
+          tokens:
+            A 1-D array containing the tokens of all sentences.
+          row_splits:
+            The tokens of sentence i are tokens[row_splits[i]:row_splits[i+1]].
+            We assume that sentences are sorted by length.
+          max_sent_len:
+            See :class:`LmDataset`.
+          batch_size:
+            See :class:`LmDataset`.
+          sos_id:
+            Token ID of the SOS symbol.
+          eos_id:
+            Token ID of the EOS symbol.
+          blank_id:
+            Token ID of the blank symbol.
+        """
+        super().__init__()
+        self.tokens = tokens
+        self.row_splits = row_splits
+        self.sos_id = sos_id
+        self.eos_id = eos_id
+        self.blank_id = blank_id
+
+        self.batch_boundaries = get_batch_boundaries(
+            sentence_lengths=row_splits[1:] - row_splits[:-1],
+            max_sent_len=max_sent_len,
+            batch_size=batch_size,
+        )
+
+    def __len__(self) -> int:
+        """Return number of batches in this dataset"""
+        return self.batch_boundaries.size - 1
+
+    def __getitem__(self, i: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Return the i'th batch as a tuple (x, y, lengths), which is the same
+        as that returned by :class:`LmDatasetCollate`.
+        """
+        assert 0 <= i < len(self), i
+        start, end = self.batch_boundaries[i], self.batch_boundaries[i + 1]
+        row_splits = self.row_splits[start : end + 1]
+        # The sentences of a batch are consecutive
+        tokens = self.tokens[row_splits[0] : row_splits[-1]]
+
+        lengths = row_splits[1:] - row_splits[:-1]
+        batch_size = lengths.size
+        max_len = int(lengths.max()) + 1
+
+        # mask[i, j] is True if j < lengths[i]
+        mask = np.arange(max_len - 1) < lengths[:, None]
+
+        x = np.full((batch_size, max_len), self.blank_id, dtype=np.int64)
+        x[:, 0] = self.sos_id
+        x[:, 1:][mask] = tokens
+
+        y = np.full((batch_size, max_len), self.blank_id, dtype=np.int64)
+        y[:, :-1][mask] = tokens
+        y[np.arange(batch_size), lengths] = self.eos_id
+
+        return (
+            torch.from_numpy(x),
+            torch.from_numpy(y),
+            torch.from_numpy((lengths + 1).astype(np.int32)),
+        )
+
+
+def load_lm_bundle(filename: Union[str, Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the memory-mapped (tokens, row_splits) of LM data.
+
+    Args:
+      filename:
+        Either a bundle created by :func:`lm_archive_to_bundle`, or an
+        archive generated by `../local/sort_lm_training_data.py`, in which
+        case it is converted to `{filename}.bundle` if that file does not
+        exist or is older than the archive. In DDP training, only rank 0
+        converts it, while the other ranks wait for it, so the bundle has
+        to be on a file system shared by all ranks.
+    """
+    filename = Path(filename)
+    if filename.suffix != ".bundle":
+        bundle = filename.with_name(f"{filename.name}.bundle")
+        is_distributed = dist.is_available() and dist.is_initialized()
+        if not is_distributed or dist.get_rank() == 0:
+            if (
+                not bundle.is_file()
+                or bundle.stat().st_mtime < filename.stat().st_mtime
+            ):
+                logging.info(f"Converting {filename} to {bundle}")
+                lm_archive_to_bundle(filename, bundle)
+        if is_distributed:
+            dist.barrier()
+        filename = bundle
+
+    ans = load_lang_bundle(filename)
+    assert ans is not None, f"{filename} is not a valid bundle"
+    arrays, _ = ans
+    return arrays["tokens"], arrays["row_splits"]
+
+
 def get_dataloader(
     filename: str,
     is_distributed: bool,
     params: AttributeDict,
+    num_workers: int = 0,
 ) -> torch.utils.data.DataLoader:
     """Get dataloader for LM training.
 
     Args:
       filename:
         Path to the file containing LM data. The file is assumed to
-        be generated by `../local/sort_lm_training_data.py`.
+        be generated by `../local/sort_lm_training_data.py`, or to be a
+        bundle converted from it. See :func:`load_lm_bundle`.
       is_distributed:
         True if using DDP training. False otherwise.
       params:
         Set `get_params()` from `rnn_lm/train.py`
+      num_workers:
+        Number of dataloader workers, which create the batches.
     Returns:
       Return a dataloader containing the LM data.
     """
-    lm_data = torch.load(filename)
-
-    words = lm_data["words"]
-    sentences = lm_data["sentences"]
-    sentence_lengths = lm_data["sentence_lengths"]
+    tokens, row_splits = load_lm_bundle(filename)
 
-    dataset = LmDataset(
-        sentences=sentences,
-        words=words,
-        sentence_lengths=sentence_lengths,
+    dataset = MappedLmDataset(
+        tokens=tokens,
+        row_splits=row_splits,
         max_sent_len=params.max_sent_len,
         batch_size=params.batch_size,
+        sos_id=params.sos_id,
+        eos_id=params.eos_id,
+        blank_id=params.blank_id,
     )
     if is_distributed:
         sampler = DistributedSampler(dataset, shuffle=True, drop_last=True)
     else:
         sampler = None
 
-    collate_fn = LmDatasetCollate(
-        sos_id=params.sos_id,
-        eos_id=params.eos_id,
-        blank_id=params.blank_id,
-    )
+    kwargs = dict()
+    if num_workers > 0:
+        # torch < 2.0 raises if prefetch_factor is set, even to None, when
+        # num_workers is 0
+        kwargs["prefetch_factor"] = 4
+        kwargs["persistent_workers"] = True
 
     dataloader = DataLoader(
         dataset,
-        batch_size=1,
-        collate_fn=collate_fn,
+        batch_size=None,
         sampler=sampler,
         shuffle=sampler is None,
+        num_workers=num_workers,
+        pin_memory=torch.cuda.is_available(),
+        **kwargs,
     )
     return dataloader
@@ -15,12 +15,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import tempfile
+from pathlib import Path
+
 import k2
+import numpy as np
+import rnn_lm.dataset
 import torch
-from rnn_lm.dataset import LmDataset, LmDatasetCollate
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from rnn_lm.dataset import (
+    LmDataset,
+    LmDatasetCollate,
+    MappedLmDataset,
+    get_batch_boundaries,
+    get_dataloader,
+    load_lm_bundle,
+)
 
+from icefall.lang_bundle import save_lang_bundle
+from icefall.utils import AttributeDict
 
-def main():
+
+def test_lm_dataset():
     sentences = k2.RaggedTensor(
         [[0, 1, 2], [1, 0, 1], [0, 1], [1, 3, 0, 2, 0], [3], [0, 2, 1]]
     )
@@ -67,5 +84,111 @@ def main():
     # I've checked the output manually; the output is as expected.
 
 
+def test_get_batch_boundaries():
+    rng = np.random.default_rng(20221017)
+    lengths = np.sort(rng.integers(1, 40, size=1000))[::-1]
+    for max_sent_len in [2, 5, 30]:
+        for batch_size in [1, 7, 50]:
+            expected = [0]
+            while expected[-1] < lengths.size:
+                sz = lengths[expected[-1]] // max_sent_len + 1
+                actual_batch_size = min(batch_size // sz + 1, batch_size)
+                end = min(expected[-1] + actual_batch_size, lengths.size)
+                expected.append(end)
+
+            boundaries = get_batch_boundaries(lengths, max_sent_len, batch_size)
+            assert boundaries.tolist() == expected, (max_sent_len, batch_size)
+
+
+def test_mapped_lm_dataset():
+    sentences = [[3, 6, 2, 8], [5, 6, 7], [9, 3], [5]]
+    row_splits = np.cumsum([0] + [len(s) for s in sentences])
+    tokens = np.array(sum(sentences, []), dtype=np.int32)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = Path(tmp_dir) / "lm_data.bundle"
+        save_lang_bundle(filename, {"tokens": tokens, "row_splits": row_splits})
+        tokens, row_splits = load_lm_bundle(filename)
+
+        dataset = MappedLmDataset(
+            tokens=tokens,
+            row_splits=row_splits,
+            max_sent_len=3,
+            batch_size=2,
+            sos_id=1,
+            eos_id=-1,
+            blank_id=0,
+        )
+        # sz is 2 for the first two sentences, so the batch size is 2
+        assert len(dataset) == 2, len(dataset)
+
+        x, y, lengths = dataset[0]
+        assert x.tolist() == [[1, 3, 6, 2, 8], [1, 5, 6, 7, 0]], x
+        assert y.tolist() == [[3, 6, 2, 8, -1], [5, 6, 7, -1, 0]], y
+        assert lengths.tolist() == [5, 4], lengths
+        assert x.dtype == y.dtype == torch.int64
+        assert lengths.dtype == torch.int32
+
+        x, y, lengths = dataset[1]
+        assert x.tolist() == [[1, 9, 3], [1, 5, 0]], x
+        assert y.tolist() == [[9, 3, -1], [5, -1, 0]], y
+        assert lengths.tolist() == [3, 2], lengths
+
+        params = AttributeDict(
+            max_sent_len=3,
+            batch_size=2,
+            sos_id=1,
+            eos_id=-1,
+            blank_id=0,
+        )
+        for num_workers in [0, 2]:
+            dataloader = get_dataloader(
+                filename,
+                is_distributed=False,
+                params=params,
+                num_workers=num_workers,
+            )
+            assert len([b for b in dataloader]) == 2
+
+
+def load_lm_bundle_ddp(rank: int, world_size: int, tmp_dir: str):
+    dist.init_process_group(
+        "gloo",
+        init_method=f"file://{tmp_dir}/init",
+        rank=rank,
+        world_size=world_size,
+    )
+    lm_archive_to_bundle = rnn_lm.dataset.lm_archive_to_bundle
+
+    def convert(archive, bundle):
+        Path(f"{tmp_dir}/converted-{rank}").touch()
+        lm_archive_to_bundle(archive, bundle)
+
+    rnn_lm.dataset.lm_archive_to_bundle = convert
+    tokens, row_splits = load_lm_bundle(f"{tmp_dir}/lm_data.pt")
+    assert tokens.tolist() == [5, 3, 6, 2, 8, 9, 3], tokens
+    assert row_splits.tolist() == [0, 1, 7], row_splits
+    dist.destroy_process_group()
+
+
+def test_load_lm_bundle_ddp():
+    words = k2.RaggedTensor([[3, 6], [2, 8, 9, 3], [5]])
+    sentences = k2.RaggedTensor([[2], [0, 1]])
+    world_size = 2
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.save({"words": words, "sentences": sentences}, f"{tmp_dir}/lm_data.pt")
+        mp.spawn(load_lm_bundle_ddp, args=(world_size, tmp_dir), nprocs=world_size)
+        # Only rank 0 converts the archive
+        converted = sorted(p.name for p in Path(tmp_dir).glob("converted-*"))
+        assert converted == ["converted-0"], converted
+
+
+def main():
+    test_lm_dataset()
+    test_get_batch_boundaries()
+    test_mapped_lm_dataset()
+    test_load_lm_bundle_ddp()
+
+
 if __name__ == "__main__":
     main()
@@ -161,6 +161,103 @@ class RelPositionMultiheadAttention(nn.Module):
             left_context=left_context,
         )
 
+    def streaming_forward(
+        self,
+        x: Tensor,
+        pos_emb: Tensor,
+        cached_kv: Tensor,
+        key_padding_mask: Optional[Tensor] = None,
+        attn_mask: Optional[Tensor] = None,
+    ) -> Tuple[Tensor, Tensor]:
+        r"""Self-attention of the new frames `x` over the cached keys/values
+        of the previous frames and the new frames themselves.
+
+        Args:
+            x: The new frames of shape :math:`(L, N, E)`.
+            pos_emb: Positional embedding tensor of shape :math:`(1, S+2*L-1, E)`,
+                where S is the number of cached frames, i.e., it is computed with
+                `left_context=S`.
+            cached_kv: The projected keys and values of the previous frames
+                concatenated along the last dim, of shape :math:`(S, N, 2*E)`.
+            key_padding_mask: :math:`(N, S+L)`. True for the positions to be
+                ignored.
+            attn_mask: :math:`(L, S+L)`. True for the positions to be ignored.
+
+        Returns:
+            Return a tuple of 2 tensors:
+            - attn_output: :math:`(L, N, E)`.
+            - new_cached_kv: :math:`(S+L, N, 2*E)`, the cached keys/values
+              for the next call.
+        """
+        tgt_len, bsz, embed_dim = x.size()
+        left_context = cached_kv.size(0)
+        num_heads = self.num_heads
+        head_dim = self.head_dim
+        scaling = float(head_dim) ** -0.5
+
+        q, kv = nn.functional.linear(
+            x, self.in_proj.get_weight(), self.in_proj.get_bias()
+        ).split([embed_dim, 2 * embed_dim], dim=-1)
+
+        new_cached_kv = torch.cat([cached_kv, kv], dim=0)
+        k, v = new_cached_kv.chunk(2, dim=-1)
+        src_len = k.size(0)
+
+        q = (q * scaling).contiguous().view(tgt_len, bsz, num_heads, head_dim)
+        k = k.contiguous().view(src_len, bsz, num_heads, head_dim)
+        v = v.contiguous().view(src_len, bsz * num_heads, head_dim).transpose(0, 1)
+
+        q = q.transpose(0, 1)  # (batch, time1, head, d_k)
+
+        p = self.linear_pos(pos_emb).view(pos_emb.size(0), -1, num_heads, head_dim)
+        p = p.permute(0, 2, 3, 1)  # (batch, head, d_k, left_context+2*time1-1)
+
+        q_with_bias_u = (q + self._pos_bias_u()).transpose(1, 2)
+        q_with_bias_v = (q + self._pos_bias_v()).transpose(1, 2)
+
+        k = k.permute(1, 2, 3, 0)  # (batch, head, d_k, time2)
+        matrix_ac = torch.matmul(q_with_bias_u, k)  # (batch, head, time1, time2)
+
+        matrix_bd = torch.matmul(q_with_bias_v, p)
+        matrix_bd = self.rel_shift(matrix_bd, left_context)
+
+        attn_output_weights = matrix_ac + matrix_bd  # (batch, head, time1, time2)
+
+        mask = None
+        if attn_mask is not None:
+            mask = attn_mask
+        if key_padding_mask is not None:
+            padding_mask = key_padding_mask.unsqueeze(1).unsqueeze(2)
+            mask = padding_mask if mask is None else mask | padding_mask
+
+        if mask is not None:
+            attn_output_weights = attn_output_weights.masked_fill(mask, float("-inf"))
+
+        attn_output_weights = nn.functional.softmax(attn_output_weights, dim=-1)
+
+        if mask is not None:
+            # Frames that can only see padding positions, e.g., the left
+            # padding of the first call, get NaNs above. Their outputs
+            # are never used.
+            attn_output_weights = attn_output_weights.masked_fill(mask, 0.0)
+
+        attn_output_weights = nn.functional.dropout(
+            attn_output_weights, p=self.dropout, training=self.training
+        )
+
+        attn_output_weights = attn_output_weights.view(
+            bsz * num_heads, tgt_len, src_len
+        )
+        attn_output = torch.bmm(attn_output_weights, v)
+        attn_output = (
+            attn_output.transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
+        )
+        attn_output = nn.functional.linear(
+            attn_output, self.out_proj.get_weight(), self.out_proj.get_bias()
+        )
+
+        return attn_output, new_cached_kv
+
     def rel_shift(self, x: Tensor, left_context: int = 0) -> Tensor:
         """Compute relative positional encoding.
 
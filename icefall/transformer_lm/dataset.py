@@ -0,0 +1 @@
+../rnn_lm/dataset.py
\ No newline at end of file
@@ -115,6 +115,58 @@ class Transformer(torch.nn.Module):
         x = x.permute(1, 0, 2)  # (T, N, C) ->(N, T, C)
         return x, x_lens
 
+    def streaming_forward(
+        self,
+        x: torch.Tensor,
+        padding_mask: torch.Tensor,
+        cached_kv: torch.Tensor,
+        cached_padding_mask: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Run the transformer on new frames given the cached keys/values of
+        the previous frames.
+
+        Since the attention only uses relative positions, the frames of
+        each sequence must be left-aligned, i.e., padding is only allowed on
+        the left so that the last frame of all sequences is at the same
+        position.
+
+        Args:
+            x (torch.Tensor): The new frames (B,T,input_dim)
+            padding_mask (torch.Tensor): True for the padding frames in x (B,T)
+            cached_kv (torch.Tensor): The cached keys and values of the
+                previous frames (num_layers,S,B,2*d_model)
+            cached_padding_mask (torch.Tensor): True for the padding frames
+                in the cache (B,S)
+
+        Returns:
+            Return a tuple of 3 tensors:
+            - x: output feature of the transformer (B,T,d_model)
+            - cached_kv: the updated cache (num_layers,S+T,B,2*d_model)
+            - cached_padding_mask: the updated padding mask (B,S+T)
+        """
+        left_context = cached_kv.size(1)
+        T = x.size(1)
+
+        ones = torch.ones(T, left_context + T, device=x.device, dtype=torch.bool)
+        attention_mask = torch.triu(ones, diagonal=left_context + 1)
+        key_padding_mask = torch.cat([cached_padding_mask, padding_mask], dim=1)
+
+        x = self.norm_before(self.embed(x))
+
+        x, pos_emb = self.encoder_pos(x, left_context=left_context)
+        x = x.permute(1, 0, 2)
+
+        x, cached_kv = self.encoder.streaming_forward(
+            x,
+            pos_emb,
+            cached_kv=cached_kv,
+            src_key_padding_mask=key_padding_mask,
+            mask=attention_mask,
+        )  # (T, N, C)
+
+        x = x.permute(1, 0, 2)  # (T, N, C) ->(N, T, C)
+        return x, cached_kv, key_padding_mask
+
 
 class TransformerEncoder(torch.nn.Module):
     def __init__(self, encoder_layer: torch.nn.Module, num_layers: int) -> None:
@@ -160,6 +212,41 @@ class TransformerEncoder(torch.nn.Module):
 
         return output
 
+    def streaming_forward(
+        self,
+        src: torch.Tensor,
+        pos_emb: torch.Tensor,
+        cached_kv: torch.Tensor,
+        src_key_padding_mask: Optional[torch.Tensor] = None,
+        mask: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            src: the new frames to the encoder (T,N,C).
+            pos_emb: Positional embedding tensor (1,S+2*T-1,C).
+            cached_kv: the cached keys/values of all layers (num_layers,S,N,2*C).
+            src_key_padding_mask: the mask for the keys per batch (N,S+T).
+            mask: the mask for the new frames (T,S+T).
+
+        Returns:
+            Return the encoded features (T,N,C) and the updated cache
+            (num_layers,S+T,N,2*C).
+        """
+        output = src
+
+        new_cached_kv = []
+        for layer_index, mod in enumerate(self.layers):
+            output, layer_cached_kv = mod.streaming_forward(
+                output,
+                pos_emb,
+                cached_kv=cached_kv[layer_index],
+                src_key_padding_mask=src_key_padding_mask,
+                src_mask=mask,
+            )
+            new_cached_kv.append(layer_cached_kv)
+
+        return output, torch.stack(new_cached_kv)
+
 
 class TransformerEncoderLayer(torch.nn.Module):
     def __init__(
@@ -235,6 +322,45 @@ class TransformerEncoderLayer(torch.nn.Module):
 
         return src
 
+    def streaming_forward(
+        self,
+        src: torch.Tensor,
+        pos_emb: torch.Tensor,
+        cached_kv: torch.Tensor,
+        src_key_padding_mask: Optional[torch.Tensor] = None,
+        src_mask: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Pass the new frames through the encoder layer, attending to the
+        cached keys/values of the previous frames.
+
+        Args:
+            src: the new frames to the encoder layer (T,N,C).
+            pos_emb: Positional embedding tensor (1,S+2*T-1,C).
+            cached_kv: the cached keys/values of this layer (S,N,2*C).
+            src_key_padding_mask: the mask for the keys per batch (N,S+T).
+            src_mask: the mask for the new frames (T,S+T).
+
+        Returns:
+            Return the output (T,N,C) and the updated cache (S+T,N,2*C).
+        """
+        src_att, cached_kv = self.self_attn.streaming_forward(
+            src,
+            pos_emb=pos_emb,
+            cached_kv=cached_kv,
+            key_padding_mask=src_key_padding_mask,
+            attn_mask=src_mask,
+        )
+
+        src = src + self.dropout(src_att)
+
+        # feed forward module
+        src = src + self.dropout(self.feed_forward(src))
+
+        src = self.norm_final(self.balancer(src))
+
+        return src, cached_kv
+
 
 class RelPositionalEncoding(torch.nn.Module):
     """Relative positional encoding module.
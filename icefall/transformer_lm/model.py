@@ -15,7 +15,7 @@
 # limitations under the License.
 
 import logging
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import torch
 import torch.nn.functional as F
@@ -102,14 +102,141 @@ class TransformerLM(torch.nn.Module):
 
         return nll_loss
 
-    def score_token(self, x: torch.Tensor, x_lens: torch.Tensor, state=None):
+    def score_token(
+        self,
+        x: torch.Tensor,
+        x_lens: torch.Tensor,
+        state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        """Return the log-probs of the next token given the input tokens.
+
+        The keys/values of all layers are returned as the state so that the
+        next call only needs to process the new tokens.
+
+        Args:
+            x (torch.Tensor): If state is None, the input tokens (B,L)
+                padded on the right. Otherwise, the new tokens after those
+                in the state (B,T), which have the same length T for all
+                sequences.
+            x_lens (torch.Tensor): The length of input tokens before padding
+                (B,). Unused if state is not None.
+            state (optional): The state returned by the previous call. It
+                is a tuple of two tensors:
+                - the cached keys/values (num_layers,S,B,2*d_model)
+                - the cached padding mask (B,S), True for padding positions.
+                  The cache is left-aligned, i.e., padding positions are on
+                  the left.
+                Use :meth:`stack_states`, :meth:`unstack_states` and
+                :meth:`select_states` to reorder it.
+
+        Returns:
+            Return a tuple containing:
+            - log-probs of the next token (B,vocab_size)
+            - the new state
+        """
+        bs, T = x.shape
+
+        if state is None:
+            # Move the padding to the left so that the last tokens of all
+            # sequences are at the same position
+            num_paddings = T - x_lens
+            index = torch.arange(T, device=x.device).unsqueeze(0).expand(bs, T)
+            index = index - num_paddings.unsqueeze(1)
+            padding_mask = index < 0
+            x = x.gather(1, index.clamp(min=0))
+
+            cached_kv = torch.zeros(
+                self.encoder.encoder_layers,
+                0,
+                bs,
+                2 * self.encoder.d_model,
+                device=x.device,
+                dtype=self.input_embedding.weight.dtype,
+            )
+            cached_padding_mask = torch.zeros(bs, 0, device=x.device, dtype=torch.bool)
+        else:
+            cached_kv, cached_padding_mask = state
+            padding_mask = torch.zeros(bs, T, device=x.device, dtype=torch.bool)
+
+        x = self.input_embedding(x)
+        x, cached_kv, cached_padding_mask = self.encoder.streaming_forward(
+            x,
+            padding_mask=padding_mask,
+            cached_kv=cached_kv,
+            cached_padding_mask=cached_padding_mask,
+        )
 
-        bs = x.size(0)
+        last_logits = self.output_linear(x[:, -1])
 
-        state = None
-        logits = self.forward(x, x, x_lens, return_logits=True)
-        index = torch.arange(bs)
+        return last_logits.log_softmax(-1), (cached_kv, cached_padding_mask)
 
-        last_logits = logits[index, x_lens - 1, :]
+    @staticmethod
+    def stack_states(
+        state_list: List[Tuple[torch.Tensor, torch.Tensor]]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Stack the states of several batches along the batch dim, padding
+        them on the left to the same length.
 
-        return last_logits.log_softmax(-1), state
+        Args:
+          state_list:
+            A list of states returned by :meth:`score_token` or
+            :meth:`unstack_states`.
+        Returns:
+          Return the stacked state. Positions that are padding for all
+          sequences are removed.
+        """
+        max_len = max(cached_kv.size(1) for cached_kv, _ in state_list)
+        cached_kv_list = []
+        cached_padding_mask_list = []
+        for cached_kv, cached_padding_mask in state_list:
+            pad = max_len - cached_kv.size(1)
+            cached_kv_list.append(F.pad(cached_kv, (0, 0, 0, 0, pad, 0)))
+            cached_padding_mask_list.append(
+                F.pad(cached_padding_mask, (pad, 0), value=True)
+            )
+
+        cached_kv = torch.cat(cached_kv_list, dim=2)
+        cached_padding_mask = torch.cat(cached_padding_mask_list, dim=0)
+
+        num_paddings = cached_padding_mask.all(dim=0).sum().item()
+        return (
+            cached_kv[:, num_paddings:],
+            cached_padding_mask[:, num_paddings:],
+        )
+
+    @staticmethod
+    def unstack_states(
+        state: Tuple[torch.Tensor, torch.Tensor]
+    ) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        """The inverse of :meth:`stack_states`. Split the given state into
+        a list of states, one per sequence.
+        """
+        cached_kv, cached_padding_mask = state
+        return list(
+            zip(
+                cached_kv.split(1, dim=2),
+                cached_padding_mask.split(1, dim=0),
+            )
+        )
+
+    @staticmethod
+    def select_states(
+        state: Tuple[torch.Tensor, torch.Tensor], indexes: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Select the states of the given sequences, e.g., the ones kept or
+        duplicated by beam search.
+
+        Args:
+          state:
+            The state returned by :meth:`score_token`.
+          indexes:
+            A 1-D tensor containing the indexes of the sequences to select.
+            An index may appear more than once.
+        Returns:
+          Return the selected state.
+        """
+        cached_kv, cached_padding_mask = state
+        return (
+            cached_kv.index_select(2, indexes),
+            cached_padding_mask.index_select(0, indexes),
+        )
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+To run this file, do:
+
+    cd icefall
+    python ./icefall/transformer_lm/test_model.py
+"""
+
+from typing import List
+
+import torch
+
+from icefall.transformer_lm.model import TransformerLM
+
+
+def get_model(vocab_size: int = 20) -> TransformerLM:
+    model = TransformerLM(
+        vocab_size=vocab_size,
+        embedding_dim=32,
+        d_model=32,
+        dim_feedforward=64,
+        nhead=4,
+        num_layers=3,
+    )
+    model.eval()
+    return model
+
+
+def score_by_recompute(model: TransformerLM, token_list: List[List[int]]):
+    """Return the log-probs of the next token by running the full forward."""
+    x_lens = torch.tensor([len(tokens) for tokens in token_list])
+    x = torch.nn.utils.rnn.pad_sequence(
+        [torch.tensor(tokens) for tokens in token_list], batch_first=True
+    )
+    logits = model(x, x, x_lens, return_logits=True)
+    logits = logits[torch.arange(len(token_list)), x_lens - 1]
+    return logits.log_softmax(-1)
+
+
+@torch.no_grad()
+def test_score_token():
+    model = get_model()
+    token_list = [[1, 3, 5, 7], [1, 2], [1, 4, 4]]
+    x_lens = torch.tensor([len(tokens) for tokens in token_list])
+    x = torch.nn.utils.rnn.pad_sequence(
+        [torch.tensor(tokens) for tokens in token_list], batch_first=True
+    )
+
+    scores, state = model.score_token(x, x_lens)
+    expected = score_by_recompute(model, token_list)
+    max_diff = (scores - expected).abs().max()
+    assert torch.allclose(scores, expected, atol=1e-5), max_diff
+
+    # Feed new tokens one by one using the cache
+    for i in range(5):
+        new_tokens = torch.randint(1, model.vocab_size, (len(token_list),))
+        for tokens, t in zip(token_list, new_tokens.tolist()):
+            tokens.append(t)
+        scores, state = model.score_token(
+            new_tokens.unsqueeze(1),
+            x_lens,
+            state,
+        )
+        expected = score_by_recompute(model, token_list)
+        assert torch.allclose(scores, expected, atol=1e-5), (
+            i,
+            (scores - expected).abs().max(),
+        )
+
+
+@torch.no_grad()
+def test_select_and_stack_states():
+    model = get_model()
+    token_list = [[1, 3, 5, 7, 9], [1, 2], [1, 4, 4]]
+    x_lens = torch.tensor([len(tokens) for tokens in token_list])
+    x = torch.nn.utils.rnn.pad_sequence(
+        [torch.tensor(tokens) for tokens in token_list], batch_first=True
+    )
+    _, state = model.score_token(x, x_lens)
+
+    # Prune the first sequence and duplicate the last one, as beam search does
+    indexes = torch.tensor([2, 1, 2])
+    token_list = [token_list[i][:] for i in indexes.tolist()]
+    state = model.select_states(state, indexes)
+
+    new_tokens = torch.tensor([[5], [6], [7]])
+    for tokens, t in zip(token_list, new_tokens.reshape(-1).tolist()):
+        tokens.append(t)
+    scores, state = model.score_token(new_tokens, x_lens, state)
+    expected = score_by_recompute(model, token_list)
+    assert torch.allclose(scores, expected, atol=1e-5)
+
+    # Positions that are padding for all sequences are removed when stacking
+    state_list = model.unstack_states(state)
+    assert len(state_list) == 3
+    state = model.stack_states([state_list[1], state_list[0]])
+    assert state[0].size(1) == 4, state[0].shape
+    token_list = [token_list[1], token_list[0]]
+
+    new_tokens = torch.tensor([[8], [9]])
+    for tokens, t in zip(token_list, new_tokens.reshape(-1).tolist()):
+        tokens.append(t)
+    scores, state = model.score_token(new_tokens, x_lens, state)
+    expected = score_by_recompute(model, token_list)
+    assert torch.allclose(scores, expected, atol=1e-5)
+
+
+def main():
+    test_score_token()
+    test_select_and_stack_states()
+
+
+if __name__ == "__main__":
+    torch.manual_seed(20221017)
+    main()
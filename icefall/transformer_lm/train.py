@@ -133,6 +133,16 @@ def get_parser():
         help="LM validation data",
     )
 
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=2,
+        help="""Number of dataloader workers. The LM data is converted to
+        a memory-mapped file next to it on first use, which is shared by
+        the workers.
+        """,
+    )
+
     parser.add_argument(
         "--vocab-size",
         type=int,
@@ -549,6 +559,7 @@ def run(rank, world_size, args):
         filename=params.lm_data,
         is_distributed=is_distributed,
         params=params,
+        num_workers=params.num_workers,
     )
 
     logging.info(f"Loading LM validation data from {params.lm_data_valid}")
@@ -556,6 +567,7 @@ def run(rank, world_size, args):
         filename=params.lm_data_valid,
         is_distributed=is_distributed,
         params=params,
+        num_workers=params.num_workers,
     )
 
     # Note: No learning rate scheduler is used here
@@ -16,11 +16,25 @@
 # limitations under the License.
 
 
+import copy
+
 import pytest
 import torch
 import torch.nn as nn
 
-from icefall.checkpoint import average_checkpoints, load_checkpoint, save_checkpoint
+from icefall.checkpoint import (
+    AsyncCheckpointWriter,
+    average_checkpoints,
+    average_state_dict,
+    find_checkpoints,
+    get_model_only_filename,
+    load_checkpoint,
+    remove_checkpoints,
+    save_checkpoint,
+    save_checkpoint_with_global_batch_idx,
+    update_averaged_model,
+)
+from icefall.utils import AttributeDict
 
 
 @pytest.fixture
@@ -61,3 +75,118 @@ def test_average_checkpoints(checkpoints1, checkpoints2):
     state_dict = average_checkpoints([checkpoints1, checkpoints2])
     assert torch.allclose(state_dict["p1"], torch.Tensor([30, 25.0]))
     assert torch.allclose(state_dict["p2"], torch.tensor([5, 51]))
+
+
+def test_average_checkpoints_model_only(checkpoints1, checkpoints2, tmp_path):
+    # The model-only copies are used
+    for f in [checkpoints1, checkpoints2]:
+        model_only = get_model_only_filename(f)
+        assert model_only.is_file()
+        checkpoint = torch.load(model_only)
+        assert "optimizer" not in checkpoint
+        checkpoint["model"]["p1"] *= 2
+        torch.save(checkpoint, model_only)
+
+    state_dict = average_checkpoints([checkpoints1, checkpoints2])
+    assert torch.allclose(state_dict["p1"], torch.Tensor([60, 50.0]))
+    assert state_dict["p1"].dtype == torch.float32
+    assert torch.allclose(state_dict["p2"], torch.tensor([5, 51]))
+
+
+def test_average_checkpoints_cache(checkpoints1, checkpoints2, tmp_path):
+    cache_dir = tmp_path / "cache"
+    state_dict = average_checkpoints(
+        [checkpoints1, checkpoints2],
+        cache_dir=cache_dir,
+    )
+    assert len(list(cache_dir.glob("*.pt"))) == 1
+
+    # Modify the cached result to check that it is reused
+    cache_filename = next(cache_dir.glob("*.pt"))
+    state_dict["p1"] += 1
+    torch.save(state_dict, cache_filename)
+    state_dict = average_checkpoints(
+        [checkpoints1, checkpoints2],
+        cache_dir=cache_dir,
+    )
+    assert torch.allclose(state_dict["p1"], torch.Tensor([31, 26.0]))
+
+
+def test_async_checkpoint_writer(tmp_path):
+    m = nn.Module()
+    m.p1 = nn.Parameter(torch.tensor([1.0, 2.0]))
+    m.l1 = nn.Linear(2, 2)
+    m.l2 = nn.Linear(2, 2)
+    m.l2.weight = m.l1.weight
+
+    writer = AsyncCheckpointWriter()
+    params = {"batch_idx_train": 0, "history": [1]}
+    for i in range(1, 5):
+        params["batch_idx_train"] = i
+        save_checkpoint_with_global_batch_idx(
+            out_dir=tmp_path,
+            global_batch_idx=i,
+            model=m,
+            params=params,
+            writer=writer,
+        )
+        remove_checkpoints(out_dir=tmp_path, topk=2, writer=writer)
+        # Changes after saving are not in the checkpoint
+        with torch.no_grad():
+            m.p1 += 1
+        params["history"].append(i)
+    writer.close()
+
+    assert find_checkpoints(tmp_path) == [
+        f"{tmp_path}/checkpoint-4.pt",
+        f"{tmp_path}/checkpoint-3.pt",
+    ]
+    assert not get_model_only_filename(tmp_path / "checkpoint-2.pt").exists()
+    assert not list(tmp_path.glob("*.tmp"))
+
+    checkpoint = torch.load(tmp_path / "checkpoint-3.pt")
+    assert checkpoint["batch_idx_train"] == 3
+    assert checkpoint["history"] == [1, 1, 2]
+    assert torch.allclose(checkpoint["model"]["p1"], torch.tensor([3.0, 4.0]))
+    # Shared parameters are still shared
+    state_dict = checkpoint["model"]
+    data_ptr = state_dict["l1.weight"].data_ptr()
+    assert state_dict["l2.weight"].data_ptr() == data_ptr
+
+
+def test_update_averaged_model():
+    torch.manual_seed(20221017)
+    model = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4), nn.Linear(4, 3))
+    model[2].weight = nn.Parameter(torch.randn(3, 4))
+    model_avg = copy.deepcopy(model).to(torch.float64)
+    expected = copy.deepcopy(model_avg).state_dict()
+
+    params = AttributeDict({"average_period": 2})
+    for batch_idx_train in [2, 4, 6]:
+        params.batch_idx_train = batch_idx_train
+        with torch.no_grad():
+            for p in model.parameters():
+                p.add_(torch.randn_like(p))
+        # Buffers assigned to new tensors are used in later updates
+        model[1].running_mean = model[1].running_mean + 1
+        model[1].num_batches_tracked += 1
+
+        update_averaged_model(
+            params=params,
+            model_cur=model,
+            model_avg=model_avg,
+        )
+
+        weight_cur = params.average_period / params.batch_idx_train
+        average_state_dict(
+            state_dict_1=expected,
+            state_dict_2=model.state_dict(),
+            weight_1=1 - weight_cur,
+            weight_2=weight_cur,
+        )
+
+    state_dict = model_avg.state_dict()
+    for k, v in expected.items():
+        assert state_dict[k].dtype == v.dtype, k
+        assert torch.allclose(state_dict[k], v), k
+    assert state_dict["1.num_batches_tracked"] == 0
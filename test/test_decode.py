@@ -23,8 +23,17 @@ You can run this file in one of the two ways:
 """
 
 import k2
+import torch
 
-from icefall.decode import Nbest
+from icefall.decode import (
+    IntersectionSizePredictor,
+    Nbest,
+    _compute_attention_scores,
+    _get_best_path_indexes,
+    _get_kbest_paths,
+    rescore_with_whole_lattice,
+)
+from icefall.utils import get_texts
 
 
 def test_nbest_from_lattice():
@@ -61,3 +70,239 @@ def test_nbest_from_lattice():
     argmax = tot_scores.argmax()
     best_path = k2.index_fsa(nbest2.fsa, argmax)
     print(best_path[0])
+
+
+def test_nbest_from_lattice_kbest():
+    s = """
+        0 1 1 10 0.1
+        0 1 5 10 0.11
+        0 1 2 20 0.2
+        1 2 3 30 0.3
+        1 2 4 40 0.4
+        2 3 -1 -1 0.5
+        3
+    """
+    lattice = k2.Fsa.from_str(s, acceptor=False)
+    lattice = k2.Fsa.from_fsas([lattice, lattice])
+
+    nbest = Nbest.from_lattice(
+        lattice=lattice,
+        num_paths=3,
+        exact_kbest=True,
+    )
+    # The 4 distinct word sequences are 20->40 (1.1), 20->30 (1.0),
+    # 10->40 (1.01) and 10->30 (0.91). The score of 10 is from the
+    # better one of its two arcs.
+    assert nbest.shape.row_splits(1).tolist() == [0, 3, 6]
+    word_seqs = get_texts(nbest.fsa)
+    assert word_seqs == [[20, 40], [10, 40], [20, 30]] * 2, word_seqs
+
+    nbest = nbest.intersect(lattice)
+    tot_scores = nbest.tot_scores().values
+    expected = torch.tensor([1.1, 1.01, 1.0] * 2, dtype=tot_scores.dtype)
+    assert torch.allclose(tot_scores, expected), tot_scores
+
+
+def test_nbest_from_lattice_kbest_not_connected():
+    # State 3 cannot reach the final state
+    s = """
+        0 1 1 10 0.15
+        0 3 7 70 5.0
+        0 1 2 20 0.2
+        1 2 3 30 0.3
+        1 2 4 40 0.4
+        2 4 -1 -1 0.5
+        4
+    """
+    lattice = k2.Fsa.from_str(s, acceptor=False)
+
+    # It has no path from the start state to the final state
+    s = """
+        0 1 1 10 0.1
+        2
+    """
+    no_path = k2.Fsa.from_str(s, acceptor=False)
+    lattice = k2.Fsa.from_fsas([lattice, no_path, lattice])
+
+    nbest = Nbest.from_lattice(
+        lattice=lattice,
+        num_paths=3,
+        exact_kbest=True,
+    )
+    assert nbest.shape.row_splits(1).tolist() == [0, 3, 3, 6]
+    word_seqs = get_texts(nbest.fsa)
+    expected = [[20, 40], [10, 40], [20, 30]]
+    assert word_seqs == expected * 2, word_seqs
+
+
+def test_get_kbest_paths():
+    # Two graphs. States 0-3 belong to the first one and 4-5 to the second
+    src_states = torch.tensor([0, 0, 1, 0, 2, 1, 4, 4])
+    dest_states = torch.tensor([1, 2, 2, 3, 3, 3, 5, 5])
+    scores = torch.tensor([1.0, 0.5, 1.0, 0.1, 0.0, 0.2, 0.3, 0.4])
+    num_paths, path_arcs, path_scores = _get_kbest_paths(
+        src_states=src_states,
+        dest_states=dest_states,
+        scores=scores,
+        start_states=torch.tensor([0, 4]),
+        final_states=torch.tensor([3, 5]),
+        num_states=6,
+        k=3,
+    )
+    assert num_paths.tolist() == [3, 2], num_paths
+    # Paths of the first graph: 0->1->2->3 (2.0), 0->1->3 (1.2),
+    # 0->2->3 (0.5) and 0->3 (0.1)
+    assert path_arcs.tolist() == [
+        [0, 2, 4],
+        [-1, 0, 5],
+        [-1, 1, 4],
+        [-1, -1, 7],
+        [-1, -1, 6],
+    ], path_arcs
+    expected = torch.tensor([2.0, 1.2, 0.5, 0.4, 0.3], dtype=torch.float64)
+    assert torch.allclose(path_scores, expected), path_scores
+
+    # Only the best path of each label sequence is kept. 0 is not a label.
+    num_paths, path_arcs, path_scores = _get_kbest_paths(
+        src_states=src_states,
+        dest_states=dest_states,
+        scores=scores,
+        start_states=torch.tensor([0, 4]),
+        final_states=torch.tensor([3, 5]),
+        num_states=6,
+        k=3,
+        labels=torch.tensor([1, 1, 0, 2, 2, 2, 3, 3]),
+    )
+    assert num_paths.tolist() == [2, 1], num_paths
+    assert path_arcs.tolist() == [
+        [0, 2, 4],
+        [-1, -1, 3],
+        [-1, -1, 7],
+    ], path_arcs
+    expected = torch.tensor([2.0, 0.1, 0.4], dtype=torch.float64)
+    assert torch.allclose(path_scores, expected), path_scores
+
+
+def get_lattice_and_G():
+    s = """
+        0 1 1 10 0.1
+        0 1 5 20 0.11
+        1 2 3 30 0.3
+        1 2 4 40 0.4
+        2 3 -1 -1 0.5
+        3
+    """
+    lattice = k2.Fsa.from_str(s, acceptor=False)
+    lattice = k2.Fsa.from_fsas([lattice, lattice])
+    lattice.lm_scores = torch.zeros_like(lattice.scores)
+
+    s = """
+        0 0 10 -1.0
+        0 0 20 -0.2
+        0 0 30 -0.5
+        0 0 40 -1.5
+        0 1 -1 0
+        1
+    """
+    G = k2.Fsa.from_str(s, acceptor=True)
+    G = k2.arc_sort(k2.add_epsilon_self_loops(G))
+    G.lm_scores = G.scores.clone()
+    G = k2.Fsa.from_fsas([G])
+    return lattice, G
+
+
+def test_rescore_with_whole_lattice_max_arcs():
+    lm_scale_list = [0.1, 0.5, 1.0, 2.0]
+
+    lattice, G = get_lattice_and_G()
+    expected = rescore_with_whole_lattice(
+        lattice=lattice,
+        G_with_epsilon_loops=G,
+        lm_scale_list=lm_scale_list,
+    )
+
+    # max_arcs=20 processes 2 LM scales together
+    for max_arcs in [20, 1000]:
+        lattice, G = get_lattice_and_G()
+        ans = rescore_with_whole_lattice(
+            lattice=lattice,
+            G_with_epsilon_loops=G,
+            lm_scale_list=lm_scale_list,
+            max_arcs=max_arcs,
+        )
+        assert ans.keys() == expected.keys()
+        for key in ans:
+            assert ans[key].shape[0] == 2
+            aux_labels = expected[key].aux_labels
+            assert torch.equal(ans[key].aux_labels, aux_labels), key
+
+
+class ToyAttentionModel(torch.nn.Module):
+    """The nll of each token depends on the token, its position and the
+    memory of its utterance."""
+
+    def decoder_nll(
+        self, memory, memory_key_padding_mask, token_ids, sos_id, eos_id
+    ) -> torch.Tensor:
+        assert memory.shape[1] == len(token_ids)
+        max_len = max(len(t) for t in token_ids) + 1
+        nll = torch.zeros(len(token_ids), max_len)
+        for i, t in enumerate(token_ids):
+            for j, token in enumerate(t + [eos_id]):
+                nll[i, j] = (j + 1) * token * memory[:, i].sum()
+        if memory_key_padding_mask is not None:
+            assert memory_key_padding_mask.shape[0] == len(token_ids)
+        return nll
+
+
+def test_compute_attention_scores():
+    memory = torch.rand(5, 3, 2)
+    memory_key_padding_mask = torch.zeros(3, 5, dtype=torch.bool)
+    token_ids = [[1, 2], [3], [4, 5, 6, 7], [], [8, 9, 10]]
+    path_to_utt_map = torch.tensor([0, 0, 1, 1, 2])
+
+    expected = []
+    for t, utt in zip(token_ids, path_to_utt_map.tolist()):
+        total = memory[:, utt].sum()
+        nll = [(j + 1) * token * total for j, token in enumerate(t + [1])]
+        expected.append(-sum(nll))
+    expected = torch.tensor(expected)
+
+    for max_tokens in [1, 5, 8, 100]:
+        scores = _compute_attention_scores(
+            model=ToyAttentionModel(),
+            memory=memory,
+            memory_key_padding_mask=memory_key_padding_mask,
+            token_ids=token_ids,
+            path_to_utt_map=path_to_utt_map,
+            sos_id=1,
+            eos_id=1,
+            max_tokens=max_tokens,
+        )
+        assert torch.allclose(scores, expected), (max_tokens, scores, expected)
+
+
+def test_get_best_path_indexes():
+    tot_scores = torch.tensor(
+        [
+            [1.0, 3.0, 2.0, 5.0, 5.0],
+            [4.0, 3.0, 2.0, 1.0, 6.0],
+        ]
+    )
+    # Utterance 1 has no paths
+    path_to_utt_map = torch.tensor([0, 0, 0, 2, 2])
+    best = _get_best_path_indexes(tot_scores, path_to_utt_map, num_utts=3)
+    assert best.tolist() == [[1, -1, 3], [0, -1, 4]], best
+
+
+def test_intersection_size_predictor():
+    predictor = IntersectionSizePredictor(ratio=10.0, decay=0.5)
+    assert predictor.predict(100) == 1000
+
+    # Increases are followed immediately
+    predictor.update(num_arcs_in=100, num_arcs_out=2000)
+    assert predictor.ratio == 20
+
+    # Decreases are followed slowly
+    predictor.update(num_arcs_in=100, num_arcs_out=1000)
+    assert predictor.ratio == 15
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+You can run this file in one of the two ways:
+
+    (1) cd icefall; pytest test/test_diagnostics.py
+    (2) cd icefall; ./test/test_diagnostics.py
+"""
+
+import json
+import tempfile
+from pathlib import Path
+
+import torch
+from torch import nn
+
+from icefall.diagnostics import SampledModelDiagnostic, get_sampled_tensor_stats
+
+
+def test_get_sampled_tensor_stats():
+    x = torch.tensor([1.0, -2.0, 3.0, float("inf")])
+    count, s, a, sq, positive, nonfinite, max_, min_ = get_sampled_tensor_stats(
+        x, max_elements=10
+    ).tolist()
+    assert count == 4
+    assert s == 2 and a == 6 and sq == 14
+    assert positive == 2 and nonfinite == 1
+    assert max_ == 3 and min_ == -2
+
+    x = torch.randn(1000, 1000)
+    stats = get_sampled_tensor_stats(x, max_elements=4096)
+    assert stats[0] == 4096
+    # rms of the subsample is close to 1
+    assert abs((stats[3] / stats[0]).sqrt() - 1) < 0.1
+
+
+def test_sampled_model_diagnostic():
+    model = nn.Sequential(nn.Linear(10, 20), nn.ReLU(), nn.Linear(20, 5))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = Path(tmp_dir) / "diagnostics.jsonl"
+        diagnostic = SampledModelDiagnostic(
+            model,
+            step_fraction=1.0,
+            module_fraction=1.0,
+            flush_interval=5,
+            filename=filename,
+        )
+        for step in range(12):
+            diagnostic.step(step)
+            model(torch.randn(8, 10)).sum().backward()
+        diagnostic.close()
+
+        assert not diagnostic.handles
+        records = [json.loads(line) for line in open(filename)]
+
+    steps = sorted(set(r["step"] for r in records))
+    assert steps == [5, 10, 11], steps
+    names = set(r["name"] for r in records)
+    assert "0.output" in names
+    assert "2.grad" in names
+    assert "0.weight.param_grad" in names
+    assert "2.bias.param_value" in names
+    for r in records:
+        if r["name"] == "1.output":
+            # output of ReLU
+            assert r["min"] >= 0
+
+
+def main():
+    test_get_sampled_tensor_stats()
+    test_sampled_model_diagnostic()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+You can run this file in one of the two ways:
+
+    (1) cd icefall; pytest test/test_error_stats.py
+    (2) cd icefall; ./test/test_error_stats.py
+"""
+
+import io
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from icefall.error_stats import ErrorStats
+from icefall.utils import write_error_stats, write_error_stats_with_timestamps
+
+
+def test_write_error_stats():
+    results = [
+        (
+            "utt1",
+            "THE CAT SAT ON THE MAT".split(),
+            "THE CAT SAT ON A MAT".split(),
+        ),
+        (
+            "utt2",
+            "FOR THE FIRST DAY SIR I THINK".split(),
+            "FOR THE DAY I THINK".split(),
+        ),
+        ("utt3", "HELLO".split(), "HELLO HELLO WORLD".split()),
+    ]
+    f = io.StringIO()
+    wer = write_error_stats(f, "test", results, enable_log=False)
+    assert wer == 35.71, wer
+
+    expected = [
+        "%WER = 35.71",
+        "Errors: 2 insertions, 2 deletions, 1 substitutions, "
+        "over 14 reference words (11 correct)",
+        "Search below for sections starting with PER-UTT DETAILS:, "
+        "SUBSTITUTIONS:, DELETIONS:, INSERTIONS:, PER-WORD STATS:",
+        "",
+        "PER-UTT DETAILS: corr or (ref->hyp)  ",
+        "utt1:\tTHE CAT SAT ON (THE->A) MAT",
+        "utt2:\tFOR THE (FIRST->*) DAY (SIR->*) I THINK",
+        "utt3:\tHELLO (*->HELLO WORLD)",
+        "",
+        "SUBSTITUTIONS: count ref -> hyp",
+        "1   THE -> A",
+        "",
+        "DELETIONS: count ref",
+        "1   SIR",
+        "1   FIRST",
+        "",
+        "INSERTIONS: count hyp",
+        "1   WORLD",
+        "1   HELLO",
+        "",
+        "PER-WORD STATS: word  corr tot_errs count_in_ref count_in_hyp",
+        "WORLD   0 1 0 1",
+        "THE   2 1 3 2",
+        "SIR   0 1 1 0",
+        "HELLO   1 1 1 2",
+        "FIRST   0 1 1 0",
+        "A   0 1 0 1",
+        "THINK   1 0 1 1",
+        "SAT   1 0 1 1",
+        "ON   1 0 1 1",
+        "MAT   1 0 1 1",
+        "I   1 0 1 1",
+        "FOR   1 0 1 1",
+        "DAY   1 0 1 1",
+        "CAT   1 0 1 1",
+        "",
+    ]
+    expected = "\n".join(expected)
+    assert f.getvalue() == expected, f.getvalue()
+
+    f2 = io.StringIO()
+    ans = write_error_stats(
+        f2,
+        "test",
+        results,
+        enable_log=False,
+        num_jobs=2,
+    )
+    assert ans == wer
+    assert f2.getvalue() == expected
+
+
+def get_random_results(num_utts: int):
+    random.seed(20221017)
+    vocab = [f"W{i}" for i in range(50)]
+    results = []
+    for i in range(num_utts):
+        ref = random.choices(vocab, k=random.randint(1, 10))
+        hyp = []
+        for w in ref:
+            hyp.append(w if random.random() < 0.8 else random.choice(vocab))
+        hyp = hyp[: random.randint(0, len(hyp))] + random.choices(vocab, k=2)
+        time_ref = [random.random() for _ in ref]
+        time_hyp = [random.random() for _ in hyp]
+        results.append((f"utt-{i}", ref, hyp, time_ref, time_hyp))
+    return results
+
+
+def test_error_stats_streaming():
+    results = get_random_results(500)
+
+    f = io.StringIO()
+    expected = write_error_stats_with_timestamps(
+        f, "test", sorted(results), enable_log=False
+    )
+
+    shuffled = list(results)
+    random.shuffle(shuffled)
+    with ProcessPoolExecutor(2) as executor:
+        stats = ErrorStats(
+            with_timestamps=True,
+            executor=executor,
+            chunk_size=64,
+        )
+        for i in range(0, len(shuffled), 30):
+            stats.add(shuffled[i : i + 30])
+        f2 = io.StringIO()
+        ans = stats.write(f2, "test", enable_log=False, sort=True)
+
+    assert ans == expected, (ans, expected)
+    assert f2.getvalue() == f.getvalue()
+
+
+def main():
+    test_write_error_stats()
+    test_error_stats_streaming()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+You can run this file in one of the two ways:
+
+    (1) cd icefall; pytest test/test_fsa_cache.py
+    (2) cd icefall; ./test/test_fsa_cache.py
+"""
+
+import tempfile
+from typing import List
+
+import k2
+
+from icefall.fsa_cache import FsaCache
+
+
+def compile_with_cache(cache: FsaCache, piece_ids: List[List[int]]) -> k2.Fsa:
+    keys = [",".join(map(str, ids)) for ids in piece_ids]
+    return cache.compile(
+        keys, lambda indexes: k2.ctc_graph([piece_ids[i] for i in indexes])
+    )
+
+
+def assert_same(a: k2.Fsa, b: k2.Fsa):
+    assert a.shape[0] == b.shape[0], (a.shape, b.shape)
+    for i in range(a.shape[0]):
+        assert str(a[i]) == str(b[i]), i
+
+
+def test_fsa_cache():
+    piece_ids = [[1, 2, 3], [4, 5], [1, 2, 3], [6]]
+    expected = k2.ctc_graph(piece_ids)
+
+    cache = FsaCache(max_size=2)
+    assert_same(compile_with_cache(cache, piece_ids), expected)
+    assert cache.num_misses == 4
+    assert len(cache.fsas) == 2
+
+    # [6] and [1, 2, 3] are in the cache
+    assert_same(
+        compile_with_cache(cache, piece_ids[2:]),
+        k2.ctc_graph(piece_ids[2:]),
+    )
+    assert cache.num_hits == 2
+
+
+def test_fsa_cache_dir():
+    piece_ids = [[1, 2, 3], [4, 5], [6]]
+    expected = k2.ctc_graph(piece_ids)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FsaCache(cache_dir=cache_dir)
+        compile_with_cache(cache, piece_ids)
+        cache.flush()
+
+        cache = FsaCache(cache_dir=cache_dir)
+        assert len(cache.stored) == 3
+        assert_same(compile_with_cache(cache, piece_ids), expected)
+        assert cache.num_misses == 0
+
+
+def main():
+    test_fsa_cache()
+    test_fsa_cache_dir()
+
+
+if __name__ == "__main__":
+    main()
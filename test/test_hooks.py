@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+You can run this file in one of the two ways:
+
+    (1) cd icefall; pytest test/test_hooks.py
+    (2) cd icefall; ./test/test_hooks.py
+"""
+
+import torch
+from torch import nn
+
+from icefall.hooks import InfChecker
+
+
+class Scale(nn.Module):
+    def __init__(self, scale: float):
+        super().__init__()
+        self.scale = scale
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x * self.scale
+
+
+class Joiner(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.output_linear = nn.Linear(10, 5)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.output_linear(x)
+
+
+class Model(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.joiner = Joiner()
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.joiner(x)
+
+
+def test_inf_checker():
+    model = nn.Sequential(nn.Linear(10, 20), Scale(1.0), nn.Linear(20, 5))
+    inf_checker = InfChecker(model)
+
+    model(torch.randn(3, 10)).sum().backward()
+    # 4 outputs, 4 output gradients and 4 parameter gradients
+    assert len(inf_checker.flags) == 12
+    inf_checker.check()
+    assert len(inf_checker.flags) == 0
+
+    # The first module whose output is not finite is reported
+    model[1].scale = float("inf")
+    model(torch.randn(3, 10)).sum().backward()
+    try:
+        inf_checker.check()
+        assert False, "It should raise"
+    except ValueError as e:
+        assert "1.output" in str(e), str(e)
+
+    # Only the gradients are not finite
+    model[1].scale = 1.0
+    (model(torch.randn(3, 10)).sum() * float("inf")).backward()
+    inf_checker.check()
+
+    # Nothing is recorded in eval mode
+    model.eval()
+    with torch.no_grad():
+        model(torch.randn(3, 10))
+    assert len(inf_checker.flags) == 0
+
+
+def test_inf_checker_output_in_name():
+    model = Model()
+    inf_checker = InfChecker(model)
+
+    # The gradients of joiner.output_linear are not outputs
+    (model(torch.randn(3, 10)).sum() * float("inf")).backward()
+    inf_checker.check()
+
+    with torch.no_grad():
+        model.joiner.output_linear.bias.fill_(float("inf"))
+    model(torch.randn(3, 10)).sum().backward()
+    try:
+        inf_checker.check()
+        assert False, "It should raise"
+    except ValueError as e:
+        assert "joiner.output_linear.output" in str(e), str(e)
+
+
+def main():
+    test_inf_checker()
+    test_inf_checker_output_in_name()
+
+
+if __name__ == "__main__":
+    main()
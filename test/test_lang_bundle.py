@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright    2026  The icefall authors
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+You can run this file in one of the two ways:
+
+    (1) cd icefall; pytest test/test_lang_bundle.py
+    (2) cd icefall; ./test/test_lang_bundle.py
+"""
+
+import tempfile
+from pathlib import Path
+
+import k2
+import numpy as np
+
+from icefall.lang_bundle import (
+    MappedSymbolTable,
+    load_lang_bundle,
+    save_lang_bundle,
+)
+
+
+def test_lang_bundle():
+    arrays = {
+        "a": np.arange(10, dtype=np.int32).reshape(2, 5),
+        "b": np.array([0.5, 1.5], dtype=np.float32),
+        "c": np.array([b"hello", b"k2"]),
+        "empty": np.zeros(0, dtype=np.int64),
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = Path(tmp_dir) / "lang.bundle"
+        save_lang_bundle(filename, arrays, metadata={"foo": 1})
+        loaded, metadata = load_lang_bundle(filename)
+
+        assert metadata == {"foo": 1}
+        assert loaded.keys() == arrays.keys()
+        for name, array in arrays.items():
+            assert loaded[name].dtype == array.dtype, name
+            assert np.array_equal(loaded[name], array), name
+            assert not loaded[name].flags.writeable, name
+
+        with open(filename, "wb") as f:
+            f.write(b"not a bundle")
+        assert load_lang_bundle(filename) is None
+
+
+def test_mapped_symbol_table():
+    table = k2.SymbolTable.from_str(
+        """
+        <eps> 0
+        HELLO 1
+        k2 2
+        icefall 5
+        你好 3
+        """
+    )
+    mapped = MappedSymbolTable.from_symbol_table(table)
+    assert len(mapped) == 5
+    for i in table.ids:
+        assert mapped[i] == table[i]
+        assert mapped[table[i]] == i
+    assert "HELLO" in mapped
+    assert "HELL" not in mapped
+    assert "HELLO2" not in mapped
+
+    symbols = ["k2", "foo", "icefall", "你好", "zzz", "<eps>"]
+    ids = mapped.to_ids(symbols, default=-2)
+    assert ids.tolist() == [2, -2, 5, 3, -2, 0]
+
+    table2 = mapped.to_symbol_table()
+    assert sorted(table2.ids) == sorted(table.ids)
+    for i in table.ids:
+        assert table2[i] == table[i]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = Path(tmp_dir) / "lang.bundle"
+        save_lang_bundle(filename, mapped.to_arrays("words"))
+        arrays, _ = load_lang_bundle(filename)
+        mapped2 = MappedSymbolTable.from_arrays(arrays, "words")
+        assert mapped2.to_ids(["icefall", "foo"]).tolist() == [5, -1]
+
+
+def main():
+    test_lang_bundle()
+    test_mapped_symbol_table()
+
+
+if __name__ == "__main__":
+    main()
@@ -131,10 +131,48 @@ def uniq_lexicon_test():
         assert piece_id == sp.encode(word)
 
 
+def lang_bundle_test():
+    # The lang bundle is written only if the caller asks for it
+    UniqLexicon(lang_dir=TMP_DIR, uniq_filename="lexicon.txt")
+    assert not (Path(TMP_DIR) / "lang.bundle").exists()
+
+    # The first one creates the lang bundle and the second one loads it
+    lexicon = UniqLexicon(
+        lang_dir=TMP_DIR,
+        uniq_filename="lexicon.txt",
+        save_bundle=True,
+    )
+    assert (Path(TMP_DIR) / "lang.bundle").is_file()
+    bundled = UniqLexicon(lang_dir=TMP_DIR, uniq_filename="lexicon.txt")
+    assert bundled._word_table is None
+
+    texts = ["cat cat", "at ct", "foo at tac cat", ""]
+    word_ids = lexicon.texts_to_word_ids(texts)
+    assert bundled.texts_to_word_ids(texts) == word_ids
+    assert (
+        bundled.texts_to_token_ids(texts).tolist()
+        == lexicon.texts_to_token_ids(texts).tolist()
+    )
+    assert bundled.ragged_lexicon.tolist() == lexicon.ragged_lexicon.tolist()
+    assert str(bundled.L_inv) == str(lexicon.L_inv)
+    assert bundled.tokens == lexicon.tokens
+    for i in lexicon.word_table.ids:
+        assert bundled.word_table[i] == lexicon.word_table[i]
+
+    not_bundled = UniqLexicon(
+        lang_dir=TMP_DIR,
+        uniq_filename="lexicon.txt",
+        bundle_filename=None,
+    )
+    assert not_bundled._word_table is not None
+    assert not_bundled.texts_to_word_ids(texts) == word_ids
+
+
 def test_main():
     generate_test_data()
 
     uniq_lexicon_test()
+    lang_bundle_test()
 
     if USING_PYTEST:
         delete_test_data()
@@ -30,7 +30,9 @@ from pathlib import Path
 
 import k2
 import sentencepiece as spm
+import torch
 
+from icefall.mmi import LFMMILoss
 from icefall.mmi_graph_compiler import MmiTrainingGraphCompiler
 
 TMP_DIR = "/tmp/icefall-test-mmi-graph-compiler"
@@ -179,10 +181,54 @@ def mmi_graph_compiler_test():
     assert token_ids == expected_token_ids
 
 
+def mmi_loss_test():
+    graph_compiler = MmiTrainingGraphCompiler(
+        lang_dir=TMP_DIR, uniq_filename="lexicon.txt"
+    )
+    texts = ["cat at ct", "at ta", "cat tac"]
+    num_classes = max(graph_compiler.lexicon.tokens) + 1
+
+    torch.manual_seed(20221017)
+    nnet_output = torch.randn(3, 30, num_classes).log_softmax(dim=-1)
+    # (sequence_index, start_frame, num_frames), sorted by num_frames
+    supervision_segments = torch.tensor(
+        [[0, 0, 30], [1, 2, 25], [2, 0, 20]], dtype=torch.int32
+    )
+
+    losses = []
+    grads = []
+    # exact, exact with a fused intersection, and pruned
+    for use_pruned_intersect, use_fused_intersect in [
+        (False, False),
+        (False, True),
+        (True, False),
+    ]:
+        x = nnet_output.detach().clone().requires_grad_(True)
+        loss_fn = LFMMILoss(
+            graph_compiler=graph_compiler,
+            use_pruned_intersect=use_pruned_intersect,
+            beam_size=10.0,
+            use_fused_intersect=use_fused_intersect,
+        )
+        dense_fsa_vec = k2.DenseFsaVec(x, supervision_segments)
+        loss = loss_fn(dense_fsa_vec=dense_fsa_vec, texts=texts)
+        loss.backward()
+        losses.append(loss.detach())
+        grads.append(x.grad)
+
+    assert torch.allclose(losses[0], losses[1]), losses
+    assert torch.allclose(grads[0], grads[1], atol=1e-5)
+
+    # The den graph is tiny, so there is almost nothing to prune
+    assert torch.allclose(losses[0], losses[2], rtol=1e-3), losses
+    assert torch.allclose(grads[0], grads[2], atol=1e-3)
+
+
 def test_main():
     generate_test_data()
 
     mmi_graph_compiler_test()
+    mmi_loss_test()
 
     if USING_PYTEST:
         delete_test_data()
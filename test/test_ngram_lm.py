@@ -15,7 +15,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 import graphviz
+import numpy as np
 
 from icefall import is_module_available
 
@@ -49,9 +52,100 @@ def generate_fst(filename: str):
     source.render(outfile=f"{filename}.svg")
 
 
+def get_next_state_and_cost_from_fst(
+    fst,
+    backoff_id: int,
+    state: int,
+    label: int,
+):
+    """A reference implementation of NgramLm.get_next_state_and_cost()
+    that reads arcs from the FST directly."""
+
+    def find_arc(state: int, label: int):
+        for arc in kaldifst.ArcIterator(fst, state):
+            if arc.ilabel == label:
+                return arc.nextstate, arc.weight.value
+        return None, None
+
+    states = [state]
+    costs = [0]
+    cost = 0
+    while True:
+        state, c = find_arc(state, backoff_id)
+        if state is None:
+            break
+        cost += c
+        states.append(state)
+        costs.append(cost)
+
+    next_states = []
+    next_costs = []
+    for s, c in zip(states, costs):
+        ns, nc = find_arc(s, label)
+        if ns:
+            next_states.append(ns)
+            next_costs.append(c + nc)
+    return next_states, next_costs
+
+
+def _check_compiled_ngram_lm(filename: str):
+    compiled_filename = f"{filename}.npz"
+    if os.path.isfile(compiled_filename):
+        os.remove(compiled_filename)
+
+    ngram_lm = NgramLm(
+        filename,
+        backoff_id=3,
+        is_binary=True,
+        compiled_filename=compiled_filename,
+    )
+    assert ngram_lm.lm is not None
+    assert os.path.isfile(compiled_filename)
+
+    # Load the arrays saved above; kaldifst is not used this time
+    compiled_lm = NgramLm(
+        filename,
+        backoff_id=3,
+        is_binary=True,
+        compiled_filename=compiled_filename,
+    )
+    assert compiled_lm.lm is None
+    assert compiled_lm.num_states == ngram_lm.lm.num_states
+
+    states = []
+    labels = []
+    for state in range(ngram_lm.num_states):
+        for label in range(6):
+            expected = get_next_state_and_cost_from_fst(
+                ngram_lm.lm, backoff_id=3, state=state, label=label
+            )
+            for lm in [ngram_lm, compiled_lm]:
+                next_states, next_costs = lm.get_next_state_and_cost(
+                    state=state,
+                    label=label,
+                )
+                assert next_states == expected[0], (state, label)
+                assert np.allclose(next_costs, expected[1]), (state, label)
+            states.append(state)
+            labels.append(label)
+
+    indexes, next_states, costs = compiled_lm.get_next_states_and_costs(
+        np.array(states), np.array(labels)
+    )
+    for i, (state, label) in enumerate(zip(states, labels)):
+        expected_states, expected_costs = ngram_lm.get_next_state_and_cost(
+            state=state, label=label
+        )
+        assert next_states[indexes == i].tolist() == expected_states
+        assert np.allclose(costs[indexes == i], expected_costs)
+
+    os.remove(compiled_filename)
+
+
 def main():
     filename = "test.fst"
     generate_fst(filename)
+    _check_compiled_ngram_lm(filename)
     ngram_lm = NgramLm(filename, backoff_id=3, is_binary=True)
     for label in [1, 2, 3, 4, 5]:
         print("---label---", label)